@@ -0,0 +1,16 @@
+# Fixtures shared by the tests. Run the tests with
+#   python -m pytest -q
+import gc
+import pytest
+import py2C as i2c
+import pySimBus as sim
+
+
+@pytest.fixture
+def bus():
+    """ A fresh simulated bus registered as bus 1 (no latency). """
+    # drop devices (and switches) of earlier tests
+    gc.collect()
+    bus = sim.SimBus()
+    i2c.set_bus(1,bus)
+    return bus
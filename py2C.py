@@ -1,6 +1,19 @@
 # py2C project: a comprehensive modules for i2c interfaced devices.
 import time 
-import smbus
+import os
+import ctypes
+import weakref
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import smbus
+except ImportError:
+    # no i2c driver on this machine; buses can still be registered by hand
+    # (e.g. simulated buses, see pySimBus)
+    smbus = None
 
 # --- Some constants:
 #     device class constants
@@ -8,6 +21,9 @@ DEV_SWITCH = 0
 DEV_MEAS = 1
 DEV_ADC = 2
 DEV_DAC = 3
+#     segment kinds of combined transactions (see I2c_device.transaction)
+I2C_WR = 0
+I2C_RD = 1
 
 # --- Miscellaneous bit and byte manipulation
 
@@ -38,12 +54,12 @@ def byte2bits(num,n=8):
 def bit_grab(num,start,nbits):
     """ Returns the value of 'nbit' bits, starting at 'start' (count from LSB).
     E.g. 'bit_grab(0b10111,2,3) returns 5, aka 0b101. """
-    return (2**nbits-1)&(num>>start)
+    return ((1<<nbits)-1)&(num>>start)
 
 def bit_set(num,start,nbits,value):
     """ Returns a modified 'byte', where 'nbits' bits from 'start' have been 
     replaced by 'value' """
-    return num + (value<<start) - (num&((2**nbits-1)<<start))
+    return num + (value<<start) - (num&(((1<<nbits)-1)<<start))
 
 def twoscompl2int(num,n=8):
     """ Returns the interger value represented as two's complement in 'num',
@@ -58,6 +74,17 @@ def bytes2int(byte_array):
         out = (out << 8) + byte_array[i]
     return out
 
+def LSbMSb2ints(byte_array,n=16):
+    """ Converts a byte_array of little-endian words (LSb first) of 'n' bits
+    each into a list of integers, interpreted as two's complement. """
+    nbytes = n//8
+    out = []
+    for i in range(0,len(byte_array)-nbytes+1,nbytes):
+        word = 0
+        for b in reversed(byte_array[i:i+nbytes]): word = (word << 8) + b
+        out.append(twoscompl2int(word,n))
+    return out
+
 def int2bytes(value,nbytes=1):
     """ Returns an array of bytes [MSb, ... ,LSb] representing the integer
     'value' as one's complementy. """
@@ -65,6 +92,235 @@ def int2bytes(value,nbytes=1):
             for i in range(0,nbytes)]
 
 
+# ---------- BATCH DECODING ----------
+# NumPy versions of the conversions above and of the devices' decode paths,
+# working on a whole array of raw samples at once: 'data' is an (N,nbytes)
+# array (or anything convertible, e.g. a list of byte lists) with the bytes
+# of one sample per row, as read from the device.
+
+def _byte_rows(data,nbytes):
+    """ Returns 'data' as an (N,nbytes) uint8 array (at least 'nbytes'
+    columns; extra columns are dropped). """
+    data = np.asarray(data,dtype=np.uint8)
+    if data.ndim == 1: data = data.reshape(-1,nbytes)
+    assert data.shape[1] >= nbytes,\
+           "Need {} bytes per sample!".format(nbytes)
+    return data[:,0:nbytes]
+
+def MSbLSb2int16(data):
+    """ Batch version of twoscompl2int(MSbLSb2int(MSb,LSb),16): decodes the
+    big-endian 16-bit words in the rows of 'data' (N,2) as signed
+    integers. Returns an int16 array of length N. """
+    data = _byte_rows(data,2)
+    return ((data[:,0].astype(np.uint16) << 8) | data[:,1]).view(np.int16)
+
+def LSbMSb2int16(data):
+    """ Batch version of LSbMSb2ints: decodes the little-endian 16-bit words
+    in the rows of 'data' (N,2*k) as signed integers. Returns an (N,k)
+    int16 array. """
+    data = np.asarray(data,dtype=np.uint8)
+    if data.ndim == 1: data = data.reshape(1,-1)
+    return np.ascontiguousarray(data).view('<i2')
+
+def decode_ads(data,FS,bits=16):
+    """ Converts ADS1x15 conversion register contents (rows of two bytes,
+    MSb first) to voltages for the full scale 'FS' (V; scalar or one per
+    row). 12-bit chips (bits=12) deliver their reading left-justified; the
+    four LSbs are discarded. """
+    raw = MSbLSb2int16(data).astype(np.int32) >> (16-bits)
+    return raw*(np.asarray(FS,dtype=float)/2**(bits-1))
+
+def decode_hih(data,hum_range=100.0,hum_offset=0.0,temp_range=165.0,\
+               temp_offset=-40.0,bits=14):
+    """ Converts HIH8121 data (rows of four bytes) to (humidity,temperature,
+    status) arrays; see HIH8121.decode_data. """
+    data = _byte_rows(data,4).astype(np.int32)
+    status = data[:,0] >> 6
+    hum_raw = ((data[:,0] & 0x3f) << 8) | data[:,1]
+    temp_raw = ((data[:,2] << 8) | data[:,3]) >> 2
+    full = float(2**bits-2)
+    return (hum_range*hum_raw/full + hum_offset,\
+            temp_range*temp_raw/full + temp_offset,\
+            status)
+
+def decode_mcp9808(data):
+    """ Converts MCP9808 ambient temperature register contents (rows of two
+    bytes, MSb first; flag bits are ignored) to temperatures in C: 13-bit
+    two's complement in units of 1/16 C. """
+    data = _byte_rows(data,2).astype(np.int32)
+    raw = ((data[:,0] & 0x1f) << 8) | data[:,1]
+    raw -= (raw & 0x1000) << 1
+    return raw/16.0
+
+def decode_lsm(data,FS=1.0):
+    """ Converts LSM9DS0/LSM9DS1 output triplets (rows of six bytes; x, y, z
+    little-endian) to (N,3) outputs scaled to the full scale 'FS' (the
+    fraction of the full scale with the default FS=1). Rows of twelve
+    bytes (e.g. gyroscope and accelerometer of one FIFO slot) give (N,6)
+    outputs, with 'FS' a scalar or one value per column. """
+    return LSbMSb2int16(data)*(np.asarray(FS,dtype=float)/2**15)
+
+
+# ---------- BUS REGISTRY ----------
+# Devices refer to their bus by number; the bus is opened when the first
+# device on it is used, and the handle is shared by all devices on that bus.
+_buses = {}
+
+def get_bus(busnum=1):
+    """ Returns the shared handle of i2c bus 'busnum', opening the bus on
+    first use. """
+    try:
+        return _buses[busnum]
+    except KeyError:
+        if smbus is None:
+            raise IOError("Cannot open i2c bus {}; smbus not available!"\
+                          .format(busnum))
+        _buses[busnum] = smbus.SMBus(busnum)
+        return _buses[busnum]
+
+def set_bus(busnum,bus):
+    """ Registers the handle 'bus' (e.g. a simulated bus) for bus number
+    'busnum'. Devices on that bus number use it from now on. """
+    _buses[busnum] = bus
+
+def close_buses():
+    """ Closes all opened buses. They are re-opened when used again. """
+    for busnum in list(_buses):
+        _buses.pop(busnum).close()
+    for busnum in list(_rdwr):
+        rdwr = _rdwr.pop(busnum)
+        if rdwr is not None: rdwr.close()
+
+
+# ---------- COMBINED TRANSFERS ----------
+# i2c-dev interface of the kernel (see linux/i2c-dev.h, linux/i2c.h)
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+I2C_RDWR_MAX_MSGS = 42
+
+class _i2c_msg(ctypes.Structure):
+    _fields_ = [('addr',ctypes.c_uint16),('flags',ctypes.c_uint16),\
+                ('len',ctypes.c_uint16),('buf',ctypes.POINTER(ctypes.c_uint8))]
+
+class _i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [('msgs',ctypes.POINTER(_i2c_msg)),('nmsgs',ctypes.c_uint32)]
+
+class I2c_rdwr(object):
+    """ Combined transfers on /dev/i2c-'busnum' through the I2C_RDWR ioctl:
+    all write and read segments of a transfer are sent as one bus transaction,
+    separated by repeated starts. """
+
+    def __init__(self,busnum):
+        if fcntl is None:
+            raise IOError("I2C_RDWR needs fcntl (Linux)!")
+        self.fd = os.open("/dev/i2c-{}".format(busnum),os.O_RDWR)
+
+    def transfer(self,addr,segments):
+        """ Sends the 'segments' [(I2C_WR,[bytes]) or (I2C_RD,nbytes),...]
+        to address 'addr' in one transaction. Returns a list with the bytes
+        received in each read segment. """
+        assert len(segments) <= I2C_RDWR_MAX_MSGS,"Too many segments!"
+        msgs = (_i2c_msg*len(segments))()
+        bufs = []
+        for i,(kind,arg) in enumerate(segments):
+            if kind == I2C_WR:
+                buf = (ctypes.c_uint8*len(arg))(*arg)
+                (flags,n) = (0,len(arg))
+            else:
+                buf = (ctypes.c_uint8*arg)()
+                (flags,n) = (I2C_M_RD,arg)
+            msgs[i] = _i2c_msg(addr,flags,n,\
+                               ctypes.cast(buf,ctypes.POINTER(ctypes.c_uint8)))
+            bufs.append(buf)
+        fcntl.ioctl(self.fd,I2C_RDWR,_i2c_rdwr_ioctl_data(msgs,len(segments)))
+        return [list(buf) for (kind,arg),buf in zip(segments,bufs) \
+                if kind == I2C_RD]
+
+    def close(self):
+        os.close(self.fd)
+
+_rdwr = {}
+
+def get_rdwr(busnum=1):
+    """ Returns the shared combined-transfer handle of i2c bus 'busnum',
+    opening it on first use. Returns None if the bus does not support
+    combined transfers. """
+    try:
+        return _rdwr[busnum]
+    except KeyError:
+        try:
+            _rdwr[busnum] = I2c_rdwr(busnum)
+        except (IOError,OSError):
+            _rdwr[busnum] = None
+        return _rdwr[busnum]
+
+def sequential_transfer(bus,addr,segments):
+    """ Emulates a combined transfer with plain smbus calls (one
+    transaction per call) for buses without I2C_RDWR support. A write of a
+    register pointer followed by a read maps onto one block read. """
+    out = []
+    i = 0
+    while i < len(segments):
+        (kind,arg) = segments[i]
+        nxt = segments[i+1] if i+1 < len(segments) else (None,None)
+        if kind == I2C_WR and len(arg) == 1 and nxt[0] == I2C_RD:
+            out.append(bus.read_i2c_block_data(addr,arg[0],nxt[1]))
+            i += 2
+            continue
+        if kind == I2C_RD:
+            if arg > 1:
+                raise IOError("Plain multi-byte reads need I2C_RDWR!")
+            out.append([bus.read_byte(addr)])
+        elif len(arg) == 0:
+            bus.write_quick(addr)
+        elif len(arg) == 1:
+            bus.write_byte(addr,arg[0])
+        else:
+            bus.write_i2c_block_data(addr,arg[0],list(arg[1:]))
+        i += 1
+    return out
+
+
+# ---------- REGISTER TABLES ----------
+# The register dictionaries of each device class are compiled once, at class
+# creation, into lookup tables used by config(), get_config() & co.
+
+def _field_decoder(fields):
+    """ Returns a function that extracts the entries 'fields', given as
+    tuples (name,start-bit,mask), from a register value into a dictionary. """
+    def decode(val):
+        return {name:(val>>start)&mask for (name,start,mask) in fields}
+    return decode
+
+def compile_conf_reg(conf_reg,volatile={}):
+    """ Compiles a configuration register dictionary (see I2c_device) into
+    a tuple of lookup tables:
+      fields  -- {entry: (register-address,start-bit,mask)}
+      decode  -- {register-address: decoder returning all entries}
+      neutral -- {register-address: (clear-mask,bits)}, setting the volatile
+                 entries of a register to the values given in 'volatile'. """
+    fields = {}
+    regs = {}
+    for kw in conf_reg:
+        if type(conf_reg[kw]) is not tuple: continue
+        (r,start,nbits) = conf_reg[kw][0:3]
+        fields[kw] = (r,start,(1<<nbits)-1)
+        regs.setdefault(r,[]).append((kw,start,(1<<nbits)-1))
+    decode = {r:_field_decoder(tuple(regs[r])) for r in regs}
+    neutral = {}
+    for kw in volatile:
+        (r,start,mask) = fields[kw]
+        (clear,bits) = neutral.get(r,(0,0))
+        neutral[r] = (clear | (mask<<start),bits | (volatile[kw]<<start))
+    return (fields,decode,neutral)
+
+def compile_data_reg(data_reg):
+    """ Compiles a data register dictionary (see I2c_device) into the
+    transaction segments reading each register: {name: (write,read)}. """
+    return {name:((I2C_WR,[data_reg[name][0]]),(I2C_RD,data_reg[name][1])) \
+            for name in data_reg}
+
+
 # ---------- GENERIC I2C DEVICE ----------
 class I2c_device(object):
     """ API for generic i2c devices; provides routines for setting class 
@@ -77,11 +333,12 @@ class I2c_device(object):
     # defaults attributes; ! must at least contain bus and address !
     _default = {\
         'addr':0x00,\
-        'bus':smbus.SMBus(1),\
+        'bus':1,\
     } 
-    _bus = None # write-once storage for device's bus
+    _bus = None # write-once storage for device's bus (number or handle)
     _addr = None # write-once storage for device's address
     _config = {} # storage place for device's configuration
+    _shadow = {} # shadow copy of the configuration registers
     
     # configuration register dictionary, specify entries as tuples
     #   (register-address,start-bit,nbits,info,value-representation)
@@ -89,14 +346,45 @@ class I2c_device(object):
     # entry (consult datasheet)
     _conf_reg = {}
 
+    # volatile configuration entries (status bits, self-clearing commands);
+    # always read from the device rather than from the shadow registers, and
+    # written with the given value unless set explicitly in config()
+    _volatile = {}
+    # entries that reload the register contents when set (soft resets)
+    _resets = ()
+
     # data register dictionary, specify entries as tuples
     #   (register-addresses,nbytes,)
     _data_reg = {}
 
+    # names of the quantities returned by get_all(), in order
+    _outputs = ()
+    # bytes per raw acquisition (see get_all_raw)
+    _raw_nbytes = 0
+
+    def __init_subclass__(cls,**kwargs):
+        """ Compiles the register tables of each device class once, when the
+        class is created. """
+        super(I2c_device,cls).__init_subclass__(**kwargs)
+        cls._compile_regs()
+
+    @classmethod
+    def _compile_regs(cls):
+        """ Builds the lookup tables '_conf_fields', '_conf_decode',
+        '_conf_neutral' and '_data_seg' from '_conf_reg', '_volatile' and
+        '_data_reg'; see compile_conf_reg and compile_data_reg. """
+        (cls._conf_fields,cls._conf_decode,cls._conf_neutral) = \
+            compile_conf_reg(cls._conf_reg,cls._volatile)
+        cls._data_seg = compile_data_reg(cls._data_reg)
+
     # getter and setter methods for bus and address (locked once set)
     @property
     def bus(self):
-        """ The bus on which the device is located. """
+        """ The bus on which the device is located. Set either to a bus
+        number (opened through the bus registry on first use) or to a bus
+        handle. """
+        if type(self._bus) is int:
+            return get_bus(self._bus)
         return self._bus
     @bus.setter
     def bus(self,value):
@@ -105,6 +393,11 @@ class I2c_device(object):
         else:
             raise AttributeError("Cannot change bus once set!")
 
+    @property
+    def busnum(self):
+        """ The bus number of the device (None if set to a bus handle). """
+        return self._bus if type(self._bus) is int else None
+
     @property
     def addr(self):
         """ The 7-bit address of the device. """
@@ -139,7 +432,10 @@ class I2c_device(object):
                 else:
                     setattr(self,kw,self._default[kw])
         if len(kwargs) > 0:
-            print("Ignoring unknown attributes ({})!".format(kwwargs))
+            print("Ignoring unknown attributes ({})!".format(kwargs))
+        # per-instance configuration storage and shadow registers
+        self._config = {}
+        self._shadow = {}
         # ready to use; read and store current configuration if requested
         if read_config:
             self._config = self.get_config()
@@ -201,13 +497,61 @@ class I2c_device(object):
                 data = self.bus.read_i2c_block_data(self.addr,ctrl,nbytes)
         return data
 
+    def transaction(self,*segments):
+        """ Sends a sequence of write and read segments to the device in a
+        single bus transaction (repeated starts, no stops in between). Each
+        segment is a tuple (I2C_WR,[bytes]) or (I2C_RD,nbytes). Returns a list
+        with the bytes received in each read segment. Buses that provide a
+        'transfer' method (e.g. simulated buses) are used directly; others go
+        through the I2C_RDWR ioctl, falling back to plain smbus calls. """
+        bus = self.bus
+        if hasattr(bus,'transfer'):
+            return bus.transfer(self.addr,segments)
+        if type(self._bus) is int:
+            rdwr = get_rdwr(self._bus)
+            if rdwr is not None:
+                return rdwr.transfer(self.addr,segments)
+        return sequential_transfer(bus,self.addr,segments)
+
+    def combined_transfers(self):
+        """ True if transaction() reaches the bus as one combined transfer
+        (simulated bus or I2C_RDWR). Otherwise it is emulated with plain
+        smbus calls (see sequential_transfer), which cannot read more than
+        one byte without sending a register pointer first. """
+        if hasattr(self.bus,'transfer'):
+            return True
+        return type(self._bus) is int and get_rdwr(self._bus) is not None
+
+    def read_regs(self,regs):
+        """ Reads the configuration registers 'regs' in a single transaction.
+        Returns a dictionary {register-address: value}. """
+        regs = list(regs)
+        nbytes = self._conf_reg['nbytes']
+        segments = []
+        for r in regs:
+            segments += [(I2C_WR,[r]),(I2C_RD,nbytes)]
+        ans = self.transaction(*segments)
+        for a in ans:
+            assert len(a) == nbytes,"Unexpected number of bytes in register!"
+        return {r:bytes2int(a) for r,a in zip(regs,ans)}
+
+    def write_regs(self,vals):
+        """ Writes the configuration register values 'vals' (dictionary 
+        {register-address: value}) in a single transaction. """
+        nbytes = self._conf_reg['nbytes']
+        self.transaction(*[(I2C_WR,[r]+int2bytes(vals[r],nbytes)) \
+                           for r in vals])
+
     def get_config(self,read=True,*args):
         """ Reads the respective parts of the configuration register that 
         contain the properties specified by string inputs. Returns a dictionary
         with one entry for each string input. Returns full configuration if no
         input arguments are given. Setting 'read=False' returns the configuation
         stored in '._config' and throw an error if the requested entry has not
-        yet been stored. """
+        yet been stored. 
+        Registers are read once and then served from a shadow copy that is
+        kept current by config(); entries listed in '_volatile' are always
+        read from the device. See also invalidate() and refresh(). """
         # return empty dictionary if no configuration register exists
         if len(self._conf_reg) == 0:
             return {}
@@ -219,39 +563,28 @@ class I2c_device(object):
                        "Configuration has to be read from device once!"
                 out[kw] = self._config[kw]
             return out
-        # read full configuration if prompted without argument
+        fields = self._conf_fields
         if len(args) == 0:
+            # read full configuration if prompted without argument; read
+            # registers that are not shadowed or hold volatile entries (all
+            # in one transaction)
+            regs = [r for r in self._conf_decode \
+                    if r in self._conf_neutral or r not in self._shadow]
+            if len(regs) > 0:
+                self._shadow.update(self.read_regs(regs))
             out = {}
-            # first collect all configuration register pointers (skip
-            # over 'nbytes' entry)
-            regs = {self._conf_reg[kw][0] for kw in self._conf_reg \
-                    if type(self._conf_reg[kw]) is tuple}
-            for r in regs:
-                # read register entry
-                ans = self.read(r,self._conf_reg['nbytes'])
-                assert len(ans) == self._conf_reg['nbytes'],\
-                       "Unexpected number of bytes in register!"
-                # build integer from read bytes and grab configurations
-                val = bytes2int(ans)
-                for kw in self._conf_reg:
-                    if kw == 'nbytes': continue
-                    if self._conf_reg[kw][0] == r:
-                        out[kw] = bit_grab(val,self._conf_reg[kw][1],\
-                                           self._conf_reg[kw][2])
-        # read only configuration specified
+            for r in self._conf_decode:
+                out.update(self._conf_decode[r](self._shadow[r]))
         else:
+            # read only configuration specified
+            regs = {fields[kw][0] for kw in args \
+                    if kw in self._volatile or fields[kw][0] not in self._shadow}
+            if len(regs) > 0:
+                self._shadow.update(self.read_regs(regs))
             out = {}
-            regs = {self._conf_reg[kw][0] for kw in args}
-            for r in regs:
-                # read register entry
-                ans = self.read(r,self._conf_reg['nbytes'])
-                assert len(ans) == self._conf_reg['nbytes'],\
-                       "Unexpected number of bytes in register!"
-                val = bytes2int(ans)
-                for kw in args:
-                    if self._conf_reg[kw][0] == r:
-                        out[kw] = bit_grab(val,self._conf_reg[kw][1],\
-                                           self._conf_reg[kw][2])                
+            for kw in args:
+                (r,start,mask) = fields[kw]
+                out[kw] = (self._shadow[r]>>start)&mask
         # automatically update stored configuration
         for kw in out:
             self._config[kw] = out[kw]
@@ -264,54 +597,79 @@ class I2c_device(object):
         arguments; e.g. if a device 'dev' has the property 'MODE', this property
         is set with dev.config(MODE=value). 
         If no arguments are give, returns the full configuration as a dictionary
-        by calling 'self.get_config()'. """
+        by calling 'self.get_config()'. 
+        Unset bits are taken from the shadow registers (read from the device
+        only once), so a configuration change is a single write. """
         # if no arguments are given, return full configuration
         if len(kwargs) == 0:
             return self.get_config()
         # if no configuration register is implemented, throw error
         assert len(self._conf_reg) > 0,"No configuration register implemented!"
         # check inputs, collect all registers that need to be updated
-        regs = []
+        fields = self._conf_fields
+        vals = {}
         for kw in kwargs:
-            assert kw in self._conf_reg,"Unknown property, {}!".format(kw)
-            if self._conf_reg[kw][0] not in regs:
-                regs.append(self._conf_reg[kw][0])
-            assert 0<=kwargs[kw]<2**self._conf_reg[kw][2],\
+            assert kw in fields,"Unknown property, {}!".format(kw)
+            (r,start,mask) = fields[kw]
+            assert 0<=kwargs[kw]<=mask,\
                    "Property value for {} out of range!".format(kw)
-        # cycle through registers, set bits, overwrite register content
-        for r in regs:
-            ans = self.read(r,self._conf_reg['nbytes'])
-            val = bytes2int(ans)
-            for kw in kwargs:
-                if self._conf_reg[kw][0] == r:
-                    val = bit_set(val,self._conf_reg[kw][1],\
-                                  self._conf_reg[kw][2],kwargs[kw])
-            # break up multi-byte registers into single bytes
-            val = int2bytes(val,self._conf_reg['nbytes'])
-            self.write(ctrl=r,data=val)
+            vals[r] = None
+        # fill the shadow copy of registers not read so far (one transaction)
+        missing = [r for r in vals if r not in self._shadow]
+        if len(missing) > 0:
+            self._shadow.update(self.read_regs(missing))
+        # set bits; volatile entries not given are written as neutral values
+        for r in vals:
+            vals[r] = self._shadow[r]
+            if r in self._conf_neutral:
+                (clear,bits) = self._conf_neutral[r]
+                vals[r] = (vals[r] & ~clear) | bits
+        for kw in kwargs:
+            (r,start,mask) = fields[kw]
+            vals[r] = (vals[r] & ~(mask<<start)) | (kwargs[kw]<<start)
+        # overwrite register contents in one transaction, keep shadow current
+        self.write_regs(vals)
+        self._shadow.update(vals)
         # finally update stored configuration dictionary
         for kw in kwargs:
             self._config[kw] = kwargs[kw]
+        # a reset reloads all registers
+        for kw in self._resets:
+            if kwargs.get(kw):
+                self.invalidate()
         return None
 
+    def invalidate(self,*args):
+        """ Discards the shadow copy of the registers holding the configuration
+        entries 'args' (entry names or register addresses; all registers if
+        none given). They are re-read from the device when next needed. Use
+        when something other than this instance changed the configuration. """
+        if len(args) == 0:
+            self._shadow = {}
+        for kw in args:
+            r = self._conf_fields[kw][0] if kw in self._conf_fields else kw
+            self._shadow.pop(r,None)
+
+    def refresh(self):
+        """ Re-reads all configuration registers from the device and returns
+        the full configuration. """
+        self.invalidate()
+        return self.get_config()
+
     def config_info(self):
         """ Lists the entries of the configuration register. Prints to the
         standard output. Does not read the register, but merely gives a way to
         show some helpful information. """
-        if len(self._conf_reg) == 0:
-            return
-        # define an order
-        kws = sorted([kw for kw in self._conf_reg \
-                      if type(self._conf_reg[kw]) is tuple])
-        # show configuration register entries
-        for kw in kws:
-            val = self._conf_reg[kw]
-            if val[2] == 1:
+        # show configuration register entries in alphabetical order
+        for kw in sorted(self._conf_fields):
+            (r,start,mask) = self._conf_fields[kw]
+            if mask == 1:
                 print("{} @ 0x{:02X},{}; {}".\
-                      format(kw,val[0],val[1],val[3]))
+                      format(kw,r,start,self._conf_reg[kw][3]))
             else:
                 print("{} @ 0x{:02X},{}:{}; {}".\
-                      format(kw,val[0],val[1]+val[2]-1,val[1],val[3]))
+                      format(kw,r,start+mask.bit_length()-1,start,\
+                             self._conf_reg[kw][3]))
 
     def get_raw(self,reg_name=None):
         """ Read from a data register specified in 'self._data_reg'. Returns 
@@ -322,12 +680,20 @@ class I2c_device(object):
         # default: read first specified register
         if reg_name == None:
             assert len(self._data_reg) == 1,"Need to specify data register!"
-            reg_name = self._data_reg[0]
+            reg_name = list(self._data_reg)[0]
         # read data from register and concatenate to long integer
         data = self.read(ctrl=self._data_reg[reg_name][0],\
                          nbytes=self._data_reg[reg_name][1])
         return bytes2int(data)
 
+    def get_raw_multi(self,*reg_names):
+        """ Reads several data registers specified in 'self._data_reg' in a
+        single transaction. Returns a list of (long) integers; see get_raw. """
+        segments = []
+        for reg_name in reg_names:
+            segments += self._data_seg[reg_name]
+        return [bytes2int(data) for data in self.transaction(*segments)]
+
     def put_raw(self,value,reg_name=None):
         """ Writes 'value' directly to a data register specified in 
         'self._data_reg'. If only one register is defined in '_data_reg',
@@ -335,11 +701,93 @@ class I2c_device(object):
         assert len(self._data_reg) > 0,"No data register(s) implemented!"
         if reg_name == None:
             assert len(self._data_reg) == 1,"Need to specify data register!"
-            reg_name = self._data_reg[0]
+            reg_name = list(self._data_reg)[0]
         # split long int value to bytes and write to register
         data = int2bytes(value,self._data_reg[reg_name][1])
         self.write(ctrl=self._data_reg[reg_name][0],data=data)
 
+    @property
+    def outputs(self):
+        """ Names of the quantities returned by get_all(), in order. """
+        return self._outputs
+
+    def get_all(self):
+        """ Returns all quantities the device provides in one acquisition as a
+        tuple, in the order given by 'outputs'. Implemented by the device
+        classes. """
+        raise NotImplementedError
+
+    @property
+    def raw_nbytes(self):
+        """ Number of bytes returned by get_all_raw(). """
+        return self._raw_nbytes
+
+    def get_all_raw(self):
+        """ Same acquisition as get_all(), but returns the data bytes as read
+        (a list of 'raw_nbytes' bytes), without converting them. Convert
+        later, in bulk, with decode_raw() and the settings from
+        raw_settings(). Implemented by the device classes. """
+        raise NotImplementedError
+
+    def raw_settings(self):
+        """ The current settings needed to convert raw data (scales, offsets)
+        as keyword arguments of decode_raw(). """
+        return {}
+
+    def decode_raw(self,data,**settings):
+        """ Converts raw data (rows of bytes as returned by get_all_raw()) to
+        the quantities of 'outputs'. Implemented by the device classes. """
+        raise NotImplementedError
+
+I2c_device._compile_regs()
+
+
+# ---------- GPIO EDGES ----------
+class GpioEdge(object):
+    """ Edge detection on a Raspberry Pi GPIO pin (BCM numbering), e.g. for
+    conversion-ready or trigger signals. Edges are caught by RPi.GPIO's event
+    detection in the background and time-stamped (time.perf_counter). 
+    'edge' is 'falling', 'rising' or 'both'. Simulated pins (see pySimBus)
+    provide the same wait/poll interface. """
+
+    def __init__(self,pin,edge='falling'):
+        import RPi.GPIO as gpio
+        import threading
+        self._gpio = gpio
+        self.pin = pin
+        self.t_edge = None # time of the last edge
+        self._event = threading.Event()
+        if gpio.getmode() == None: gpio.setmode(gpio.BCM)
+        gpio.setup(pin,gpio.IN)
+        edge = {'falling':gpio.FALLING,'rising':gpio.RISING,\
+                'both':gpio.BOTH}[edge]
+        gpio.add_event_detect(pin,edge,callback=self._callback)
+
+    def _callback(self,pin):
+        self.t_edge = time.perf_counter()
+        self._event.set()
+
+    def wait(self,timeout=None):
+        """ Blocks until the next edge (or an edge that occurred since the
+        last call) for at most 'timeout' seconds. Returns the time of the
+        edge, or None on timeout. """
+        if not self._event.wait(timeout):
+            return None
+        self._event.clear()
+        return self.t_edge
+
+    def poll(self):
+        """ Returns the time of an edge that occurred since the last call
+        (None if there was none); does not block. """
+        if not self._event.is_set():
+            return None
+        self._event.clear()
+        return self.t_edge
+
+    def close(self):
+        """ Stops the edge detection. """
+        self._gpio.remove_event_detect(self.pin)
+
         
 
 # ---------- I2C DEVICES ----------
@@ -352,11 +800,12 @@ class ADS1115(I2c_device):
 
     # defining attributes
     BIT_DEPTH = 16
+    DR_TOLERANCE = 0.1 # relative accuracy of the data rate (internal clock)
     _dev_type = 'ADS1115'
     _dev_class = DEV_ADC
     _valid_addr = [0x48,0x49,0x4a,0x4b]
     _default = {\
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x48,\
         'cycle':None,\
         'group':None,\
@@ -366,6 +815,8 @@ class ADS1115(I2c_device):
     CH1 = 0b101
     CH2 = 0b110
     CH3 = 0b111
+    _cycle = None # MUX settings read in turn by get()
+    _scan = None # the same settings, in the order given (not rotated)
 
     # Configuration register (1 x 16bit); see datasheet
     _conf_reg = {\
@@ -383,25 +834,38 @@ class ADS1115(I2c_device):
         'COMP_LAT':(0x01,2,1,'Comparator latch',[0,1]),\
         'COMP_QUE':(0x01,0,2,'Comp. queiung',[1,2,4,"OFF"]),
     }
+    # OS reads the conversion status; writing 1 starts a conversion
+    _volatile = {'OS':0}
     
     # Data registers (3 x 16 bit); CONVersion, LOw THreshold, HIgh THreshold;
     # see datasheet
-    ## currently not implemendet: using LOTH and HITH and the COMP feature
+    ## the comparator is only used as conversion-ready signal (see stream)
     _data_reg = {\
         'CONV':(0x00,2,),\
-        'LOTH':(0x10,2,),\
-        'HITH':(0x11,2,),\
+        'LOTH':(0x02,2,),\
+        'HITH':(0x03,2,),\
     }
     
     # methods
     def __init__(self,**kwargs):
         """ Initialize instance. """
         I2c_device.__init__(self,**kwargs)
+
+    @property
+    def cycle(self):
+        """ MUX settings read one after the other by get(), which rotates the
+        list with every reading; None to read with the current settings.
+        get_all() and scan() read them in the order given. """
+        return self._cycle
+    @cycle.setter
+    def cycle(self,value):
+        self._cycle = value
+        self._scan = None if value == None else tuple(value)
         
     def put_raw(self,value,reg_name=None):
         """ Do not allow for setting the conversion register. """
         # not really necessary, just an example
-        assert reg_name is not "CONV","Cannot set conversion register!"
+        assert reg_name != "CONV","Cannot set conversion register!"
         I2c_device.put_raw(self,value,reg_name)
 
     def get_conversion(self):
@@ -409,11 +873,35 @@ class ADS1115(I2c_device):
         request before reading or continuous conversion mode. """
         # get full-scale from (stored) PGA setting
         i = self._config['PGA']
-        if i == None: i = self.get_config()['PGA']
+        if i == None: i = self.get_config(True,'PGA')['PGA']
         FS = self._conf_reg['PGA'][4][i]
         # read register and return converted voltage reading
         
         return FS*twoscompl2int(self.get_raw('CONV'),16)/(2**15)
+
+    def decode_raw(self,data,PGA=None):
+        """ Converts conversion register contents (rows of two bytes, MSb
+        first; see decode_ads) to voltages, in one go. Rows of several
+        conversions (2 bytes each, as returned by get_all_raw with a cycle)
+        give one column per conversion. 'PGA' is the PGA setting of the
+        readings (a single one, or one per conversion in a row; default: the
+        current setting). """
+        if PGA == None:
+            PGA = self._config['PGA']
+            if PGA == None: PGA = self.get_config(True,'PGA')['PGA']
+        FS = np.asarray(self._conf_reg['PGA'][4])[PGA]
+        data = np.asarray(data,dtype=np.uint8)
+        if data.ndim == 1 or data.shape[1] == 2:
+            return decode_ads(data,FS,self.BIT_DEPTH)
+        raw = MSbLSb2int16(data.reshape(-1,2)).reshape(len(data),-1)
+        bits = self.BIT_DEPTH
+        return (raw.astype(np.int32) >> (16-bits))*(FS/2.0**(bits-1))
+
+    def raw_settings(self):
+        """ The current PGA setting; see decode_raw. """
+        PGA = self._config['PGA']
+        if PGA == None: PGA = self.get_config(True,'PGA')['PGA']
+        return {'PGA':PGA}
     
     def request_conversion(self,ch=None):
         """ Triggers a single-shot conversion by setting the OS bit to 1. 
@@ -429,12 +917,13 @@ class ADS1115(I2c_device):
             assert ch in range(2**self._conf_reg['MUX'][2])
             self.config(MUX=ch,OS=0b1) # set MUX and trigger conversion
     
-    def get_single(self,MUX=None,ch=None):
+    def get_single(self,MUX=None,ch=None,raw=False):
         """ Sets the conversion mode to 1 (SNGL) and reads the conversion \
         register of the chip after requesting a conversion. If 'ch' is \
         specified, sets the MUX to measure AINch vs GND. Alternatively, \
         can set 'MUX' directly (overrides 'ch'). If neither 'ch' nor 'MUX'\
-        are set, reads with the current settings."""
+        are set, reads with the current settings. With 'raw' set, returns
+        the two bytes of the conversion register instead of the voltage."""
         if ch == None and MUX == None:
             # set MODE to SNGL and trigger conversion
             self.config(MODE=0b1,OS=0b1) 
@@ -455,12 +944,90 @@ class ADS1115(I2c_device):
             # set MUX, set MODE to SNGL and trigger conversion            
             self.config(MUX=0b100+ch,MODE=0b1,OS=0b1)
         # wait until conversion is finished, then read
-        #print(self.get_config('OS'))
-        time.sleep(.01)
-        #while not self.get_config('OS'):
-        #    pass
+        self.wait_conversion(time.perf_counter())
+        if raw:
+            return self.read(ctrl=self._data_reg['CONV'][0],nbytes=2)
         return(self.get_conversion())
+
+    def conversion_time(self):
+        """ Returns the nominal duration of a conversion (in s), given by the
+        (stored) data rate setting. """
+        return 1.0/self._conf_reg['DR'][4][self.get_config(True,'DR')['DR']]
+
+    def wait_conversion(self,t_start):
+        """ Waits for a single-shot conversion requested at time 't_start'
+        (time.perf_counter) to finish: sleeps for the nominal conversion time,
+        then confirms completion by polling the OS bit. Polling is bounded by
+        the data rate tolerance ('DR_TOLERANCE') plus one millisecond; raises
+        an IOError if the conversion is not finished by then. """
+        T = self.conversion_time()
+        dt = t_start + T - time.perf_counter()
+        if dt > 0: time.sleep(dt)
+        deadline = t_start + T*(1+self.DR_TOLERANCE) + 1e-3
+        while not self.get_config(True,'OS')['OS']:
+            if time.perf_counter() > deadline:
+                raise IOError("Conversion timed out on {}!".format(self))
     
+    def scan(self,channels=None,PGA=None,raw=False):
+        """ Converts the MUX settings in 'channels' (default: 'cycle', in the
+        order given) one after the other and returns the readings (in V) as
+        a list. 'PGA' sets the PGA for all channels, or per channel if given
+        as a list (default: current setting). Single-shot conversions are
+        pipelined: the result of each conversion is read and the next
+        conversion started in the same transaction, so a scan takes about one
+        conversion time per channel. The switch channel (if part of a group)
+        stays selected for the whole scan. With 'raw' set, returns the
+        conversion register bytes (two per channel, in one list) instead of
+        the readings. """
+        if self._dev_type not in ('ADS1115','ADS1015',):
+            raise NotImplementedError('Chip not equipped with multiplexer.')
+        if channels == None: channels = self._scan
+        if channels == None:
+            raise ValueError("No channels to scan: pass 'channels' or set "\
+                             "a 'cycle'!")
+        n = len(channels)
+        if PGA == None: PGA = self.get_config(True,'PGA')['PGA']
+        if type(PGA) is not list: PGA = [PGA]*n
+        assert len(PGA) == n,"Need one PGA setting per channel!"
+        # configuration words (single-shot, OS=1) of all channels, based on
+        # the shadow register
+        self.get_config(True,'DR')
+        fields = self._conf_fields
+        (conf,start,mask) = fields['MUX']
+        words = []
+        for (mux,pga) in zip(channels,PGA):
+            assert mux in range(0b000,0b111+1),\
+                   "MUX setting needs to be in [0b000,0b111]!"
+            val = self._shadow[conf]
+            for (kw,v) in (('OS',1),('MUX',mux),('PGA',pga),('MODE',1)):
+                (r,start,mask) = fields[kw]
+                val = (val & ~(mask<<start)) | (v<<start)
+            words.append(int2bytes(val,2))
+        FS = [self._conf_reg['PGA'][4][pga] for pga in PGA]
+        conv = [(I2C_WR,[self._data_reg['CONV'][0]]),(I2C_RD,2)]
+        # start first conversion, then read each result while starting the
+        # next conversion
+        self.set_focus()
+        self.transaction((I2C_WR,[conf]+words[0]))
+        t = time.perf_counter()
+        out = []
+        for i in range(n):
+            self.wait_conversion(t)
+            if i+1 < n:
+                data = self.transaction(*(conv+[(I2C_WR,[conf]+words[i+1])]))
+                t = time.perf_counter()
+            else:
+                data = self.transaction(*conv)
+            if raw:
+                out += data[0]
+            else:
+                out.append(FS[i]*twoscompl2int(bytes2int(data[0]),16)/(2**15))
+        # keep shadow register and stored configuration current
+        self._shadow[conf] = bytes2int(words[-1])
+        self._config['MUX'] = channels[-1]
+        self._config['PGA'] = PGA[-1]
+        return out
+
     def start_continuous(self,ch=None,MUX=None):
         """ Sets the conversion mode to 0 (CONT) for continuous conversion.\
         If 'ch' is specified, sets the MUX to measure AINch vs GND. \
@@ -484,15 +1051,56 @@ class ADS1115(I2c_device):
                     'Channel {} does not exist!'.format(ch))
             # set MUX, set MODE to SNGL and trigger conversion            
             self.config(MUX=0b100+ch,MODE=0b0)
+    def stream(self,nsamples,rdy,ch=None,MUX=None,out=None,timeout=1.0):
+        """ Continuous acquisition of 'nsamples' conversions, paced by the
+        chip's ALERT/RDY pin. The comparator is set up as conversion-ready
+        signal (HITH MSb 1, LOTH MSb 0, asserting after each conversion) and
+        continuous conversion is started with the channel/MUX setting of
+        'ch'/'MUX' (see start_continuous). On every edge of 'rdy' (an object
+        with a wait(timeout) method such as GpioEdge, or a simulated pin)
+        only the conversion register is read. Readings are collected in a
+        preallocated buffer and returned as voltages in the NumPy array 'out'
+        (allocated if not given). Returns to single-shot mode afterwards. The
+        switch channel (if part of a group) is selected before the setup and
+        stays selected for the whole stream. """
+        assert 'COMP_QUE' in self._conf_fields,"Chip has no ALERT/RDY pin!"
+        if out is None: out = np.empty(nsamples)
+        raw = np.empty(nsamples,dtype=np.uint16)
+        # RDY mode of the comparator, then start converting
+        self.set_focus()
+        self.put_raw(0x8000,'HITH')
+        self.put_raw(0x0000,'LOTH')
+        self.config(COMP_MODE=0,COMP_LAT=0,COMP_QUE=0)
+        self.start_continuous(ch=ch,MUX=MUX)
+        FS = self._conf_reg['PGA'][4][self.get_config(True,'PGA')['PGA']]
+        try:
+            conv = self._data_reg['CONV'][0]
+            if self.combined_transfers():
+                # point to the conversion register once; every reading is
+                # then a plain two-byte read
+                self.transaction((I2C_WR,[conv]))
+                segs = ((I2C_RD,2),)
+            else:
+                # plain smbus calls: re-send the pointer with every reading
+                segs = ((I2C_WR,[conv]),(I2C_RD,2))
+            for i in range(nsamples):
+                if rdy.wait(timeout) == None:
+                    raise IOError("No conversion-ready signal from {}!"\
+                                  .format(self))
+                data = self.transaction(*segs)[0]
+                raw[i] = (data[0] << 8) | data[1]
+        finally:
+            # back to single-shot mode (power-down), comparator off
+            self.config(MODE=0b1,COMP_QUE=0b11)
+        out[:] = raw.view(np.int16)*(FS/2.0**15)
+        return out
+
     def set_focus(self):
-        if self.group == None:
-            pass
-        else:
-            sw = self.group['switch'].get_settings()
-            for ch in self.group['channels']:
-                sw[ch] = 0
-            sw[self.group['me']] = 1
-            self.group['switch'].set_channels(sw)
+        """ Sets the focus on this ADC, if it is part of a group, by routing
+        the group's switch to the ADC's channel (see I2c_switch.select). """
+        if self.group != None:
+            self.group['switch'].select(self.group['me'],\
+                                        self.group['channels'])
 
 
     def get(self):
@@ -508,13 +1116,48 @@ class ADS1115(I2c_device):
             
             out = self.get_single(MUX=self.cycle[0])
             self.cycle.append(self.cycle.pop(0))
-        self.group['switch'].disable(self.group['me'])
             #print(out)
             #return out
         # return value
         
         
         return out            
+
+    @property
+    def outputs(self):
+        """ Names of the readings returned by get_all(): the MUX settings in
+        'cycle' (e.g. 'AIN0-GND'), in the order given, or 'V' if there is no
+        cycle. """
+        if self._scan == None or \
+           self._dev_type not in ('ADS1115','ADS1015',):
+            return ('V',)
+        return tuple(self._conf_reg['MUX'][4][mux] for mux in self._scan)
+
+    def get_all(self):
+        """ Returns the readings (in V) of all MUX settings in 'cycle', in the
+        order given (see outputs), converted in a single pipelined scan (see
+        scan); a single conversion with the current settings if there is no
+        cycle. """
+        self.set_focus()
+        if self._scan == None or \
+           self._dev_type not in ('ADS1115','ADS1015',):
+            return (self.get_single(),)
+        return tuple(self.scan())
+
+    @property
+    def raw_nbytes(self):
+        """ Number of bytes returned by get_all_raw(): two per output. """
+        return 2*len(self.outputs)
+
+    def get_all_raw(self):
+        """ Raw version of get_all: the conversion register bytes of all MUX
+        settings in 'cycle' (two per setting, see scan), or of a single
+        conversion if there is no cycle. """
+        self.set_focus()
+        if self._scan == None or \
+           self._dev_type not in ('ADS1115','ADS1015',):
+            return self.get_single(raw=True)
+        return self.scan(raw=True)
     
 # ----- ADS1114: Single-channel ADC (16-Bit) with PGA, Texas Instruments -----
 class ADS1114(ADS1115):
@@ -528,7 +1171,7 @@ class ADS1114(ADS1115):
     _dev_class = DEV_ADC
     _valid_addr = [0x48,0x49,0x4a,0x4b]
     _default = {
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x48, \
         'cycle':None,\
     }
@@ -551,8 +1194,8 @@ class ADS1114(ADS1115):
     # see datasheet
     _data_reg = {\
         'CONV':(0x00,2,),\
-        'LOTH':(0x10,2,),\
-        'HITH':(0x11,2,),\
+        'LOTH':(0x02,2,),\
+        'HITH':(0x03,2,),\
     }
 
 # ----- ADS1113: Single-channel ADC (16-Bit), Texas Instruments -----
@@ -567,7 +1210,7 @@ class ADS1113(ADS1115):
     _dev_class = DEV_ADC
     _valid_addr = [0x48,0x49,0x4a,0x4b]
     _default = {
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x48,\
         'cycle':None,\
     }
@@ -598,7 +1241,7 @@ class ADS1015(ADS1115):
     _dev_class = DEV_ADC
     _valid_addr = [0x48,0x49,0x4a,0x4b]
     _default = {
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x48,\
         'cycle':None,\
     }
@@ -613,7 +1256,7 @@ class ADS1015(ADS1115):
         'PGA':(0x01,9,3,'PGA setting',\
                [6.144,4.096,2.048,1.024,0.512,0.256,0.256,0.256]),\
         'MODE':(0x01,8,1,'Conversion mode',["CONT","SNGL"]),\
-        'DR':(0x01,5,3,'Data rate',[128,250,490,920,1600,2400,3300]),\
+        'DR':(0x01,5,3,'Data rate',[128,250,490,920,1600,2400,3300,3300]),\
         'COMP_MODE':(0x01,4,1,'Comparator mode',[0,1]),\
         'COMP_POL':(0x01,3,1,'Alert-pin polarity',[0,1]),\
         'COMP_LAT':(0x01,2,1,'Comparator latch',[0,1]),\
@@ -634,7 +1277,7 @@ class ADS1014(ADS1115):
     _dev_class = DEV_ADC
     _valid_addr = [0x48,0x49,0x4a,0x4b]
     _default = {
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x48,\
         'cycle':None
     }
@@ -646,7 +1289,7 @@ class ADS1014(ADS1115):
         'PGA':(0x01,9,3,'PGA setting',\
                [6.144,4.096,2.048,1.024,0.512,0.256,0.256,0.256]),\
         'MODE':(0x01,8,1,'Conversion mode',["CONT","SNGL"]),\
-        'DR':(0x01,5,3,'Data rate',[128,250,490,920,1600,2400,3300]),\
+        'DR':(0x01,5,3,'Data rate',[128,250,490,920,1600,2400,3300,3300]),\
         'COMP_MODE':(0x01,4,1,'Comparator mode',[0,1]),\
         'COMP_POL':(0x01,3,1,'Alert-pin polarity',[0,1]),\
         'COMP_LAT':(0x01,2,1,'Comparator latch',[0,1]),\
@@ -657,8 +1300,8 @@ class ADS1014(ADS1115):
     # see datasheet
     _data_reg = {\
         'CONV':(0x00,2,),\
-        'LOTH':(0x10,2,),\
-        'HITH':(0x11,2,),\
+        'LOTH':(0x02,2,),\
+        'HITH':(0x03,2,),\
     }
 
 
@@ -675,7 +1318,7 @@ class ADS1013(ADS1115):
     _dev_type = 'ADS1013'
     _valid_addr = [0x48,0x49,0x4a,0x4b]
     _default = {
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x48,\
         'cycle':None,\
     }
@@ -685,7 +1328,7 @@ class ADS1013(ADS1115):
         'nbytes':2,\
         'OS':(0x01,15,1,'Operative status',['CONV','IDLE']),\
         'MODE':(0x01,8,1,'Conversion mode',["CONT","SNGL"]),\
-        'DR':(0x01,5,3,'Data rate',[128,250,490,920,1600,2400,3300]),\
+        'DR':(0x01,5,3,'Data rate',[128,250,490,920,1600,2400,3300,3300]),\
     }
     
     # Data registers (1 x 16 bit); CONVersion, LOw THreshold, HIgh THreshold;
@@ -708,7 +1351,7 @@ class LSM9DS1_MAG(I2c_device):
     _dev_class = DEV_MEAS
     _valid_addr = [0x1c,0x1e]
     _default = {\
-        'bus':smbus.SMBus(1),\
+        'bus':1,\
         'addr':0x1e,\
         'cycle':None,\
         'axis':0,\
@@ -748,12 +1391,23 @@ class LSM9DS1_MAG(I2c_device):
         'YDA':(0x27,1,1,'Y data available'),\
         'XDA':(0x27,0,1,'X data available'),\
     }
+    # status register and self-clearing bits
+    _volatile = {'ZYXOR':0,'ZOR':0,'YOR':0,'XOR':0,\
+                 'ZYXDA':0,'ZDA':0,'YDA':0,'XDA':0,\
+                 'REBOOT':0,'SOFT_RST':0}
+    _resets = ('REBOOT','SOFT_RST',)
+    # quantities returned by get_all()
+    _outputs = ('x','y','z',)
+    _raw_nbytes = 6
 
     # Data register (6 x 8Bit, see datasheet)
     _data_reg = {\
         'XLO':(0x28,1,), 'XHI':(0x29,1,),\
         'YLO':(0x2a,1,), 'YHI':(0x2b,1,),\
         'ZLO':(0x2c,1,), 'ZHI':(0x2d,1,),\
+        # all axes in one burst; the MSb of the sub-address enables the
+        # auto-increment of the register pointer
+        'XYZ':(0x28|0x80,6,),\
     }
 
     ## @@ Not implemented (yet): comparator interrupts and offsets.
@@ -765,25 +1419,40 @@ class LSM9DS1_MAG(I2c_device):
     def get_output(self,axis=0,FS=None):
         """ Returns the measurement output along 'axis'. Pass the fullscale
         'FS' to slightly speed up the interpreter. """
+        # read LO and HI registers of the axis in one transaction
         if axis == 0:
-            # read from x-registers
-            LSb = self.get_raw('XLO')
-            MSb = self.get_raw('XHI')
+            (LSb,MSb) = self.get_raw_multi('XLO','XHI')
         elif axis == 1:
-            # read from y-registers
-            LSb = self.get_raw('YLO')
-            MSb = self.get_raw('YHI')
+            (LSb,MSb) = self.get_raw_multi('YLO','YHI')
         elif axis == 2:
-            # read from z-registers
-            LSb = self.get_raw('ZLO')
-            MSb = self.get_raw('ZHI')
+            (LSb,MSb) = self.get_raw_multi('ZLO','ZHI')
         # return properly scaled measurement
         if FS == None:
-            return self._conf_reg['FS'][4][self.get_config('FS')['FS']]\
+            return self._conf_reg['FS'][4][self.get_config(True,'FS')['FS']]\
                    *twoscompl2int(MSbLSb2int(MSb,LSb),n=16)/(2**15)
         else:
             return FS*twoscompl2int(MSbLSb2int(MSb,LSb),n=16)/(2**15)
 
+    def get_vector(self,FS=None):
+        """ Returns the measurement output along all three axes (x,y,z),
+        read in a single burst transaction. Block data update is enabled so
+        that all axes stem from the same sample. Pass the fullscale 'FS' to
+        slightly speed up the interpreter. """
+        if self.get_config(True,'BDU')['BDU'] != 1:
+            self.config(BDU=1)
+        if FS == None:
+            FS = self._conf_reg['FS'][4][self.get_config(True,'FS')['FS']]
+        data = self.transaction(*self._data_seg['XYZ'])[0]
+        return tuple(FS*x/(2.0**15) for x in LSbMSb2ints(data))
+
+    def decode_raw(self,data,FS=None):
+        """ Converts raw outputs (rows of six bytes, as read by get_vector)
+        to an (N,3) array of (x,y,z) fields. Pass the fullscale 'FS' to
+        avoid reading it from the device. """
+        if FS == None:
+            FS = self._conf_reg['FS'][4][self.get_config(True,'FS')['FS']]
+        return decode_lsm(data,FS)
+
     def get(self):
         """ Short-hand for getting a single measurement from the device. """
         if self.cycle == None:
@@ -795,6 +1464,20 @@ class LSM9DS1_MAG(I2c_device):
             self.cycle.append(self.cycle.pop(0))
         # return value
         return self.get_output(axis)
+
+    def get_all(self):
+        """ Returns the field along all three axes (x,y,z); see get_vector. """
+        return self.get_vector()
+
+    def get_all_raw(self):
+        """ Raw version of get_all: the six output bytes of all three axes. """
+        if self.get_config(True,'BDU')['BDU'] != 1:
+            self.config(BDU=1)
+        return self.transaction(*self._data_seg['XYZ'])[0]
+
+    def raw_settings(self):
+        """ The current fullscale 'FS'; see decode_raw. """
+        return {'FS':self._conf_reg['FS'][4][self.get_config(True,'FS')['FS']]}
     
     
 # ----- LSM9DS1_ACC: iNEMO interial module: 3D accelerometer, ST -----
@@ -809,7 +1492,7 @@ class LSM9DS1_ACC(I2c_device):
     _dev_class = DEV_MEAS
     _valid_addr = [0x6a,0x6b]
     _default = {\
-        'bus':smbus.SMBus(1),\
+        'bus':1,\
         'addr':0x6b,\
         'cycle':None,\
         'mspec':10,\
@@ -823,6 +1506,11 @@ class LSM9DS1_ACC(I2c_device):
     GYR = 0
     ACC = 10
     TMP = 20
+    # FIFO slots per read transaction (gyroscope and accelerometer burst of
+    # each slot, within the I2C_RDWR message limit), and the fill level at
+    # which stream() drains the 32-slot FIFO
+    FIFO_BURST = I2C_RDWR_MAX_MSGS//4
+    FIFO_DRAIN = 2*FIFO_BURST
     
     # Configuration registers, combined with status registers;
     # there is a lot going on here, since many of the settings depend
@@ -883,7 +1571,22 @@ class LSM9DS1_ACC(I2c_device):
         'STOP_ON_FTH':(0x23,0,1,'Enable FIFO threshold',[0,1]),\
         'ST_G':(0x24,2,1,'Gyro self test enable',[0,1]),\
         'ST_XL':(0x24,0,1,'Acc self test enable',[0,1]),\
+        'FMODE':(0x2e,5,3,'FIFO mode',['BYPASS','FIFO',None,'CONT-FIFO',\
+                                       'BYPASS-CONT',None,'CONT',None]),\
+        'FTH':(0x2e,0,5,'FIFO threshold level',range(2**5)),\
+        'FIFO_FTH':(0x2f,7,1,'FIFO threshold reached',[0,1]),\
+        'OVRN':(0x2f,6,1,'FIFO overrun',[0,1]),\
+        'FSS':(0x2f,0,6,'Number of unread FIFO samples',range(2**6)),\
     }
+    # status registers and self-clearing bits
+    _volatile = {'IG_XL':0,'IG_G':0,'INACT':0,'BOOT_STATUS':0,\
+                 'TDA':0,'GDA':0,'XLDA':0,\
+                 'FIFO_FTH':0,'OVRN':0,'FSS':0,\
+                 'BOOT':0,'SW_RESET':0}
+    _resets = ('BOOT','SW_RESET',)
+    # quantities returned by get_all()
+    _outputs = ('gx','gy','gz','ax','ay','az','temp',)
+    _raw_nbytes = 14
 
     # Data register (6 x 8Bit, see datasheet)
     _data_reg = {\
@@ -894,6 +1597,9 @@ class LSM9DS1_ACC(I2c_device):
         'X_XL_LO':(0x28,1,), 'X_XL_HI':(0x29,1,),\
         'Y_XL_LO':(0x2a,1,), 'Y_XL_HI':(0x2b,1,),\
         'Z_XL_LO':(0x2c,1,), 'Z_XL_HI':(0x2d,1,),\
+        # bursts (with IF_ADD_INC set): temperature, status and gyroscope
+        # outputs; gyroscope outputs; accelerometer outputs
+        'TMP_G':(0x15,9,), 'G':(0x18,6,), 'XL':(0x28,6,),\
     }
 
     ## @@ Not implemented (yet): comparator interrupts and offsets.
@@ -908,7 +1614,7 @@ class LSM9DS1_ACC(I2c_device):
         if axis == 0: (reg_lo,reg_hi) = ('X_G_LO','X_G_HI')
         elif axis == 1: (reg_lo,reg_hi) = ('Y_G_LO','Y_G_HI')
         elif axis == 2: (reg_lo,reg_hi) = ('Z_G_LO','Z_G_HI')
-        (LSb,MSb) = (self.get_raw(reg_lo),self.get_raw(reg_hi))
+        (LSb,MSb) = self.get_raw_multi(reg_lo,reg_hi)
         # return properly scaled measurement
         if FS == None:
             return twoscompl2int(MSbLSb2int(MSb,LSb),n=16)/(2.0**15)
@@ -921,7 +1627,7 @@ class LSM9DS1_ACC(I2c_device):
         if axis == 0: (reg_lo,reg_hi) = ('X_XL_LO','X_XL_HI')
         elif axis == 1: (reg_lo,reg_hi) = ('Y_XL_LO','Y_XL_HI')
         elif axis == 2: (reg_lo,reg_hi) = ('Z_XL_LO','Z_XL_HI')
-        (LSb,MSb) = (self.get_raw(reg_lo),self.get_raw(reg_hi))
+        (LSb,MSb) = self.get_raw_multi(reg_lo,reg_hi)
         # return properly scaled measurement
         if FS == None:
             return 1.0*twoscompl2int(MSbLSb2int(MSb,LSb),n=16)/(2.0**15)
@@ -932,13 +1638,113 @@ class LSM9DS1_ACC(I2c_device):
         """ Returns the measurement output along 'axis'. Pass the fullscale
         'FS' to slightly speed up the interpreter. """
         (reg_lo,reg_hi) = ('TMP_LO','TMP_HI')
-        (LSb,MSb) = (self.get_raw(reg_lo),self.get_raw(reg_hi))
+        (LSb,MSb) = self.get_raw_multi(reg_lo,reg_hi)
         # return properly scaled measurement
         if FS == None:
             return twoscompl2int(MSbLSb2int(MSb,LSb),n=16)/(2.0**15)
         else:
             return FS*twoscompl2int(MSbLSb2int(MSb,LSb),n=16)/(2.0**15)
 
+    def get_snapshot(self,FS_G=None,FS_XL=None):
+        """ Returns the full output of the device, ((gx,gy,gz),(ax,ay,az),
+        temp), read with two register bursts in a single transaction. Enables
+        the register auto-increment and block data update (all axes stem from
+        the same sample). Fullscales are applied as in get_gyro, get_acc and
+        get_temp. """
+        if self.get_config(True,'BDU','IF_ADD_INC') != \
+           {'BDU':1,'IF_ADD_INC':1}:
+            self.config(BDU=1,IF_ADD_INC=1)
+        (tg,xl) = self.transaction(*(self._data_seg['TMP_G'] \
+                                     + self._data_seg['XL']))
+        # temperature (0x15-0x16), status (0x17), gyroscope (0x18-0x1d)
+        (temp,) = LSbMSb2ints(tg[0:2])
+        gyro = LSbMSb2ints(tg[3:9])
+        acc = LSbMSb2ints(xl)
+        FS_G = 1.0 if FS_G == None else FS_G
+        FS_XL = 1.0 if FS_XL == None else FS_XL
+        return (tuple(FS_G*g/(2.0**15) for g in gyro),\
+                tuple(FS_XL*a/(2.0**15) for a in acc),\
+                temp/(2.0**15))
+
+    def read_fifo(self,nslots):
+        """ Reads 'nslots' slots from the FIFO. Returns an integer NumPy array
+        with one row (gx,gy,gz,ax,ay,az) of raw outputs per slot. Each slot
+        is read as a gyroscope and an accelerometer burst; as many slots as
+        the I2C_RDWR message limit allows ('FIFO_BURST') are read in one
+        transaction. """
+        per = self.FIFO_BURST
+        slot = self._data_seg['G'] + self._data_seg['XL']
+        data = []
+        for i in range(0,nslots,per):
+            data += self.transaction(*(slot*min(per,nslots-i)))
+        raw = np.array(data,dtype=np.uint8).reshape(nslots,12)
+        return raw.view('<i2').astype(int)
+
+    def decode_raw(self,data,FS_G=None,FS_XL=None):
+        """ Converts raw outputs (rows of twelve bytes, gyroscope then
+        accelerometer burst, as in read_fifo) to an (N,6) array of rows
+        (gx,gy,gz,ax,ay,az). Rows of fourteen bytes (see get_all_raw) also
+        hold the temperature, as a seventh column. Fullscales are applied as
+        in get_gyro, get_acc and get_temp. """
+        FS_G = 1.0 if FS_G == None else FS_G
+        FS_XL = 1.0 if FS_XL == None else FS_XL
+        FS = (FS_G,)*3 + (FS_XL,)*3 + (1.0,)
+        data = np.asarray(data,dtype=np.uint8)
+        return decode_lsm(data,FS[0:data.shape[-1]//2])
+
+    def stream(self,ODR=6,nframes=None,duration=None,FS_G=None,FS_XL=None):
+        """ Generator streaming gyroscope and accelerometer outputs through the
+        on-chip FIFO (continuous mode) at the output data rate with index
+        'ODR' in the 'ODR_G' table (default: 952 Hz). Sleeps until the FIFO
+        holds about 'FIFO_DRAIN' slots (the FIFO threshold), judged from the
+        fill level and the data rate, then drains it in read transactions of
+        'FIFO_BURST' slots each; yields NumPy arrays with one row
+        (t,gx,gy,gz,ax,ay,az) per sample, where 't' is the sample time on the
+        monotonic clock, reconstructed from the data rate. Stops after
+        'nframes' samples or 'duration' seconds (or when closed) and disables
+        the FIFO. Fullscales are applied as in get_gyro and get_acc. FIFO
+        overruns (lost samples) are counted in 'fifo_overruns'. """
+        rate = self._conf_reg['ODR_G'][4][ODR]
+        assert rate not in ('PD',None),"Invalid output data rate!"
+        FS_G = 1.0 if FS_G == None else FS_G
+        FS_XL = 1.0 if FS_XL == None else FS_XL
+        per = self.FIFO_BURST
+        # set data rate, reset the FIFO (bypass mode), then start collecting
+        self.config(ODR_G=ODR,BDU=1,IF_ADD_INC=1,FIFO_EN=1,FMODE=0)
+        self.config(FMODE=6,FTH=self.FIFO_DRAIN)
+        t0 = time.monotonic()
+        k = 0 # number of samples streamed so far
+        self.fifo_overruns = 0
+        try:
+            while (nframes == None or k < nframes) and \
+                  (duration == None or time.monotonic() - t0 < duration):
+                src = self.get_config(True,'FSS','OVRN')
+                n = src['FSS']
+                if src['OVRN']:
+                    # samples were lost; re-anchor the time base on the
+                    # newest sample in the FIFO
+                    self.fifo_overruns += 1
+                    t0 = time.monotonic() - (k + n - 1)/rate
+                # wait for the threshold level (or the last samples)
+                need = self.FIFO_DRAIN
+                if nframes != None: need = min(need,nframes - k)
+                if n < need:
+                    time.sleep((need - n + 0.5)/rate)
+                    continue
+                if nframes != None: n = min(n,nframes - k)
+                # full read transactions only; the rest waits for the next
+                # block, unless they are the last samples
+                if nframes == None or n < nframes - k: n -= n % per
+                raw = self.read_fifo(n)
+                block = np.empty((n,7))
+                block[:,0] = t0 + np.arange(k,k+n)/rate
+                block[:,1:4] = raw[:,0:3]*(FS_G/2.0**15)
+                block[:,4:7] = raw[:,3:6]*(FS_XL/2.0**15)
+                k += n
+                yield block
+        finally:
+            self.config(FMODE=0,FIFO_EN=0)
+
     def get_output(self,spec,FS=None):
         """ Returns the output specified by SPEC in terms of the class'
         constants (AX_X, AX_Y, AX_Z) + (GYR, ACC, TMP). """
@@ -970,55 +1776,169 @@ class LSM9DS1_ACC(I2c_device):
         #self.group['switch'].disable(self.group['me'])
         return self.get_output(spec)
 
+    def get_all(self):
+        """ Returns the gyroscope and accelerometer outputs and the
+        temperature, (gx,gy,gz,ax,ay,az,temp), from a single snapshot
+        (see get_snapshot). """
+        (gyro,acc,temp) = self.get_snapshot()
+        return gyro + acc + (temp,)
+
+    def get_all_raw(self):
+        """ Raw version of get_all: the output bytes of the gyroscope, the
+        accelerometer and the temperature (fourteen bytes, see decode_raw)
+        from a single snapshot (see get_snapshot). """
+        if self.get_config(True,'BDU','IF_ADD_INC') != \
+           {'BDU':1,'IF_ADD_INC':1}:
+            self.config(BDU=1,IF_ADD_INC=1)
+        (tg,xl) = self.transaction(*(self._data_seg['TMP_G'] \
+                                     + self._data_seg['XL']))
+        return tg[3:9] + xl + tg[0:2]
+
+
+
+# ----- I2c_switch: common base of the TCA954x isolating i2c switches -----
+class I2c_switch(I2c_device):
+    """ Common base of TI's TCA954x isolating i2c switches. A single control
+    byte selects the channels: channel i is connected to the upstream bus if
+    bit i is set. The last control byte written is cached, so that routing to
+    a channel that is already selected costs no bus traffic and the settings
+    are known without reading the switch. Call resync() (or invalidate())
+    when something other than this instance may have touched the switch.
+
+    A switch may itself sit behind a channel of another switch; give its
+    position as 'group' = {'me':channel,'switch':upstream_switch}, like for
+    the devices. """
 
-
-# ----- TCA9545A: Four-channel isolating i2c switch, Texas Instruments -----
-class TCA9545A(I2c_device):
-    """ TI's TCA9545A is a four-channel isolating i2c switch with one interrupt 
-    line per channel. A single control byte is used to write/read its settings. 
-    (ST-2016-09) ."""
-    ## @@ UNTESTED!
-    
-    ## @@ Not implemented (yet): interrupt support
-
-    _dev_type = 'TCA9545A'
     _dev_class = DEV_SWITCH
     _default = {\
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x70,\
+        'group':None,\
         }
-    _valid_addr = (0x70,0x71,0x72,0x73,)
+    NCHANNELS = 8
+    _ctrl = None # cached control byte (None: unknown)
+    # all switches, to isolate the others on the same bus when routing
+    _switches = weakref.WeakSet()
 
     def __init__(self,**kwargs):
         I2c_device.__init__(self,**kwargs)
-        
+        self._ctrl = None
+        I2c_switch._switches.add(self)
+
     def config(self,*args,**kwargs): raise NotImplementedError
     def get_config(self,*args,**kwargs): raise NotImplementedError
     def config_info(self,*args,**kwargs): raise NotImplementedError
 
+    def path(self):
+        """ Returns the list of switches leading to (and including) this one,
+        starting with the one connected directly to the bus. """
+        path = [self]
+        while path[0].group != None:
+            path.insert(0,path[0].group['switch'])
+        return path
+
+    def reachable(self):
+        """ True if, as far as known from the cached settings, every switch
+        upstream of this one connects the channel leading to it. """
+        for sw in self.path()[1:]:
+            up = sw.group['switch']._ctrl
+            if up is not None and not (up >> sw.group['me']) & 1:
+                return False
+        return True
+
+    def set_focus(self):
+        """ Connects the bus to this switch: every upstream switch is set to
+        the channel leading here (and only that channel). """
+        path = self.path()
+        for (up,down) in zip(path[:-1],path[1:]):
+            up.set_ctrl(1 << down.group['me'])
+
+    def set_ctrl(self,ctrl):
+        """ Writes the control byte 'ctrl', unless it is the cached one. """
+        if ctrl == self._ctrl:
+            return
+        try:
+            self.write(ctrl=ctrl)
+        except (IOError,OSError):
+            # the switch may or may not have taken the new setting
+            self._ctrl = None
+            raise
+        self._ctrl = ctrl
+
+    def get_ctrl(self):
+        """ Returns the control byte; read from the switch only if unknown. """
+        if self._ctrl is None:
+            self.resync()
+        return self._ctrl
+
+    def invalidate(self,*args):
+        """ Forgets the cached control byte; it is read from the switch when
+        next needed. """
+        self._ctrl = None
+
+    def resync(self):
+        """ Reads the control byte back from the switch, replacing the cached
+        one. Returns the channel settings (see get_settings). """
+        self.set_focus()
+        self._ctrl = self.read() & ((1 << self.NCHANNELS)-1)
+        return byte2bits(self._ctrl,self.NCHANNELS)
+
+    @classmethod
+    def resync_all(cls):
+        """ Re-reads the control bytes of all switches, upstream ones first. """
+        for sw in sorted(cls._switches,key=lambda sw: len(sw.path())):
+            sw.resync()
+
+    def isolate_others(self):
+        """ Disables all other switches on the same bus (except for the ones
+        leading to this switch), so that devices behind them cannot answer
+        alongside the devices behind this switch. Only switches that may have
+        channels enabled and are currently reachable are written to. """
+        path = self.path()
+        others = [sw for sw in I2c_switch._switches if sw not in path \
+                  and sw._bus == self._bus]
+        # upstream switches first; disabling those cuts off the ones behind
+        for sw in sorted(others,key=lambda sw: len(sw.path())):
+            if sw._ctrl != 0 and sw.reachable():
+                sw.set_ctrl(0)
+
+    def select(self,me,channels=None):
+        """ Routes the bus to channel 'me' of this switch: connects the switch
+        (see set_focus), isolates the other switches on the bus (see
+        isolate_others), and enables channel 'me' while disabling 'channels'
+        (default: all other channels). Writes only control bytes that change;
+        selecting the current channel again costs no bus traffic. """
+        self.set_focus()
+        self.isolate_others()
+        if channels is None:
+            ctrl = 1 << me
+        else:
+            mask = 0
+            for ch in channels: mask |= 1 << ch
+            ctrl = (self.get_ctrl() & ~mask) | (1 << me)
+        self.set_ctrl(ctrl)
+
     def set_channels(self,settings):
         """ Enables/disables channels according to bit xi=1/0 in 
-        settings = [x0,x1,x2,x3]."""
-        assert type(settings) is list and len(settings) == 4
-        # @@ interrupts not implemented for now 
-        ctrl_byte = 0b0000
-        # mind the order: xxxx3210
+        settings = [x0,x1,...]."""
+        assert type(settings) is list and len(settings) == self.NCHANNELS
+        ctrl_byte = 0
+        # mind the order: 76543210
         for s in reversed(settings):
-            assert s in (0,1),"Channel settings need to be 0 or 1!"
+            assert s in (0,1,),"Channel settings need to be 0 or 1!"
             ctrl_byte = (ctrl_byte << 1) + s
-        self.write(ctrl=ctrl_byte)
+        self.set_focus()
+        self.set_ctrl(ctrl_byte)
 
     def get_settings(self):
-        """ Returns the current channel settings [x0,x1,x2,x3]."""
-        data = byte2bits(self.read())
-        # only return the channel settings (4 LSB), discard interrupts (4 MSB)
-        # mind the order: xxxx3210
-        return data[0:4]
-    
+        """ Returns the current channel settings [x0,x1,...]."""
+        self.set_focus()
+        return byte2bits(self.get_ctrl(),self.NCHANNELS)
+
     def enable(self, channels):
         """ Enables one or more channels."""
         if type(channels) is not list: channels = [channels]
-        assert max(channels) <= 3; assert min(channels) >= 0
+        assert max(channels) < self.NCHANNELS; assert min(channels) >= 0
         settings = self.get_settings()
         for ch in channels: settings[ch] = 1
         self.set_channels(settings)
@@ -1026,79 +1946,111 @@ class TCA9545A(I2c_device):
     def disable(self, channels):
         """ Disables one or more channels."""
         if type(channels) is not list: channels = [channels]
-        assert max(channels) <= 3; assert min(channels) >= 0
+        assert max(channels) < self.NCHANNELS; assert min(channels) >= 0
         settings = self.get_settings()
         for ch in channels: settings[ch] = 0
         self.set_channels(settings)
 
     def enable_all(self):
         """ Enables all channels."""
-        self.set_channels([1,1,1,1])
+        self.set_channels([1]*self.NCHANNELS)
 
     def disable_all(self):
         """ Disables all channels."""
-        self.set_channels([0,0,0,0])
+        self.set_channels([0]*self.NCHANNELS)
 
 
+# ----- TCA9545A: Four-channel isolating i2c switch, Texas Instruments -----
+class TCA9545A(I2c_switch):
+    """ TI's TCA9545A is a four-channel isolating i2c switch with one interrupt 
+    line per channel. A single control byte is used to write/read its settings. 
+    (ST-2016-09) ."""
+    ## @@ UNTESTED!
+    
+    ## @@ Not implemented (yet): interrupt support
+    ## (interrupt flags in the 4 MSB are discarded when reading)
+
+    _dev_type = 'TCA9545A'
+    _valid_addr = (0x70,0x71,0x72,0x73,)
+    NCHANNELS = 4
+
         
 # ----- TCA9548A: Eight-channel isolating i2c switch, Texas Instruments -----
-class TCA9548A(I2c_device):
+class TCA9548A(I2c_switch):
     """ TI's TCA9548A is an eight-channel isolating i2c switch with reset. \
     (ST-2017-02) ."""
     
     _dev_type = 'TCA9548A'
-    _default = {\
-        'bus':smbus.SMBus(1), \
-        'addr':0x70,\
-        }
     _valid_addr = (0x70,0x71,0x72,0x73,0x74,0x75,0x76,0x77)
+    NCHANNELS = 8
 
-    def __init__(self,**kwargs):
-        I2c_device.__init__(self,**kwargs)
-        
-    def config(self,*args,**kwargs): raise NotImplementedError
-    def get_config(self,*args,**kwargs): raise NotImplementedError
-    def config_info(self,*args,**kwargs): raise NotImplementedError
-
-    def set_channels(self,settings):
-        """ Enables/disables channels according to bit xi=1/0 in 
-        settings = [x0,x1,x2,x3,x4,x5,x6,x7]."""
-        assert type(settings) is list and len(settings) == 8
-        # @@ interrupts not implemented for now 
-        ctrl_byte = 0
-        # mind the order: xxxx3210
-        for s in reversed(settings):
-            assert s in (0,1,),"Channel settings need to be 0 or 1!"
-            ctrl_byte = (ctrl_byte << 1) + s
-        self.write(ctrl=ctrl_byte)
-
-    def get_settings(self):
-        """ Returns the current channel settings [x0,x1,x2,x3,x4,x5,x6,x7]."""
-        return byte2bits(self.read())
-    
-    def enable(self, channels):
-        """ Enables one or more channels."""
-        if type(channels) is not list: channels = [channels]
-        assert max(channels) <= 7; assert min(channels) >= 0
-        settings = self.get_settings()
-        for ch in channels: settings[ch] = 1
-        self.set_channels(settings)
-
-    def disable(self, channels):
-        """ Disables one or more channels."""
-        if type(channels) is not list: channels = [channels]
-        assert max(channels) <= 7; assert min(channels) >= 0
-        settings = self.get_settings()
-        for ch in channels: settings[ch] = 0
-        self.set_channels(settings)
-
-    def enable_all(self):
-        """ Enables all channels."""
-        self.set_channels([1,1,1,1,1,1,1,1])
 
-    def disable_all(self):
-        """ Disables all channels."""
-        self.set_channels([0,0,0,0,0,0,0,0])
+        
+# ----- Read scheduling: visiting devices in an order that spares the switches
+def route(device):
+    """ Returns the list of (switch,channel) pairs leading from the bus to
+    'device' (upstream switch first); empty if the device is not part of a
+    group. """
+    group = getattr(device,'group',None)
+    if group == None:
+        return []
+    sw = group['switch']
+    return route(sw) + [(sw,group['me'])]
+
+def device_name(device):
+    """ A name for 'device' built from type, bus, switch route and address,
+    e.g. 'HIH8121[1:0x71.3>0x27]'. """
+    path = "".join(["0x{:02X}.{}>".format(sw.addr,ch) \
+                    for (sw,ch) in route(device)])
+    bus = "" if device.busnum == None else "{}:".format(device.busnum)
+    return "{}[{}{}0x{:02X}]".format(device.dev_type,bus,path,device.addr)
+
+def route_active(path):
+    """ True if, according to the cached switch settings, all switches in the
+    route 'path' (see route) have their channel selected. """
+    for (sw,ch) in path:
+        if sw._ctrl is None or not (sw._ctrl >> ch) & 1:
+            return False
+    return True
+
+def schedule_reads(devices):
+    """ Returns a visiting order (a list of indices into 'devices') that
+    minimises switch writes when reading all of 'devices' once: devices are
+    grouped by bus, then by switch and channel along their routes, so each
+    switch channel is selected once per pass. The order is rotated so that
+    the route selected right now comes first. Repeated entries of the same
+    device keep their relative order, so cycling devices still hand out
+    their readings in the order of 'devices'. Use like
+        out = [None]*len(devices)
+        for i in order: out[i] = devices[i].get() """
+    buses = []
+    keys = []
+    for d in devices:
+        if d._bus not in buses: buses.append(d._bus)
+        keys.append((buses.index(d._bus),)\
+                    +tuple((sw.addr,ch) for (sw,ch) in route(d)))
+    # stable sort: keeps the order of repeated devices
+    order = sorted(range(len(devices)),key=lambda i: keys[i])
+    return active_first(order,[route(d) for d in devices])
+
+def active_first(order,paths):
+    """ Rotates the visiting 'order' (see schedule_reads) so that it starts
+    with the first device whose route is selected right now (if any).
+    'paths' holds the route of every device (see route). """
+    for (k,i) in enumerate(order):
+        if len(paths[i]) > 0 and route_active(paths[i]):
+            return order[k:] + order[:k]
+    return order
+
+def read_scheduled(devices,order=None):
+    """ Calls get() on each of 'devices' in the visiting 'order' (see
+    schedule_reads; computed if not given) and returns the readings in the
+    order of 'devices'. """
+    if order is None: order = schedule_reads(devices)
+    out = [None]*len(devices)
+    for i in order:
+        out[i] = devices[i].get()
+    return out
 
 
         
@@ -1109,11 +2061,12 @@ class HIH8121(I2c_device):
     programming. (ST-2016-09)"""
 
     BIT_DEPTH = 14
+    T_MEAS = 36.65e-3 # duration of a measurement cycle (s; typical)
     _dev_type = 'HIH8121'
     _dev_class = DEV_MEAS
     _valid_addr = [0x27]
     _default = {\
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x27, \
         'hum_range':100.0, \
         'hum_offset':0.0, \
@@ -1126,6 +2079,9 @@ class HIH8121(I2c_device):
     # addressing humidity and temperature data
     HUM = 0
     TMP = 1
+    # quantities returned by get_all()
+    _outputs = ('hum','temp','status',)
+    _raw_nbytes = 4
 
     def __init__(self,**kwargs):
         """ Initialize instance """
@@ -1146,7 +2102,11 @@ class HIH8121(I2c_device):
         (humidity,temperature,status). Will read stale data if no new
         measurements are requested.
         Warning: does not set the focus to this sensor if part of a group! """
-        data = self.read(ctrl=0x00,nbytes=4)
+        return self.decode_data(self.read(ctrl=0x00,nbytes=4))
+
+    def decode_data(self,data):
+        """ Converts the four data bytes read from the chip to a tuple
+        (humidity,temperature,status). """
         # first two bits give the chip's status 0b00 for normal; 0b01 for stale data
         status = data[0]>>6 
         # next 6+8 bits are the humidity data
@@ -1158,32 +2118,42 @@ class HIH8121(I2c_device):
         temperature = self.temp_range*temp_raw/(2**self.BIT_DEPTH-2) \
                       + self.temp_offset
         return(humidity,temperature,status)
+
+    def decode_raw(self,data,hum_range=None,hum_offset=None,\
+                   temp_range=None,temp_offset=None):
+        """ Batch version of decode_data: converts rows of four data bytes to
+        arrays (humidity,temperature,status). Ranges and offsets default to
+        the current ones. """
+        if hum_range == None: hum_range = self.hum_range
+        if hum_offset == None: hum_offset = self.hum_offset
+        if temp_range == None: temp_range = self.temp_range
+        if temp_offset == None: temp_offset = self.temp_offset
+        return decode_hih(data,hum_range,hum_offset,temp_range,temp_offset,\
+                          self.BIT_DEPTH)
+
+    def raw_settings(self):
+        """ The current ranges and offsets; see decode_raw. """
+        return {'hum_range':self.hum_range,'hum_offset':self.hum_offset,\
+                'temp_range':self.temp_range,'temp_offset':self.temp_offset}
     
     def set_focus(self):
         """ Sets the focus on this  sensor, if it is part of a group. This is 
         done by choosing the switch settings that exclusively targets this 
         HIH sensor, muting all others in the group. """
-        if self.group == None:
-            # do nothing, if not part of a group
-            pass
-        else:
-            # build switch settings
-            sw = self.group['switch'].get_settings()
-            for ch in self.group['channels']:
-                sw[ch] = 0
-            sw[self.group['me']] = 1
-            # set switch to disable all channels in group except for 'mine'
-            self.group['switch'].set_channels(sw)
+        if self.group != None:
+            # enable 'my' channel, disabling all others in group; the switch
+            # is only written to if its settings change
+            self.group['switch'].select(self.group['me'],\
+                                        self.group['channels'])
             
 
     def get(self):
         """ Short-hand for getting a single measurement from the device. """
         # set focus to 'me' if part of a group
         self.set_focus()
-        # request new measurement and retrieve values
-        self.request_measurement()
-        data = self.get_data()
-        
+        # request new measurement and retrieve values in one transaction
+        data = self.transaction((I2C_WR,[0x00]),(I2C_RD,4))[0]
+        data = self.decode_data(data)
         if self.cycle == None:
             # @@ not a great name
             i = self.get_temp
@@ -1191,9 +2161,73 @@ class HIH8121(I2c_device):
             # get measurement along next axis in cycle; advance cycle
             i = self.cycle[0]
             self.cycle.append(self.cycle.pop(0))
-        # return value
-        self.group['switch'].disable(self.group['me'])
+        # return value; the channel stays selected for the next reading
         return data[i]
+
+    def get_all(self):
+        """ Returns (humidity,temperature,status) from a single measurement
+        request and read; see get. """
+        self.set_focus()
+        data = self.transaction((I2C_WR,[0x00]),(I2C_RD,4))[0]
+        return self.decode_data(data)
+
+    def get_all_raw(self):
+        """ Raw version of get_all: the four data bytes. """
+        self.set_focus()
+        return self.transaction((I2C_WR,[0x00]),(I2C_RD,4))[0]
+
+    @classmethod
+    def sweep(cls,sensors,timeout=0.1,order=None):
+        """ Measures all HIH sensors in 'sensors' at once, returning a list
+        of (humidity,temperature,status) tuples in the order of 'sensors'.
+        All sensors sit at the same address, so every switch holding sensors
+        is set to enable all of their channels and a single measurement
+        request reaches all of them. After one measurement cycle, each sensor
+        is selected alone and read. Sensors still busy (stale data) are
+        re-read until 'timeout' (s) after the measurement cycle. Buses
+        without combined transfers are read as in get_data. The sensors are
+        read in the visiting 'order' (see schedule_reads; computed if not
+        given). """
+        # broadcast the measurement request, one switch at a time
+        switches = []
+        for s in sensors:
+            sw = None if s.group == None else s.group['switch']
+            if sw not in switches: switches.append(sw)
+        for sw in switches:
+            group = [s for s in sensors if s.group != None \
+                     and s.group['switch'] is sw]
+            if sw is None:
+                # not behind a switch; each gets its own request
+                for s in sensors:
+                    if s.group == None: s.request_measurement()
+                continue
+            (mask,ctrl) = (0,0)
+            for s in group:
+                for ch in s.group['channels']: mask |= 1 << ch
+                ctrl |= 1 << s.group['me']
+            sw.set_focus()
+            sw.isolate_others()
+            sw.set_ctrl((sw.get_ctrl() & ~mask) | ctrl)
+            group[0].request_measurement()
+        t_done = time.perf_counter() + cls.T_MEAS
+        time.sleep(cls.T_MEAS)
+        # read back, visiting the sensors in switch order
+        out = [None]*len(sensors)
+        if order is None: order = schedule_reads(sensors)
+        for i in order:
+            s = sensors[i]
+            s.set_focus()
+            combined = s.combined_transfers()
+            while True:
+                if combined:
+                    data = s.decode_data(s.transaction((I2C_RD,4))[0])
+                else:
+                    data = s.get_data()
+                if data[2] != 1 or time.perf_counter() > t_done + timeout:
+                    break
+                time.sleep(1e-3)
+            out[i] = data
+        return out
     
 # ----- HIH8120, 7121, 7120: only differ from HIH8121 in accuracy and
 # ----- package (x121 with filter)
@@ -1221,7 +2255,7 @@ class DAC8574(I2c_device):
     _dev_type = 'DAC8574'
     _dev_class = DEV_DAC
     _valid_addr = [0x4c,0x4d,0x4e,0x4f]
-    _default = {'bus':smbus.SMBus(1), \
+    _default = {'bus':1, \
                'addr':0x4c, \
                'ext_addr':0b00, \
                'Vref':2.486, \
@@ -1253,11 +2287,12 @@ class DAC8574(I2c_device):
     def __init__(self,**kwargs):
         """ Initialize instance """
         I2c_device.__init__(self,**kwargs)
-        # update data register ctrl bytes with extended address
-        for reg in self._data_reg:
-            self._data_reg[reg] = \
-                (self._data_reg[reg][0] + (self.ext_addr << 6),\
-                 self._data_reg[reg][1],)
+        # update data register ctrl bytes with extended address (per
+        # instance, leaving the class' table untouched)
+        self._data_reg = {reg:(self._data_reg[reg][0] + (self.ext_addr << 6),\
+                               self._data_reg[reg][1],) \
+                          for reg in self._data_reg}
+        self._data_seg = compile_data_reg(self._data_reg)
             
     # architecture without many registers
     def config(self,*args,**kwargs): raise NotImplementedError
@@ -1459,12 +2494,15 @@ class MCP9808(I2c_device):
     _dev_class = DEV_MEAS
     _valid_addr = [0x18]
     _default = {\
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x18, \
         'group':None,\
         'cycle':None,\
         'data_index':0,\
         }
+    # quantities returned by get_all()
+    _outputs = ('temp',)
+    _raw_nbytes = 2
     
     def __init__(self,**kwargs):
         """ Initialize instance """
@@ -1503,22 +2541,21 @@ class MCP9808(I2c_device):
             return (self.buf[0] * 16 + self.buf[1] / 16.0) - 256
         # if T > 0 C, calculate
         return self.buf[0] * 16 + self.buf[1] / 16.0
+
+    def decode_raw(self,data):
+        """ Converts ambient temperature register contents (rows of two or
+        three bytes, as read by get_data) to temperatures in C. """
+        return decode_mcp9808(data)
     
     def set_focus(self):
         """ Sets the focus on this  sensor, if it is part of a group. This is 
         done by choosing the switch settings that exclusively targets this 
-        HIH sensor, muting all others in the group. """
-        if self.group == None:
-            # do nothing, if not part of a group
-            pass
-        else:
-            # build switch settings
-            sw = self.group['switch'].get_settings()
-            for ch in self.group['channels']:
-                sw[ch] = 0
-            sw[self.group['me']] = 1
-            # set switch to disable all channels in group except for 'mine'
-            self.group['switch'].set_channels(sw)
+        MCP9808 sensor, muting all others in the group. """
+        if self.group != None:
+            # enable 'my' channel, disabling all others in group; the switch
+            # is only written to if its settings change
+            self.group['switch'].select(self.group['me'],\
+                                        self.group['channels'])
             
     def get(self):
         """ Short-hand for getting a single measurement from the device. """
@@ -1529,6 +2566,16 @@ class MCP9808(I2c_device):
         data = self.get_data()
         # return value
         return data
+
+    def get_all(self):
+        """ Returns the temperature as a one-element tuple; see get. """
+        return (self.get(),)
+
+    def get_all_raw(self):
+        """ Raw version of get_all: the two bytes of the ambient temperature
+        register. """
+        self.set_focus()
+        return self.read(ctrl=0x05,nbytes=2)
     
 
 
@@ -1548,7 +2595,7 @@ class LSM9DS0_XM(I2c_device):
     _dev_class = DEV_MEAS
     _valid_addr = [0x1d]
     _default = {\
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x1d, \
         'group':None,\
         'cycle':None,\
@@ -1742,7 +2789,7 @@ class LSM9DS0_G(I2c_device):
     _dev_class = DEV_MEAS
     _valid_addr = [0x6b]
     _default = {\
-        'bus':smbus.SMBus(1), \
+        'bus':1, \
         'addr':0x6b, \
         'group':None,\
         'cycle':None,\
@@ -0,0 +1,211 @@
+# Micro-benchmarks of the py2C hot paths on the simulated bus (see pySimBus).
+# Each case is run against a latency-modelled bus and reports, per call, the
+# number of bus transactions and bytes, the modelled bus time and the CPU
+# time spent in Python. The results are compared against a stored baseline:
+# a case needing more transactions or more modelled bus time than in the
+# baseline fails the run (exit status 1). CPU times are only reported, as
+# they depend on the machine.
+#
+#   python pyBench.py             # run and compare against the baseline
+#   python pyBench.py --save      # run and store the results as baseline
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import py2C as i2c
+import pySimBus as sim
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                        'pyBench_baseline.json')
+# relative increase of transactions/bus time tolerated (conversion-ready
+# polling of the ADCs depends on timing)
+TOLERANCE = 0.05
+
+
+# ---------- CASES ----------
+# each case sets up its devices on the given (empty) simulated bus 1 and
+# returns the callable to benchmark
+
+def case_ads_single(bus):
+    bus.attach(sim.SimADS1115(inputs=(0.1,0.2,0.3,0.4)),0x48)
+    adc = i2c.ADS1115(addr=0x48)
+    adc.config(DR=7)
+    return adc.get
+
+def case_ads_cycled(bus):
+    bus.attach(sim.SimADS1115(inputs=(0.1,0.2,0.3,0.4)),0x48)
+    adc = i2c.ADS1115(addr=0x48,cycle=[0b100,0b101,0b110,0b111])
+    adc.config(DR=7)
+    return adc.get
+
+def case_ads_scan(bus):
+    bus.attach(sim.SimADS1115(inputs=(0.1,0.2,0.3,0.4)),0x48)
+    adc = i2c.ADS1115(addr=0x48,cycle=[0b100,0b101,0b110,0b111])
+    adc.config(DR=7)
+    return adc.get_all
+
+def case_hih_group(bus):
+    switch = sim.SimTCA9548A()
+    bus.attach(switch,0x70)
+    for ch in range(4):
+        bus.attach(sim.SimHIH8121(hum=40.0+ch),0x27,behind=(switch,ch))
+    tca = i2c.TCA9548A(addr=0x70)
+    hih = [i2c.HIH8121(group={'me':ch,'channels':[0,1,2,3],\
+                              'switch':tca}) for ch in range(4)]
+    def get():
+        # one sensor after the other, as listed in a logger
+        hih.append(hih.pop(0))
+        return hih[0].get()
+    return get
+
+def case_mcp(bus):
+    bus.attach(sim.SimMCP9808(temp=21.5),0x18)
+    return i2c.MCP9808().get
+
+def case_mag_get(bus):
+    bus.attach(sim.SimLSM9DS1_MAG(field=(0.1,0.2,0.3)),0x1c)
+    return i2c.LSM9DS1_MAG(addr=0x1c,cycle=[0,1,2]).get
+
+def case_mag_vector(bus):
+    bus.attach(sim.SimLSM9DS1_MAG(field=(0.1,0.2,0.3)),0x1c)
+    return i2c.LSM9DS1_MAG(addr=0x1c).get_vector
+
+def case_acc_get(bus):
+    bus.attach(sim.SimLSM9DS1_ACC(),0x6b)
+    return i2c.LSM9DS1_ACC(addr=0x6b).get
+
+def case_acc_snapshot(bus):
+    bus.attach(sim.SimLSM9DS1_ACC(),0x6b)
+    return i2c.LSM9DS1_ACC(addr=0x6b).get_snapshot
+
+def case_tca_set_channels(bus):
+    bus.attach(sim.SimTCA9548A(),0x70)
+    tca = i2c.TCA9548A(addr=0x70)
+    settings = [[1,0,0,0,0,0,0,0],[0,0,0,1,1,0,0,0]]
+    def set_channels():
+        settings.append(settings.pop(0))
+        tca.set_channels(settings[0])
+    return set_channels
+
+def case_acc_config(bus):
+    bus.attach(sim.SimLSM9DS1_ACC(),0x6b)
+    acc = i2c.LSM9DS1_ACC(addr=0x6b)
+    settings = [{'ODR_G':1,'FS_G':0,'ODR_XL':1,'FS_XL':0,'BDU':0},\
+                {'ODR_G':3,'FS_G':1,'ODR_XL':3,'FS_XL':2,'BDU':1}]
+    def config():
+        settings.append(settings.pop(0))
+        acc.config(**settings[0])
+    return config
+
+def case_acc_get_config(bus):
+    bus.attach(sim.SimLSM9DS1_ACC(),0x6b)
+    return i2c.LSM9DS1_ACC(addr=0x6b).get_config
+
+CASES = [\
+    ('ADS1115.get',case_ads_single),\
+    ('ADS1115.get (cycled)',case_ads_cycled),\
+    ('ADS1115.get_all (scan of 4)',case_ads_scan),\
+    ('HIH8121.get (mux group of 4)',case_hih_group),\
+    ('MCP9808.get',case_mcp),\
+    ('LSM9DS1_MAG.get (cycled)',case_mag_get),\
+    ('LSM9DS1_MAG.get_vector',case_mag_vector),\
+    ('LSM9DS1_ACC.get',case_acc_get),\
+    ('LSM9DS1_ACC.get_snapshot',case_acc_snapshot),\
+    ('TCA9548A.set_channels',case_tca_set_channels),\
+    ('LSM9DS1_ACC.config (5 fields)',case_acc_config),\
+    ('LSM9DS1_ACC.get_config',case_acc_get_config),\
+    ]
+
+
+# ---------- RUNNER ----------
+def run_case(setup,n=200,clock=100e3):
+    """ Runs the case 'setup' 'n' times (after one warm-up call) on a fresh
+    simulated bus clocked at 'clock' Hz. Returns the per-call averages
+    {'transactions','bytes','bus_time','cpu'} (times in s). """
+    # drop devices (and switches) of earlier cases
+    gc.collect()
+    bus = sim.SimBus(sim.LatencyModel.for_clock(clock))
+    i2c.set_bus(1,bus)
+    call = setup(bus)
+    call()
+    bus.reset_stats()
+    c0 = time.process_time()
+    for i in range(n):
+        call()
+    cpu = time.process_time() - c0
+    return {'transactions':bus.transactions/float(n),\
+            'bytes':bus.nbytes/float(n),\
+            'bus_time':bus.bus_time/n,\
+            'cpu':cpu/n}
+
+def run(n=200,clock=100e3):
+    """ Runs all cases; returns {case name: results} (see run_case). """
+    results = {}
+    for (name,setup) in CASES:
+        results[name] = run_case(setup,n,clock)
+    return results
+
+def compare(results,baseline,tolerance=TOLERANCE):
+    """ Compares 'results' with 'baseline' (both as returned by run).
+    Returns the list of (case name,quantity,baseline value,value) of all
+    transaction counts and bus times that increased by more than the
+    relative 'tolerance'. """
+    failed = []
+    for (name,res) in results.items():
+        if name not in baseline:
+            continue
+        for q in ('transactions','bus_time',):
+            if res[q] > baseline[name][q]*(1+tolerance) + 1e-12:
+                failed.append((name,q,baseline[name][q],res[q]))
+    return failed
+
+def report(results,baseline={}):
+    """ Prints the results, with the baseline values in brackets. """
+    print("{:<32} {:>14} {:>8} {:>16} {:>16}".format(\
+        "case","trans/call","bytes","bus (us)","cpu (us)"))
+    for (name,setup) in CASES:
+        res = results[name]
+        base = baseline.get(name)
+        def fmt(q,scale=1.0,prec=1):
+            s = "{:.{}f}".format(res[q]*scale,prec)
+            if base != None:
+                s += " [{:.{}f}]".format(base[q]*scale,prec)
+            return s
+        print("{:<32} {:>14} {:>8.1f} {:>16} {:>16}".format(\
+            name,fmt('transactions',prec=2),res['bytes'],\
+            fmt('bus_time',1e6),fmt('cpu',1e6)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=\
+        "Micro-benchmarks of py2C on the simulated bus.")
+    parser.add_argument('-n',type=int,default=200,\
+                        help="calls per case (default: 200)")
+    parser.add_argument('--clock',type=float,default=100e3,\
+                        help="modelled bus clock in Hz (default: 100e3)")
+    parser.add_argument('--baseline',default=BASELINE,\
+                        help="baseline file (default: %(default)s)")
+    parser.add_argument('--save',action='store_true',\
+                        help="store the results as baseline")
+    args = parser.parse_args(argv)
+    results = run(args.n,args.clock)
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results,baseline)
+    if args.save:
+        with open(args.baseline,'w') as f:
+            json.dump(results,f,indent=1,sort_keys=True)
+            f.write("\n")
+        print("Baseline stored in {}.".format(args.baseline))
+        return 0
+    failed = compare(results,baseline)
+    for (name,q,base,value) in failed:
+        print("REGRESSION: {}: {} per call {:.4g} -> {:.4g}".\
+              format(name,q,base,value))
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
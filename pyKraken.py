@@ -1,15 +1,456 @@
 # Datalogging with the raspberry pi and i2c devices -- ST 03/2017
 #
-#   Running on 2.7.9; everything but gpio functionality works in 3.5 as well.
+#   Requires Python 3.7 or later (py2C compiles its register tables in
+#   __init_subclass__; traces are time-stamped with time.perf_counter_ns).
 #
 import py2C as i2c
-import RPi.GPIO as gpio
+try:
+    import RPi.GPIO as gpio
+except ImportError:
+    # not on a Pi; triggers can still be given as pin objects (see
+    # wait_trigger)
+    gpio = None
 import numpy as np
 import time
-import smbus
+import os
+import json
+import struct
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class DeadlineTimer(object):
+    """ Paces a loop on a fixed grid of deadlines t0 + k*period, using the
+    monotonic clock (time.perf_counter). wait() sleeps until shortly before
+    the next deadline and spins for the last 'spin' seconds only, so the
+    loop uses next to no CPU while idle. Deadlines do not depend on when
+    wait() is called, so the loop keeps its phase over long runs. Deadlines
+    that have passed by more than 'spin' already count as 'overruns'; if
+    the loop falls behind by whole periods, the missed grid points are
+    skipped (counted in 'skipped') rather than caught up with. """
+
+    def __init__(self,period,spin=1e-3):
+        assert period > 0,"Period needs to be positive!"
+        self.period = period
+        self.spin = spin
+        self.start()
+
+    def start(self,t0=None):
+        """ (Re-)starts the grid at 't0' (default: now) and resets the
+        overrun counters. """
+        self.t0 = time.perf_counter() if t0 == None else t0
+        self.k = 0
+        self.overruns = 0
+        self.skipped = 0
+
+    @property
+    def next(self):
+        """ The next deadline on the grid. """
+        return self.t0 + self.k*self.period
+
+    def wait(self):
+        """ Waits for the next deadline and returns it (the scheduled time,
+        not the time of return). """
+        target = self.t0 + self.k*self.period
+        now = time.perf_counter()
+        if now > target + self.spin:
+            self.overruns += 1
+            if now - target >= self.period:
+                missed = int((now - target)/self.period)
+                self.skipped += missed
+                self.k += missed
+                target = self.t0 + self.k*self.period
+        else:
+            if target - now > self.spin:
+                time.sleep(target - now - self.spin)
+            while time.perf_counter() < target:
+                pass
+        self.k += 1
+        return target
+
+class StreamStats(object):
+    """ Running statistics of 'nchannels' channels, updated one sample at a
+    time in preallocated NumPy arrays: count 'n', 'mean', 'var' and 'std'
+    (sample variance by Welford's algorithm), 'min' and 'max'. Memory use
+    does not depend on the number of samples. """
+
+    # statistics that can be requested by name (see get)
+    STATS = ('mean','std','var','min','max','n',)
+
+    def __init__(self,nchannels):
+        self.nchannels = nchannels
+        self.mean = np.zeros(nchannels)
+        self.min = np.zeros(nchannels)
+        self.max = np.zeros(nchannels)
+        self._m2 = np.zeros(nchannels)
+        # scratch space for the updates
+        self._x = np.zeros(nchannels)
+        self._d = np.zeros(nchannels)
+        self._t = np.zeros(nchannels)
+        self.reset()
+
+    def reset(self):
+        """ Discards all samples. """
+        self.n = 0
+        self.mean[:] = 0.0
+        self._m2[:] = 0.0
+        self.min[:] = np.inf
+        self.max[:] = -np.inf
+
+    def add(self,values):
+        """ Adds one sample (one value per channel). """
+        (x,d,t) = (self._x,self._d,self._t)
+        x[:] = values
+        self.n += 1
+        # Welford update of mean and sum of squared deviations, in place
+        np.subtract(x,self.mean,out=d)
+        np.divide(d,self.n,out=t)
+        np.add(self.mean,t,out=self.mean)
+        np.subtract(x,self.mean,out=t)
+        np.multiply(d,t,out=d)
+        np.add(self._m2,d,out=self._m2)
+        np.minimum(self.min,x,out=self.min)
+        np.maximum(self.max,x,out=self.max)
+
+    @property
+    def var(self):
+        """ Sample variance per channel (zero for less than two samples). """
+        if self.n < 2:
+            return np.zeros(self.nchannels)
+        return self._m2/(self.n-1)
+
+    @property
+    def std(self):
+        """ Sample standard deviation per channel. """
+        return np.sqrt(self.var)
+
+    def get(self,stat):
+        """ Returns the statistic named 'stat' (one of STATS) per channel. """
+        assert stat in self.STATS,"Unknown statistic '{}'!".format(stat)
+        if stat == 'n':
+            return np.full(self.nchannels,self.n)
+        return getattr(self,stat)
+
+# --- Binary log files: a self-describing header followed by fixed-width
+#     records. The header is the magic string, the length of the JSON part
+#     (uint32, little endian) and the JSON part (padded with blanks so that
+#     the records start at a multiple of 16 bytes).
+LOG_MAGIC = b'PYKRKN\x00\x01'
+# flags stored with each record of the binary log
+FLAG_TRIGGERED = 0x1
+FLAG_TIMEOUT = 0x2
+FLAG_OVERRUN = 0x4
+
+def write_header(f,header,size=None):
+    """ Writes the dictionary 'header' (JSON serialisable; may contain a
+    NumPy 'dtype') to the beginning of the open binary file 'f'. Returns
+    the offset of the data following the header. If 'size' is given, the
+    header is padded to exactly 'size' bytes, so that it can be rewritten
+    later without moving the data. """
+    header = dict(header)
+    if 'dtype' in header:
+        header['dtype'] = np.dtype(header['dtype']).descr
+    text = json.dumps(header).encode('utf-8')
+    offset = len(LOG_MAGIC) + 4 + len(text)
+    if size == None:
+        size = offset + (-offset % 16)
+    elif offset > size:
+        raise ValueError("Header does not fit into {} bytes!".format(size))
+    text += b' '*(size - offset)
+    f.write(LOG_MAGIC + struct.pack('<I',len(text)) + text)
+    return size
+
+def read_header(f):
+    """ Reads the header written by write_header from the open binary file
+    'f'. Returns (header,offset); the header's 'dtype' (if any) is turned
+    back into a NumPy dtype. """
+    magic = f.read(len(LOG_MAGIC))
+    if magic != LOG_MAGIC:
+        raise IOError("Not a pyKraken binary file!")
+    (n,) = struct.unpack('<I',f.read(4))
+    header = json.loads(f.read(n).decode('utf-8'))
+    if 'dtype' in header:
+        header['dtype'] = np.dtype([tuple(d) for d in header['dtype']])
+    return (header,len(LOG_MAGIC)+4+n)
+
+class BinaryLogSink(object):
+    """ Append-only binary log with one file per day. Records are
+    (t,channels...,flags) with the unix time 't' as float64, one float32 per
+    channel and uint32 flags (see FLAG_TRIGGERED etc.). Each file starts with
+    a header (see write_header) holding the channel names, the record dtype
+    and the metadata given in 'meta'. The day file is kept open and every
+    record goes to the file of its own date, so rotation at midnight does not
+    drop a sample. An existing day file is appended to if its layout matches
+    (a partly written last record is cut off), otherwise the next free name
+    with suffix '_1', '_2', ... is used. """
+
+    def __init__(self,path,filemask,channels,meta={}):
+        self.path = path
+        self.filemask = filemask
+        self.channels = list(channels)
+        self.meta = meta
+        self.dtype = np.dtype([('t','<f8')]\
+                              +[(c,'<f4') for c in self.channels]\
+                              +[('flags','<u4')])
+        self._record = np.zeros(1,dtype=self.dtype)
+        self._day = None
+        self._file = None
+        self.filename = None
+
+    def _open(self,day):
+        """ Opens the log file for 'day' (a time.struct_time). """
+        self.close()
+        name = self.filemask.format(day.tm_mday,day.tm_mon,day.tm_year)
+        (base,ext) = os.path.splitext(self.path + name)
+        k = 0
+        while True:
+            filename = base + ("_{}".format(k) if k > 0 else "") + ext
+            if not os.path.exists(filename) or \
+               os.path.getsize(filename) == 0:
+                f = open(filename,'wb')
+                write_header(f,{'channels':self.channels,\
+                                'dtype':self.dtype,\
+                                'meta':self.meta})
+                break
+            f = open(filename,'r+b')
+            try:
+                (header,offset) = read_header(f)
+            except (IOError,ValueError,struct.error):
+                header = None
+            if header != None and header['dtype'] == self.dtype \
+               and header['channels'] == self.channels:
+                # append after the last complete record
+                size = os.path.getsize(filename)
+                f.truncate(size - (size-offset) % self.dtype.itemsize)
+                f.seek(0,os.SEEK_END)
+                break
+            f.close()
+            k += 1
+        self._file = f
+        self._day = day[0:3]
+        self.filename = filename
+
+    def write(self,t,values,flags=0):
+        """ Appends the record (t,values,flags); 't' is the unix time. """
+        day = time.localtime(t)
+        if self._day != day[0:3]:
+            self._open(day)
+        rec = self._record
+        rec['t'] = t
+        rec['flags'] = flags
+        for (c,v) in zip(self.channels,values):
+            rec[c] = v
+        self._file.write(rec.tobytes())
+        self._file.flush()
+
+    def close(self):
+        """ Closes the current day file. """
+        if self._file != None:
+            self._file.close()
+            self._file = None
+            self._day = None
+
+def read_binlog(filename):
+    """ Reads a binary log file written by BinaryLogSink. Returns (header,
+    records), the records as a NumPy structured array. A partly written last
+    record is ignored. """
+    with open(filename,'rb') as f:
+        (header,offset) = read_header(f)
+        data = f.read()
+    dtype = header['dtype']
+    n = len(data)//dtype.itemsize
+    return (header,np.frombuffer(data,dtype=dtype,count=n))
+
+def binlog2csv(filename,outfile=None):
+    """ Converts a binary log file to DataLogger's text layout (time of day,
+    column means, trigger flag, extra statistics; see DataLogger). Writes to
+    'outfile' (default: 'filename' with extension .txt) and returns its
+    name. """
+    (header,rec) = read_binlog(filename)
+    if outfile == None:
+        outfile = os.path.splitext(filename)[0] + ".txt"
+    ncols = header['meta'].get('ncolumns',len(header['channels']))
+    channels = header['channels']
+    with open(outfile,'w') as f:
+        for r in rec:
+            now = time.localtime(r['t'])
+            line = "{:02}:{:02}:{:02}".\
+                   format(now.tm_hour,now.tm_min,now.tm_sec)
+            for c in channels[0:ncols]:
+                line += ",{:.4f}".format(r[c])
+            line += "," + ("1" if r['flags'] & FLAG_TRIGGERED else "0")
+            for c in channels[ncols:]:
+                if c == 'n':
+                    line += ",{}".format(int(r[c]))
+                else:
+                    line += ",{:.4f}".format(r[c])
+            f.write(line + "\n")
+    return outfile
+
+def column_names(columns):
+    """ Unique names for the logger columns 'columns' (see read_columns):
+    the device name (see py2C.device_name), followed by '.output' for named
+    outputs. Repeated columns get a running number ('#2', '#3', ...). """
+    out = []
+    names = []
+    for c in columns:
+        if type(c) is tuple:
+            name = i2c.device_name(c[0]) + "." + c[0].outputs[c[1]]
+        else:
+            name = i2c.device_name(c)
+        k = names.count(name)
+        names.append(name)
+        out.append(name if k == 0 else name + "#{}".format(k+1))
+    return out
+
+def wait_trigger(trigger,timeout=-1):
+    """ Waits for a rising edge on 'trigger': either a GPIO pin number (BCM
+    numbering; opened as py2C.GpioEdge for the wait) or an object with a
+    wait() method, such as py2C.GpioEdge or a simulated pin (see pySimBus).
+    'timeout' is given in ms (-1: wait forever). Returns the time of the
+    edge (time.perf_counter, taken when the edge is caught), or None on
+    timeout. """
+    pin = trigger
+    if not hasattr(trigger,'wait'):
+        if gpio == None:
+            raise IOError("RPi.GPIO not available; use a pin object as "\
+                          "trigger!")
+        # the edge is time-stamped by the event callback, not when the
+        # wait returns
+        pin = i2c.GpioEdge(trigger,'rising')
+    try:
+        return pin.wait(None if timeout < 0 else timeout/1000.0)
+    finally:
+        if pin is not trigger: pin.close()
+
+def schedule_columns(columns):
+    """ Works out how read_columns reads the logger columns 'columns': the
+    HIH sensors swept together, the devices read once for their named
+    outputs, the plain columns and the order in which they are visited (see
+    py2C.schedule_reads). Pass the result to read_columns when reading the
+    same columns over and over. """
+    multi = []
+    for c in columns:
+        if type(c) is tuple and c[0] not in multi:
+            multi.append(c[0])
+    hih = [d for d in multi if isinstance(d,i2c.HIH8121)]
+    if len(hih) < 2: hih = []
+    # remaining devices read once, followed by the plain columns
+    reads = [d for d in multi if d not in hih]
+    nmulti = len(reads)
+    reads += [c for c in columns if type(c) is not tuple]
+    return {'hih':hih,'hih_order':i2c.schedule_reads(hih),\
+            'reads':reads,'nmulti':nmulti,\
+            'order':i2c.schedule_reads(reads),\
+            'paths':[i2c.route(d) for d in reads]}
+
+def read_columns(columns,schedule=None):
+    """ Reads the logger columns 'columns' (devices, or (device,index)
+    pairs naming one of the device's outputs) and returns one value per
+    column. Devices with named columns are read once (get_all()), HIH
+    sensors all at once (see py2C.HIH8121.sweep); all other columns by the
+    device's get() method. The devices are visited in an order that
+    minimises switch writes, starting with the route selected right now
+    (see schedule_columns; computed if 'schedule' is not given); values are
+    returned in the order of 'columns'. """
+    if schedule is None: schedule = schedule_columns(columns)
+    values = {}
+    hih = schedule['hih']
+    if len(hih) > 0:
+        values.update(zip(hih,i2c.HIH8121.sweep(hih,\
+                                                order=schedule['hih_order'])))
+    reads = schedule['reads']
+    nmulti = schedule['nmulti']
+    out = [None]*len(reads)
+    for i in i2c.active_first(schedule['order'],schedule['paths']):
+        out[i] = reads[i].get_all() if i < nmulti else reads[i].get()
+    values.update(zip(reads[:nmulti],out[:nmulti]))
+    plain = iter(out[nmulti:])
+    return [values[c[0]][c[1]] if type(c) is tuple else next(plain)\
+            for c in columns]
+
+class BusReader(object):
+    """ Reads logger columns (see read_columns; outputs may also be given
+    by name) spread over several i2c buses, with one worker thread per bus,
+    so that the buses are busy at the same time. Devices are grouped by
+    their bus handle. read() returns one time-stamped row with the values
+    in the order of 'columns'. With a single bus, the columns are read in
+    the calling thread. Call close() to stop the workers. """
+
+    def __init__(self,columns):
+        self.columns = [(c[0],c[0].outputs.index(c[1])) \
+                        if type(c) is tuple and type(c[1]) is str else c \
+                        for c in columns]
+        groups = {}
+        for (i,c) in enumerate(self.columns):
+            d = c[0] if type(c) is tuple else c
+            groups.setdefault(id(d.bus),[]).append(i)
+        # the reading schedule of each bus is worked out once
+        self._groups = []
+        for idx in groups.values():
+            columns = [self.columns[i] for i in idx]
+            self._groups.append((idx,columns,schedule_columns(columns)))
+        self._schedule = None
+        if len(self._groups) == 1: self._schedule = self._groups[0][2]
+        self._workers = []
+        if len(self._groups) > 1:
+            self._results = queue.Queue()
+            for k in range(len(self._groups)):
+                q = queue.Queue()
+                w = threading.Thread(target=self._work,args=(k,q))
+                w.daemon = True
+                w.start()
+                self._workers.append((w,q))
+
+    def _work(self,k,requests):
+        """ Worker loop of bus group 'k'. """
+        (idx,columns,schedule) = self._groups[k]
+        while requests.get():
+            try:
+                self._results.put((k,read_columns(columns,schedule),None))
+            except Exception as e:
+                self._results.put((k,None,e))
+
+    def read(self):
+        """ Reads all columns. Returns (t,values) with the unix time 't' at
+        the start of the acquisition. """
+        t = time.time()
+        if len(self._workers) == 0:
+            return (t,read_columns(self.columns,self._schedule))
+        for (w,q) in self._workers:
+            q.put(True)
+        values = [None]*len(self.columns)
+        error = None
+        for n in range(len(self._workers)):
+            (k,out,e) = self._results.get()
+            if e != None:
+                error = e
+                continue
+            for (i,v) in zip(self._groups[k][0],out):
+                values[i] = v
+        if error != None:
+            raise error
+        return (t,values)
+
+    def close(self):
+        """ Stops the worker threads. """
+        for (w,q) in self._workers:
+            q.put(False)
+        for (w,q) in self._workers:
+            w.join()
+        self._workers = []
 
 class DataLogger():
-    """ A simple data-to-file logging class. """
+    """ A simple data-to-file logging class. Each line holds the mean of
+    every column over 'avg_period' (avg_period/meas_period samples, rounded),
+    followed by the trigger flag and, for each statistic named in 'stats'
+    (see StreamStats.STATS; 'n' gives a single count column), one more value
+    per column. With 'format' set to 'bin' or 'both', lines are (also)
+    appended to a binary log named by 'binmask' (see BinaryLogSink,
+    binlog2csv). Set 'echo' to False to keep the lines off the standard
+    output. """
 
     _default = {\
         'meas_period':0.1,\
@@ -19,23 +460,20 @@ class DataLogger():
         'trigger_timeout':10*1000,\
         'path':"./",\
         'filemask':"DataLog_3_{2:04}-{1:02}-{0:02}.txt",\
+        'stats':(),\
+        'format':'csv',\
+        'binmask':"DataLog_3_{2:04}-{1:02}-{0:02}.bin",\
+        'echo':True,\
         }
     
     def __init__(self,**kwargs):
         # pick out device specifications and add devices
         self._devices = []
+        # reader for the columns; set up when first needed
+        self._reader = None
         if 'devices' in kwargs:
-            devices = kwargs.pop('devices')
-            for d in devices:
-                assert isinstance(d,i2c.I2c_device),\
-                       "Expecting instance of I2c_device!"
-                assert d.dev_class in (i2c.DEV_MEAS,i2c.DEV_ADC,),\
-                       "Unsupported device class for device '{}'!"\
-                       .format(d.dev_type)
-                ## @@ check for device class as well.
-                self._devices.append(d)
-        else:
-            devices = []
+            for d in kwargs.pop('devices'):
+                self.add_device(d)
         # first set defaults, then overwrite with possible user input
         for kw in self._default:
             setattr(self,kw,self._default[kw])
@@ -43,59 +481,131 @@ class DataLogger():
             assert kw in self._default,\
                    "Uknown keyword '{}!'".format(kw)
             setattr(self,kw,kwargs[kw])
-        # initialize data list
-        self._data = []
+        for s in self.stats:
+            assert s in StreamStats.STATS,"Unknown statistic '{}'!".format(s)
+        assert self.format in ('csv','bin','both',),\
+               "Unknown format '{}'!".format(self.format)
+        # running statistics; allocated when the loop starts
+        self._stats = None
 
-    def add_device(self,device):
-        """ Append a new device to the end of the devices list. Note, that
-        using the same device multiple times prompts a new measurement every
-        time. Use cycling to access different 'channels' in one device. """
+    def add_device(self,device,output=None):
+        """ Append a new column to the end of the devices list. A column is
+        either a device, read by its get() method, or one of the quantities
+        named in the device's 'outputs', given as (device,output) or with
+        'output'. Devices with named columns are read once per sample (by
+        get_all()), however many of their quantities are logged. Note, that
+        using the same device multiple times without naming outputs prompts
+        a new measurement every time. Use cycling to access different
+        'channels' in one device. """
+        if type(device) is tuple:
+            (device,output) = device
         assert isinstance(device,i2c.I2c_device),\
                "Expecting instance of I2c_device!"
-        assert d.dev_class in (i2c.DEV_MEAS,i2c.DEV_ADC,),\
+        assert device.dev_class in (i2c.DEV_MEAS,i2c.DEV_ADC,),\
                "Unsupported device class for device '{}'!"\
-               .format(d.dev_type)
-        # append
-        self._devices.append(device)
+               .format(device.dev_type)
+        # append; the reader is set up again for the new columns
+        if self._reader != None:
+            self._reader.close()
+            self._reader = None
+        if output == None:
+            self._devices.append(device)
+        else:
+            assert output in device.outputs,\
+                   "Device '{}' has no output '{}'!".format(device,output)
+            self._devices.append((device,device.outputs.index(output)))
+
+    def column_info(self):
+        """ Returns a list with a dictionary per column describing it: unique
+        'name', device 'type', 'bus' number, 'addr', 'route' ([switch
+        address,channel] pairs) and 'output' (None for plain columns). """
+        info = []
+        for (c,name) in zip(self._devices,column_names(self._devices)):
+            (d,output) = (c[0],c[0].outputs[c[1]]) if type(c) is tuple \
+                         else (c,None)
+            info.append({'name':name,'type':d.dev_type,'bus':d.busnum,\
+                         'addr':d.addr,\
+                         'route':[[sw.addr,ch] for (sw,ch) in i2c.route(d)],\
+                         'output':output})
+        return info
+
+    def channel_names(self):
+        """ Names of all values of a line: the column means, followed by the
+        extra statistics (see 'stats'). """
+        names = [c['name'] for c in self.column_info()]
+        out = list(names)
+        for s in self.stats:
+            if s == 'n':
+                out.append('n')
+            else:
+                out += [name + "." + s for name in names]
+        return out
 
     def get_measurements(self):
-        """ Returns the list of measurement values obatained by each device's
-        get() method. """
-        return [device.get() for device in self._devices]
+        """ Returns the list of measurement values, one per column (see
+        read_columns). Devices on different buses are read concurrently
+        (see BusReader). """
+        if self._reader == None:
+            self._reader = BusReader(self._devices)
+        return self._reader.read()[1]
 
     def start_measurement_loop(self):
-        " Starts the measurement loop for this DataLogger. "
-        # @@ cheap and dirty!!
+        """ Starts the measurement loop for this DataLogger. Measurements are
+        taken on a fixed grid of 'meas_period' (see DeadlineTimer). """
+        timer = DeadlineTimer(self.meas_period)
+        self._stats = StreamStats(len(self._devices))
+        sink = None
+        if self.format in ('bin','both',):
+            meta = {'columns':self.column_info(),\
+                    'ncolumns':len(self._devices),\
+                    'stats':list(self.stats),\
+                    'meas_period':self.meas_period,\
+                    'avg_period':self.avg_period}
+            sink = BinaryLogSink(self.path,self.binmask,\
+                                 self.channel_names(),meta)
+        try:
+            self._loop(timer,sink)
+        finally:
+            if sink != None: sink.close()
+            if self._reader != None:
+                self._reader.close()
+                self._reader = None
+
+    def _loop(self,timer,sink):
+        """ The measurement loop; see start_measurement_loop. """
+        # every line averages the same number of grid points
+        nsamples = max(1,int(round(self.avg_period/self.meas_period)))
         while True:
             line_note = ""
             triggered = "0"
+            flags = 0
             # wait for trigger if triggered operation is selected
             if self.trigger_enable and self.trigger_pin != None:
-                res = gpio.wait_for_edge(self.trigger_pin,\
-                                         gpio.RISING,\
-                                         timeout=self.trigger_timeout)
+                res = wait_trigger(self.trigger_pin,self.trigger_timeout)
                 if res == None:
                     line_note = "timeout"
+                    flags |= FLAG_TIMEOUT
                 else:
-                    line_note = "TR({})".format(res)
+                    line_note = "TR({})".format(self.trigger_pin \
+                                    if type(self.trigger_pin) is int else "")
                     triggered = "1"
-            # initialize empty data list
-            ## @@ verify that there is no memory leak here (used .clear()
-            ## @@ before, which is not supported in 2.7.9)
-            self._data = []
-            last_avg = time.time()
-            while (time.time() - last_avg) < self.avg_period:
-                # get a measurement
-                last = time.time()
-                self._data.append(self.get_measurements())
-                # wait for next measurement
-                while (time.time() - last) < self.meas_period:
-                    pass
-            avg = [sum([data[i] for data in self._data])\
-                   /len(self._data) \
-                   for i in range(0,len(self._data[0]))]
+                    flags |= FLAG_TRIGGERED
+                # measurement grid starts at the trigger
+                timer.start()
+            # restart statistics
+            self._stats.reset()
+            overruns = timer.overruns
+            for k in range(nsamples):
+                # wait for the next grid point, then get a measurement
+                timer.wait()
+                self._stats.add(self.get_measurements())
+            if timer.overruns > overruns:
+                line_note += " overrun({})".format(timer.overruns-overruns)
+                flags |= FLAG_OVERRUN
+            avg = self._stats.mean
             # build filename with current date
-            now = time.localtime()
+            t = time.time()
+            now = time.localtime(t)
             outfile = self.path + self.filemask.\
                       format(now.tm_mday,now.tm_mon,now.tm_year)
             # build timestamp
@@ -104,61 +614,351 @@ class DataLogger():
             # build line
             line = ",".join(["{:.4f}".format(a) for a in avg])
             line += "," + triggered
+            values = list(avg)
+            for s in self.stats:
+                if s == 'n':
+                    line += ",{}".format(self._stats.n)
+                    values.append(self._stats.n)
+                else:
+                    line += "," + ",".join(["{:.4f}".format(a) \
+                                            for a in self._stats.get(s)])
+                    values += list(self._stats.get(s))
             # print to stdandard output
-            print_line = " , ".join(["{:.4f}".format(a) for a in avg])
-            print(outfile + " < " + print_line + "   @ " \
-                  + timestamp + "   " + line_note)
-            # append to file
-            with open(outfile,'a') as f:
-                f.write(timestamp + "," +line+"\n")
+            if self.echo:
+                print_line = " , ".join(["{:.4f}".format(a) for a in avg])
+                print(outfile + " < " + print_line + "   @ " \
+                      + timestamp + "   " + line_note)
+            # append to file(s)
+            if sink != None:
+                sink.write(t,values,flags)
+            if self.format in ('csv','both',):
+                with open(outfile,'a') as f:
+                    f.write(timestamp + "," +line+"\n")
+
+def trace_stats(t,timer=None):
+    """ Statistics of a trace with sample times 't' (s): number of samples
+    'n', 'duration', achieved 'rate' (Hz) and 'jitter' (standard deviation
+    of the sample intervals, s); the 'overruns' and 'skipped' samples of
+    the pacing DeadlineTimer 'timer', if any. """
+    n = len(t)
+    duration = float(t[-1] - t[0]) if n > 1 else 0.0
+    stats = {'n':n,'duration':duration,\
+             'rate':(n-1)/duration if duration > 0 else 0.0,\
+             'jitter':float(np.std(np.diff(t))) if n > 2 else 0.0}
+    if timer != None:
+        stats['overruns'] = timer.overruns
+        stats['skipped'] = timer.skipped
+    return stats
+
+def trace_dtype(devices):
+    """ The record type of traces of 'devices': the sample time 't' and one
+    field per device (named as in column_names), all float64. """
+    return np.dtype([('t','<f8')]+[(c,'<f8') for c in column_names(devices)])
+
+def trace_array(devices,t,values):
+    """ Builds a trace: a NumPy structured array (see trace_dtype) with the
+    sample times 't' and the columns of 'values'. """
+    names = column_names(devices)
+    trace = np.empty(len(t),dtype=trace_dtype(devices))
+    trace['t'] = t
+    for (j,c) in enumerate(names):
+        trace[c] = values[:,j]
+    return trace
+
+def create_trace_file(filename,devices,nmax):
+    """ Creates the trace file 'filename' for 'nmax' samples of 'devices'
+    and returns it as a NumPy memmap (see trace_dtype), to be filled in
+    place. The file starts with a header (see write_header) holding the
+    field names, the record dtype, the planned length 'nmax' and the actual
+    'length' (0 until set by finish_trace_file). """
+    dtype = trace_dtype(devices)
+    header = {'columns':list(dtype.names),'dtype':dtype,\
+              'planned':nmax,'length':0,'created':time.time()}
+    with open(filename,'wb') as f:
+        # leave room for the length to grow
+        size = write_header(f,header)
+        size += 64
+        f.seek(0)
+        write_header(f,header,size)
+        f.truncate(size + nmax*dtype.itemsize)
+    return np.memmap(filename,dtype=dtype,mode='r+',offset=size,\
+                     shape=(nmax,))
+
+def finish_trace_file(trace,n):
+    """ Completes a trace file created by create_trace_file once 'n' samples
+    are written to its memmap 'trace': flushes the data, records the length
+    in the header and cuts the file to the samples taken. Returns the file
+    name. Takes over 'trace': its mapping is closed before the file is cut
+    (pages past the new end would fault), so neither 'trace' nor any view
+    of it may be used afterwards; reopen the file with open_trace. """
+    trace.flush()
+    filename = trace.filename
+    trace._mmap.close()
+    with open(filename,'r+b') as f:
+        (header,offset) = read_header(f)
+        header['length'] = n
+        f.seek(0)
+        write_header(f,header,offset)
+        f.truncate(offset + n*header['dtype'].itemsize)
+    return filename
+
+def open_trace(filename,mode='r'):
+    """ Opens a trace file written by triggered_trace (see create_trace_file)
+    without copying: returns (trace,header), the trace as a NumPy memmap of
+    the 'length' samples taken. 'mode' is passed on to numpy.memmap. """
+    with open(filename,'rb') as f:
+        (header,offset) = read_header(f)
+    n = header['length']
+    if n == 0:
+        return (np.zeros(0,dtype=header['dtype']),header)
+    return (np.memmap(filename,dtype=header['dtype'],mode=mode,\
+                      offset=offset,shape=(n,)),header)
+
+class RawCapture(object):
+    """ Acquisition of raw device data, with deferred conversion. Each
+    sample reads all outputs of every device in 'devices' as raw bytes (see
+    py2C.I2c_device.get_all_raw) into a preallocated uint8 buffer for
+    'nmax' samples, time-stamped in integer ns; nothing is converted while
+    sampling. The devices' scales and offsets (raw_settings) are captured
+    when the capture is created. convert() decodes the samples in bulk
+    (decode_raw) into a trace with one column per device output. """
+
+    def __init__(self,devices,nmax):
+        if type(devices) not in (tuple,list,):
+            devices = [devices]
+        self.devices = list(devices)
+        self.settings = [d.raw_settings() for d in self.devices]
+        self.columns = [(d,k) for d in self.devices \
+                        for k in range(len(d.outputs))]
+        # byte ranges of the devices within a row
+        self._slices = []
+        nbytes = 0
+        for d in self.devices:
+            self._slices.append((nbytes,nbytes+d.raw_nbytes))
+            nbytes += d.raw_nbytes
+        self.raw = np.zeros((nmax,nbytes),dtype=np.uint8)
+        self.tns = np.zeros(nmax,dtype=np.int64)
+        self.n = 0
+        # visit devices in an order sparing the switches
+        self._order = [(self.devices[j],)+self._slices[j] \
+                       for j in i2c.schedule_reads(self.devices)]
+
+    def __len__(self):
+        return self.n
+
+    def sample(self,t_ns):
+        """ Takes one sample, time-stamped with 't_ns'. """
+        row = self.raw[self.n]
+        for (d,a,b) in self._order:
+            row[a:b] = d.get_all_raw()
+        self.tns[self.n] = t_ns
+        self.n += 1
+
+    def values(self,start=0,stop=None):
+        """ Converts the samples 'start' to 'stop' (default: all taken so
+        far); returns an array with one row per sample and one column per
+        entry of 'columns'. """
+        if stop == None: stop = self.n
+        n = stop - start
+        out = np.empty((n,len(self.columns)))
+        j = 0
+        for (d,settings,(a,b)) in zip(self.devices,self.settings,\
+                                      self._slices):
+            v = d.decode_raw(self.raw[start:stop,a:b],**settings)
+            if type(v) is tuple:
+                v = np.column_stack(v)
+            k = len(d.outputs)
+            out[:,j:j+k] = np.reshape(v,(n,k))
+            j += k
+        return out
+
+    def convert(self,t0_ns=0,out=None,chunk=65536):
+        """ Converts the samples taken so far to a trace (see trace_array)
+        with the times 't' (s) relative to 't0_ns'. With 'out' given (a
+        trace of at least as many samples, e.g. the memmap of
+        create_trace_file), the trace is written into it 'chunk' samples at
+        a time, without building it in memory. Returns the trace. """
+        n = self.n
+        if out is None:
+            out = np.empty(n,dtype=trace_dtype(self.columns))
+        names = column_names(self.columns)
+        for a in range(0,n,chunk):
+            b = min(n,a+chunk)
+            out['t'][a:b] = (self.tns[a:b] - t0_ns)*1e-9
+            values = self.values(a,b)
+            for (j,c) in enumerate(names):
+                out[c][a:b] = values[:,j]
+        return out[:n]
 
 def triggered_trace(trigger_pin,devices,timeout=-1,tmax=None,nmax=10,\
-                    dt=None):
+                    dt=None,filename=None,raw=False):
     """ Performs a triggered measurement, accumulating samples either until
-    'nmax' samples are reached or until theloop has run for time 'tmax'.
-    Optionally can force time intervals of measurements to 'dt'.
-    The loop starts after a rising flank has been detected on 'trigger_pin',
-    or once the 'timeout' time is elapsed. """
+    'nmax' samples are reached or until the loop has run for time 'tmax'.
+    Optionally can force time intervals of measurements to 'dt' (see
+    DeadlineTimer); 'nmax' may then be None to sample for all of 'tmax'.
+    The loop starts after a rising flank has been detected on 'trigger_pin'
+    (pin number or pin object, see wait_trigger; None to start right away),
+    or once the 'timeout' (ms) is elapsed.
+    Samples are written in place into a preallocated buffer, time-stamped
+    with time.perf_counter_ns. With 'filename' given, the buffer is a trace
+    file mapped into memory (see create_trace_file), so that the trace may
+    exceed the RAM; should the capture fail or be interrupted, the file is
+    still completed with the samples taken. Returns (trace,stats): 'trace'
+    is a NumPy structured array with the time since the start 't' (s) and
+    one field per device (see trace_dtype; a read-only memmap of the file,
+    see open_trace, if 'filename' is given); 'stats' holds the achieved
+    rate and jitter (see trace_stats) and the time from the trigger edge to
+    the start of the loop, 'latency' (s; None without trigger edge).
+    With 'raw' set, the loop only collects the raw data of all outputs of
+    each device (see RawCapture), converted once the loop is done (in
+    chunks, straight into the file if 'filename' is given); the trace then
+    holds one field per device output (see column_names). """
     # reshape and validate input
     if type(devices) not in (tuple,list,):
         devices = [devices]
-    assert nmax != 0 or tmax != 0,"Missing break condition!"
-    # initialize empty data array
-    data = []
-    # start by waiting for the trigger
-    gpio.wait_for_edge(trigger_pin,gpio.RISING,timeout=timeout)
-    print('Go!')
-    start=time.clock()
-    # based on choices: slightly different loops
-    if dt == None:
-        if tmax == None:
-            # continuous loop until nmax reached
-            while len(data) < nmax:
-                data.append([time.clock()-start]\
-                            +[d.get() for d in devices])
+    devices = list(devices)
+    if nmax == None:
+        assert tmax != None and dt != None,"Missing break condition!"
+        nmax = int(np.ceil(tmax/dt))
+    assert nmax > 0,"Missing break condition!"
+    if tmax == None: tmax = float('inf')
+    # preallocate buffers (raw data, or a row per sample: t and one value per
+    # device);
+    # visit devices in an order sparing the switches
+    clock = time.perf_counter_ns
+    if raw:
+        capture = RawCapture(devices,nmax)
+        def sample(n):
+            capture.sample(clock())
+    else:
+        if filename == None:
+            trace = np.empty(nmax,dtype=trace_dtype(devices))
         else:
+            trace = create_trace_file(filename,devices,nmax)
+        buf = trace.view('<f8').reshape(nmax,len(devices)+1)
+        order = [(j+1,devices[j]) for j in i2c.schedule_reads(devices)]
+        def sample(n):
+            row = buf[n]
+            row[0] = (clock() - start)*1e-9
+            for (j,d) in order:
+                row[j] = d.get()
+    tmax_ns = tmax*1e9
+    n = 0
+    start = None
+    timer = None
+    try:
+        # start by waiting for the trigger
+        t_edge = None
+        if trigger_pin != None:
+            t_edge = wait_trigger(trigger_pin,timeout)
+        print('Go!')
+        start = clock()
+        # based on choices: free-running or paced by a deadline grid
+        if dt == None:
             # continuous loop until nmax or tmax reached
-            while (len(data) < nmax) and (time.clock()-start < tmax):
-                data.append([time.clock()-start]\
-                            +[d.get() for d in devices])
-    else:
-        if tmax == None:
-            # continuous loop until nmax reached, waiting for dt
-            while len(data) < nmax:
-                data.append([time.clock()-start]\
-                            +[d.get() for d in devices])
-                while (time.clock()-start < dt*len(data)):
-                    pass
+            while n < nmax and clock() - start < tmax_ns:
+                sample(n)
+                n += 1
         else:
-            # continuous loop until nmax or tmax reached, waiting for dt
-            while (len(data) < nmax) and (time.clock()-start < tmax):
-                data.append([time.clock()-start]\
-                            +[d.get() for d in devices])
-                while (time.clock()-start < dt*len(data)):
-                    pass
+            # loop until nmax or tmax reached, measuring every dt
+            timer = DeadlineTimer(dt)
+            timer.start(start*1e-9)
+            while n < nmax and timer.next - start*1e-9 < tmax:
+                timer.wait()
+                sample(n)
+                n += 1
+    finally:
+        # complete the file with the samples taken, also if the capture is
+        # interrupted; raw samples are converted straight into the file
+        if filename != None and raw:
+            trace = create_trace_file(filename,capture.columns,max(n,1))
+            try:
+                capture.convert(start,trace)
+            finally:
+                finish_trace_file(trace,n)
+        elif filename != None:
+            finish_trace_file(trace,n)
     # hand back the measurement result
-    return data
+    if filename != None:
+        (trace,header) = open_trace(filename)
+    elif raw:
+        trace = capture.convert(start)
+    else:
+        trace = trace[:n]
+    stats = trace_stats(trace['t'],timer)
+    stats['latency'] = None if t_edge == None else start*1e-9 - t_edge
+    if timer != None and timer.overruns > 0:
+        print('{} overruns, {} samples skipped'.format(timer.overruns,\
+                                                      timer.skipped))
+    return (trace,stats)
             
+def pretrigger_trace(trigger,devices,npre=100,npost=100,timeout=-1,\
+                     dt=None):
+    """ Triggered measurement that keeps the history before the trigger:
+    while armed, samples are taken continuously into a ring buffer (every
+    'dt' if given, see DeadlineTimer), and the 'trigger' is polled for a
+    rising edge after each sample. The trigger is an object with a poll()
+    method, such as py2C.GpioEdge (edges caught by an event callback) or a
+    simulated pin; a pin number is opened as GpioEdge for the capture. Once
+    the edge is seen, sampling goes on until 'npost' samples at or after
+    the edge are taken. If no edge arrives within 'timeout' ms (-1: wait
+    forever), the capture is triggered at the time of the timeout.
+    Returns (trace,itrig,t_edge): the trace (see trace_array) of up to
+    'npre' samples before the edge and 'npost' samples from it on, with
+    times 't' relative to the edge (s); the index 'itrig' of the first
+    sample at or after the edge; and the time of the edge (perf_counter;
+    None on timeout). """
+    if type(devices) not in (tuple,list,):
+        devices = [devices]
+    devices = list(devices)
+    pin = trigger
+    if type(trigger) is int:
+        pin = i2c.GpioEdge(trigger,'rising')
+    # ring buffer large enough for all samples kept
+    R = npre + npost
+    buf = np.empty((R,len(devices)))
+    tns = np.empty(R,dtype=np.int64)
+    order = i2c.schedule_reads(devices)
+    clock = time.perf_counter_ns
+    timer = None if dt == None else DeadlineTimer(dt)
+    t_out = None if timeout < 0 else clock() + timeout*1e6
+    try:
+        # arm: discard edges from before
+        pin.poll()
+        k = 0
+        t_edge = None
+        k_end = None
+        while k_end == None or k < k_end:
+            if timer != None: timer.wait()
+            i = k % R
+            tns[i] = clock()
+            row = buf[i]
+            for j in order:
+                row[j] = devices[j].get()
+            k += 1
+            if k_end != None:
+                continue
+            t = pin.poll()
+            if t != None:
+                t_edge = t
+                e_ns = int(t*1e9)
+            elif t_out != None and clock() >= t_out:
+                e_ns = int(t_out)
+            else:
+                continue
+            # first sample at or after the edge
+            k_trig = k
+            while k_trig > max(0,k-R) and tns[(k_trig-1) % R] >= e_ns:
+                k_trig -= 1
+            k_end = k_trig + npost
+    finally:
+        if pin is not trigger: pin.close()
+    # unroll the ring buffer
+    k0 = max(k_trig - npre,k - R,0)
+    idx = np.arange(k0,k) % R
+    trace = trace_array(devices,(tns[idx] - e_ns)*1e-9,buf[idx])
+    return (trace,k_trig - k0,t_edge)
+
 if __name__ == "__main__":       
     print('RELEASE THE KRAKEN!!!')
     # setup a trigger pin
@@ -220,10 +1020,10 @@ if __name__ == "__main__":
             
             ## Some triggered trace taking ...
     #print('Waiting for trigger ...')
-    #tt = triggered_trace(16,[adc,adc,adc,adc],\
-             #            dt=0.004,tmax=2.0,nmax=100000)
-    #with open("test_trace.txt",'w') as f:
-        #for t in tt:
+    #(tt,stats) = triggered_trace(16,[adc,adc,adc,adc],\
+             #            dt=0.004,tmax=2.0,nmax=100000,\
+             #            filename="test_trace.bin")
+    #(tt,header) = open_trace("test_trace.bin")
     
     
 ##    # create a datalogger object for the devices
@@ -236,7 +1036,8 @@ if __name__ == "__main__":
   # create a datalogger object for the devices
     log = DataLogger(filemask="DataLog_tempChipLab_{2:04}-{1:02}-{0:02}.txt",\
                      path="/home/pi/Documents/Data Log/",\
-                     devices=[hih[0],hih[0],hih2[1],hih2[1],hih2[2],hih2[2],hih[3],hih[3],hih[2],hih[2],hih[0],hih[0],hih[1],hih[1]],\
+                     devices=[(h,q) for h in hih[0:4]+hih2[1:3] \
+                              for q in ('hum','temp')],\
 #,hih[1],hih[1],hih[2],hih[2],hih[3],hih[3],hih[4],hih[4],hih[5],hih[5],hih[6],hih[6],hih[7],hih[7]],\
                      avg_period=5.0)
     
@@ -247,5 +1048,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt: 
         print('Goodbye!')
     finally:
-        gpio.cleanup()
+        if gpio != None: gpio.cleanup()
 
@@ -0,0 +1,225 @@
+# Opt-in instrumentation for py2C devices -- counts the bus operations (read,
+# write, transaction) and bytes of every device by kind (mux, config, data)
+# and times every get()/get_all() call with log-bucketed latency histograms.
+# The device classes are patched only while the instrumentation is enabled;
+# when it is off, the classes are untouched and it costs nothing.
+#
+#   import pyProbe
+#   pyProbe.enable()
+#   ... (measure)
+#   pyProbe.report()    # or pyProbe.snapshot() for the numbers
+#   pyProbe.disable()
+import time
+import math
+import threading
+import weakref
+import py2C as i2c
+
+# histogram buckets: bucket i counts durations in [2**i,2**(i+1)) us; the
+# first bucket also takes everything shorter, the last everything longer
+NBUCKETS = 24
+
+# operation kinds
+MUX = 'mux'
+CONFIG = 'config'
+DATA = 'data'
+GET = 'get'
+
+# patched methods: bus operations, configuration methods (operations issued
+# within count as CONFIG) and measurement methods (timed as GET)
+_OPS = ('read','write','transaction',)
+_CONFIGS = ('config','get_config','refresh',)
+_GETS = ('get','get_all',)
+
+_originals = {} # (class,name) -> original method, while enabled
+# device -> {kind: Counter}; devices are not kept alive by the recording
+_stats = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_tls = threading.local()
+_clock = time.perf_counter
+
+
+class Counter(object):
+    """ Number of calls, bytes moved, total time and latency histogram of
+    one kind of operation. For GET, 'ops' counts the bus operations issued
+    within the calls. """
+
+    def __init__(self):
+        self.calls = 0
+        self.nbytes = 0
+        self.ops = 0
+        self.time = 0.0
+        self.hist = [0]*NBUCKETS
+
+    def add(self,dt,nbytes=0,ops=0):
+        """ Records one call of duration 'dt' (s). """
+        self.calls += 1
+        self.nbytes += nbytes
+        self.ops += ops
+        self.time += dt
+        us = dt*1e6
+        b = 0 if us < 2 else min(int(math.log(us,2)),NBUCKETS-1)
+        self.hist[b] += 1
+
+    def as_dict(self):
+        """ The numbers as a dictionary; 'hist' maps the lower edge of each
+        non-empty bucket (us) to its count. """
+        return {'calls':self.calls,'bytes':self.nbytes,'ops':self.ops,\
+                'time':self.time,\
+                'mean':self.time/self.calls if self.calls > 0 else 0.0,\
+                'hist':dict((2**b,n) for (b,n) in enumerate(self.hist) \
+                            if n > 0)}
+
+
+def _record(device,kind,dt,nbytes=0,ops=0):
+    with _lock:
+        kinds = _stats.setdefault(device,{})
+        if kind not in kinds: kinds[kind] = Counter()
+        kinds[kind].add(dt,nbytes,ops)
+
+def _nbytes_read(ctrl=None,nbytes=1):
+    return int(nbytes) + (0 if ctrl is None else 1)
+
+def _nbytes_write(data=None,ctrl=None):
+    n = 0 if ctrl is None else 1
+    if type(data) is list:
+        return n + len(data)
+    return n + (1 if data is not None or ctrl is None else 0)
+
+def _nbytes_transaction(*segments):
+    return sum([len(x) if kind == i2c.I2C_WR else x \
+                for (kind,x) in segments])
+
+_NBYTES = {'read':_nbytes_read,'write':_nbytes_write,\
+           'transaction':_nbytes_transaction}
+
+def _wrap_op(name,func):
+    """ Wraps the bus operation 'name'. Operations are charged to the device
+    whose get() is running (if any), else to the device itself. """
+    nbytes = _NBYTES[name]
+    def op(self,*args,**kwargs):
+        if getattr(_tls,'op',False):
+            # nested in another operation; counted there
+            return func(self,*args,**kwargs)
+        _tls.op = True
+        t = _clock()
+        try:
+            return func(self,*args,**kwargs)
+        finally:
+            dt = _clock() - t
+            _tls.op = False
+            if isinstance(self,i2c.I2c_switch):
+                kind = MUX
+            elif getattr(_tls,'config',0) > 0:
+                kind = CONFIG
+            else:
+                kind = DATA
+            owner = getattr(_tls,'owner',None)
+            n = nbytes(*args,**kwargs)
+            _record(self if owner is None else owner,kind,dt,n)
+            if owner is not None:
+                _tls.ops += 1
+                _tls.nbytes += n
+    op.__doc__ = func.__doc__
+    return op
+
+def _wrap_config(func):
+    """ Wraps a configuration method: operations within count as CONFIG. """
+    def config(self,*args,**kwargs):
+        _tls.config = getattr(_tls,'config',0) + 1
+        try:
+            return func(self,*args,**kwargs)
+        finally:
+            _tls.config -= 1
+    config.__doc__ = func.__doc__
+    return config
+
+def _wrap_get(func):
+    """ Wraps a measurement method: times the outermost call and counts the
+    bus operations issued within. """
+    def get(self,*args,**kwargs):
+        if getattr(_tls,'owner',None) is not None:
+            return func(self,*args,**kwargs)
+        (_tls.owner,_tls.ops,_tls.nbytes) = (self,0,0)
+        t = _clock()
+        try:
+            return func(self,*args,**kwargs)
+        finally:
+            dt = _clock() - t
+            _tls.owner = None
+            _record(self,GET,dt,_tls.nbytes,_tls.ops)
+    get.__doc__ = func.__doc__
+    return get
+
+def _classes(cls=i2c.I2c_device):
+    """ 'cls' and all its subclasses. """
+    out = [cls]
+    for sub in cls.__subclasses__():
+        out += [c for c in _classes(sub) if c not in out]
+    return out
+
+
+def enable():
+    """ Patches all device classes (those defined so far) to record their
+    bus operations and measurement calls. Does nothing if already enabled. """
+    if len(_originals) > 0:
+        return
+    for cls in _classes():
+        for name in _OPS + _CONFIGS + _GETS:
+            if name not in cls.__dict__:
+                continue
+            func = cls.__dict__[name]
+            _originals[(cls,name)] = func
+            if name in _OPS:
+                setattr(cls,name,_wrap_op(name,func))
+            elif name in _CONFIGS:
+                setattr(cls,name,_wrap_config(func))
+            else:
+                setattr(cls,name,_wrap_get(func))
+
+def disable():
+    """ Restores the original device classes. The numbers recorded so far
+    are kept (see reset). """
+    for ((cls,name),func) in _originals.items():
+        setattr(cls,name,func)
+    _originals.clear()
+
+def enabled():
+    """ True if the instrumentation is enabled. """
+    return len(_originals) > 0
+
+def reset():
+    """ Discards all numbers recorded so far. """
+    with _lock:
+        _stats.clear()
+
+def snapshot():
+    """ Returns the numbers recorded so far as a dictionary
+        {device name: {kind: {'calls','bytes','ops','time','mean','hist'}}}
+    with the kinds MUX, CONFIG and DATA for bus operations (switch traffic,
+    operations within config()/get_config(), all others) and GET for the
+    get()/get_all() calls. Operations issued within a get() are charged to
+    the measuring device. Device names as given by py2C.device_name. """
+    out = {}
+    with _lock:
+        for (device,kinds) in _stats.items():
+            name = i2c.device_name(device)
+            k = 1
+            while name in out:
+                k += 1
+                name = i2c.device_name(device) + "#{}".format(k)
+            out[name] = dict((kind,c.as_dict()) for (kind,c) in kinds.items())
+    return out
+
+def report():
+    """ Prints the numbers recorded so far, one line per device and kind. """
+    print("{:<36} {:<6} {:>8} {:>8} {:>9} {:>11}".\
+          format("device","kind","calls","bytes","ops/call","mean (us)"))
+    for (name,kinds) in sorted(snapshot().items()):
+        for kind in (GET,MUX,CONFIG,DATA):
+            if kind not in kinds: continue
+            c = kinds[kind]
+            ops = "{:.1f}".format(c['ops']/float(c['calls'])) \
+                  if kind == GET else ""
+            print("{:<36} {:<6} {:>8} {:>8} {:>9} {:>11.1f}".\
+                  format(name,kind,c['calls'],c['bytes'],ops,c['mean']*1e6))
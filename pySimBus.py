@@ -0,0 +1,746 @@
+# Simulated i2c bus for py2C -- a drop-in replacement for smbus.SMBus that
+# routes transactions to register models of the chips supported by py2C and
+# charges a configurable latency per transaction and per byte. Allows running
+# and benchmarking the device classes on machines without an i2c bus.
+import time
+import errno
+
+# the time base used by all chip models (conversion times etc.)
+_now = time.perf_counter
+
+
+def _value(x):
+    """ Returns 'x', or 'x(t)' evaluated at the current time if 'x' is a
+    callable. Used for model inputs that may vary in time. """
+    if callable(x):
+        return x(_now())
+    return x
+
+def _clamp(code,nbits):
+    """ Clamps 'code' to the range of an 'nbits' signed integer and returns
+    the two's complement representation. """
+    code = min(max(int(round(code)),-2**(nbits-1)),2**(nbits-1)-1)
+    return code & (2**nbits-1)
+
+
+# ---------- LATENCY MODEL ----------
+class LatencyModel(object):
+    """ Bus timing model. Every transaction costs 't_trans' seconds plus
+    't_byte' seconds per byte on the wire (address and command bytes
+    included). With 'sleep=True' the bus actually waits for the modelled
+    time, which reproduces production timing; otherwise the time is only
+    accounted for in the bus statistics. With 'release=True' as well, even
+    short waits sleep instead of spinning: other threads run meanwhile, as
+    they do during a blocking i2c ioctl, at the price of some overshoot. """
+
+    def __init__(self,t_trans=0.0,t_byte=0.0,sleep=False,release=False):
+        self.t_trans = t_trans
+        self.t_byte = t_byte
+        self.sleep = sleep
+        self.release = release
+
+    @classmethod
+    def for_clock(cls,clock=100e3,t_trans=50e-6,sleep=False,release=False):
+        """ Latency model of a bus clocked at 'clock' Hz (9 clock cycles per
+        byte, including ACK) with a fixed overhead of 't_trans' seconds per
+        transaction (kernel round-trip, start/stop conditions). """
+        return cls(t_trans=t_trans,t_byte=9.0/clock,sleep=sleep,\
+                   release=release)
+
+    def cost(self,nbytes):
+        """ Returns the modelled duration of a transaction moving 'nbytes'
+        bytes. """
+        return self.t_trans + nbytes*self.t_byte
+
+    def wait(self,duration):
+        """ Blocks for 'duration' seconds if sleeping is enabled. Short waits
+        spin on the clock, since sleep() is too coarse for them. """
+        if not self.sleep or duration <= 0:
+            return
+        if duration > 2e-3 or self.release:
+            time.sleep(duration)
+        else:
+            deadline = _now() + duration
+            while _now() < deadline:
+                pass
+
+
+# ---------- SIMULATED BUS ----------
+class SimBus(object):
+    """ A virtual i2c bus implementing the smbus methods used by py2C. Chip
+    models are attached at an address, optionally behind a channel of a
+    (simulated) i2c switch; they only respond while that channel is enabled.
+    Writes are received by every responding chip, reads from an address with
+    more than one responding chip fail (address collision). Keeps count of
+    transactions, bytes and the modelled bus time. """
+
+    def __init__(self,latency=None):
+        if latency is None: latency = LatencyModel()
+        self.latency = latency
+        self._devices = [] # list of [addr,model,behind]
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Resets the transaction, byte and bus time counters. """
+        self.transactions = 0
+        self.nbytes = 0
+        self.bus_time = 0.0
+
+    def attach(self,model,addr=None,behind=None):
+        """ Attaches the chip model 'model' at address 'addr' (default: the
+        model's default address). 'behind=(switch_model,channel)' places the
+        chip behind a channel of a simulated switch. Returns the model. """
+        if addr is None: addr = model.addr
+        assert addr in range(0,0b10000000),"Invalid address!"
+        if behind is not None:
+            assert isinstance(behind[0],SimTCA9548A),"Expecting a switch!"
+            assert behind[1] in range(behind[0].nchannels),"Invalid channel!"
+        model.addr = addr
+        self._devices.append([addr,model,behind])
+        return model
+
+    def detach(self,model):
+        """ Removes the chip model 'model' from the bus. """
+        self._devices = [d for d in self._devices if d[1] is not model]
+
+    def _visible(self,behind):
+        """ Whether a chip placed 'behind' is connected to the bus. """
+        if behind is None:
+            return True
+        switch,ch = behind
+        if not (switch.ctrl >> ch) & 1:
+            return False
+        # the switch itself may sit behind another switch
+        for d in self._devices:
+            if d[1] is switch:
+                return self._visible(d[2])
+        return False
+
+    def _targets(self,addr):
+        """ Returns the models responding to address 'addr'. """
+        return [d[1] for d in self._devices \
+                if d[0] == addr and self._visible(d[2])]
+
+    def _charge(self,nbytes):
+        """ Accounts for (and possibly waits for) a transaction. """
+        duration = self.latency.cost(nbytes)
+        self.transactions += 1
+        self.nbytes += nbytes
+        self.bus_time += duration
+        self.latency.wait(duration)
+
+    def _write(self,addr,data):
+        targets = self._targets(addr)
+        if len(targets) == 0:
+            raise IOError(errno.EREMOTEIO,"No device at 0x{:02X}".format(addr))
+        for t in targets:
+            t.write(data)
+
+    def _read(self,addr,n):
+        targets = self._targets(addr)
+        if len(targets) == 0:
+            raise IOError(errno.EREMOTEIO,"No device at 0x{:02X}".format(addr))
+        if len(targets) > 1:
+            raise IOError(errno.EIO,\
+                          "Address collision at 0x{:02X}".format(addr))
+        return [b & 0xff for b in targets[0].read(n)]
+
+    # smbus interface
+    def write_quick(self,addr):
+        """ Addresses the device without sending any data. """
+        self._charge(1)
+        self._write(addr,[])
+
+    def write_byte(self,addr,value):
+        """ Writes a single byte to the device. """
+        self._charge(2)
+        self._write(addr,[value])
+
+    def read_byte(self,addr):
+        """ Reads a single byte from the device. """
+        self._charge(2)
+        return self._read(addr,1)[0]
+
+    def write_i2c_block_data(self,addr,cmd,vals):
+        """ Writes the command byte 'cmd' followed by the bytes 'vals'. """
+        self._charge(2+len(vals))
+        self._write(addr,[cmd]+list(vals))
+
+    def read_i2c_block_data(self,addr,cmd,length=32):
+        """ Writes the command byte 'cmd', then reads 'length' bytes after a
+        repeated start. """
+        self._charge(3+length)
+        self._write(addr,[cmd])
+        return self._read(addr,length)
+
+    # combined transfers (I2C_RDWR equivalent, see py2C.I2c_device)
+    def transfer(self,addr,segments):
+        """ Performs the write segments (0,[bytes]) and read segments
+        (1,nbytes) in one transaction. Returns the bytes of each read. """
+        nbytes = 0
+        for (kind,arg) in segments:
+            nbytes += 1 + (arg if kind else len(arg))
+        self._charge(nbytes)
+        out = []
+        for (kind,arg) in segments:
+            if kind:
+                out.append(self._read(addr,arg))
+            else:
+                self._write(addr,list(arg))
+        return out
+
+    def close(self):
+        pass
+
+
+# ---------- CHIP MODELS ----------
+class SimDevice(object):
+    """ Base class of the chip models. A model receives the payload of every
+    write message addressed to it through 'write(data)', and provides the
+    bytes of a read message through 'read(n)'. """
+    addr = 0x00
+
+    def write(self,data):
+        pass
+
+    def read(self,n):
+        return [0xff]*n
+
+
+class SimRegisterFile(SimDevice):
+    """ Generic model of a chip with a register pointer: the first byte of
+    each write selects the register, further bytes are written to it.
+    Registers are 'width' bytes wide (MSB first). Multi-byte transfers on
+    8-bit register files advance the pointer if 'autoinc()' is true. """
+    width = 1
+    _reset = {}
+
+    def __init__(self):
+        self.regs = dict(self._reset)
+        self.ptr = 0x00
+
+    def pointer(self,cmd):
+        """ Returns the register selected by command byte 'cmd'. """
+        return cmd
+
+    def autoinc(self,cmd):
+        """ Whether multi-byte transfers started with 'cmd' advance the
+        register pointer. """
+        return False
+
+    def get_reg(self,reg):
+        """ Returns the content of register 'reg'; override for registers
+        that are computed at read time. """
+        return self.regs.get(reg,0)
+
+    def set_reg(self,reg,value):
+        """ Stores 'value' in register 'reg'; override for side effects. """
+        self.regs[reg] = value
+
+    def write(self,data):
+        if len(data) == 0:
+            return
+        self._cmd = data[0]
+        self.ptr = self.pointer(data[0])
+        payload = list(data[1:])
+        if self.width > 1:
+            for i in range(0,len(payload)-self.width+1,self.width):
+                value = 0
+                for b in payload[i:i+self.width]: value = (value << 8) + b
+                self.set_reg(self.ptr,value)
+        else:
+            for b in payload:
+                self.set_reg(self.ptr,b)
+                if self.autoinc(self._cmd): self.ptr = (self.ptr+1) & 0xff
+
+    def read(self,n):
+        self.begin_read()
+        out = []
+        if self.width > 1:
+            value = self.get_reg(self.ptr)
+            regbytes = [(value >> 8*(self.width-i-1)) & 0xff \
+                        for i in range(self.width)]
+            # further bytes repeat the register content
+            while len(out) < n:
+                out.extend(regbytes)
+            out = out[:n]
+        else:
+            inc = self.autoinc(getattr(self,'_cmd',self.ptr))
+            for i in range(n):
+                out.append(self.get_reg(self.ptr))
+                if inc: self.ptr = (self.ptr+1) & 0xff
+        return out
+
+    def begin_read(self):
+        """ Called at the start of every read message; models latch their
+        outputs here so multi-byte reads are consistent. """
+        pass
+
+
+class SimADS1115(SimRegisterFile):
+    """ Model of the ADS1115 four-channel 16-bit ADC. 'inputs' are the
+    voltages at AIN0..AIN3 (numbers or callables of time). Single-shot and
+    continuous conversions take 1/DR seconds. """
+    addr = 0x48
+    width = 2
+    BIT_DEPTH = 16
+    DR = (8,16,32,64,128,250,475,860)
+    PGA = (6.144,4.096,2.048,1.024,0.512,0.256,0.256,0.256)
+    _reset = {0x00:0x0000,0x01:0x8583,0x02:0x8000,0x03:0x7fff}
+
+    def __init__(self,inputs=(0.0,0.0,0.0,0.0)):
+        SimRegisterFile.__init__(self)
+        self.inputs = list(inputs)
+        self._t_done = None # completion time of pending single-shot
+        self._t_cont = None # start time of continuous conversions
+
+    def pointer(self,cmd):
+        # only the two LSBs of the pointer register are decoded
+        return cmd & 0x03
+
+    def conversion_time(self):
+        """ Duration of one conversion at the current data rate. """
+        return 1.0/self.DR[(self.regs[0x01] >> 5) & 0b111]
+
+    def convert(self):
+        """ Returns the conversion code of the current MUX/PGA setting. """
+        cfg = self.regs[0x01]
+        mux = (cfg >> 12) & 0b111
+        fs = self.PGA[(cfg >> 9) & 0b111]
+        ain = [_value(v) for v in self.inputs]
+        pos,neg = [(0,1),(0,3),(1,3),(2,3),\
+                   (0,None),(1,None),(2,None),(3,None)][mux]
+        v = ain[pos] - (0.0 if neg is None else ain[neg])
+        code = _clamp(v/fs*2**15,16)
+        # 12-bit parts report left-aligned codes
+        return code & ~(2**(16-self.BIT_DEPTH)-1) & 0xffff
+
+    def _update(self):
+        """ Completes pending conversions. """
+        t = _now()
+        if self._t_done is not None and t >= self._t_done:
+            self.regs[0x00] = self.convert()
+            self._t_done = None
+        if self._t_cont is not None \
+           and t - self._t_cont >= self.conversion_time():
+            self.regs[0x00] = self.convert()
+
+    def set_reg(self,reg,value):
+        self._update()
+        if reg == 0x00:
+            return # conversion register is read-only
+        if reg != 0x01:
+            self.regs[reg] = value
+            return
+        self.regs[reg] = value & 0x7fff
+        if value & 0x0100:
+            # single-shot mode; OS=1 starts a conversion
+            self._t_cont = None
+            if value & 0x8000 and self._t_done is None:
+                self._t_done = _now() + self.conversion_time()
+        elif self._t_cont is None:
+            self._t_cont = _now()
+
+    def get_reg(self,reg):
+        self._update()
+        if reg == 0x01:
+            # OS reads 0 while a conversion is in progress
+            busy = self._t_done is not None
+            return (self.regs[0x01] & 0x7fff) | (0 if busy else 0x8000)
+        return self.regs[reg]
+
+
+class SimADS1015(SimADS1115):
+    """ Model of the ADS1015 four-channel 12-bit ADC. """
+    BIT_DEPTH = 12
+    DR = (128,250,490,920,1600,2400,3300,3300)
+
+
+class SimHIH8121(SimDevice):
+    """ Model of the HIH8121 humidity and temperature sensor. Any write
+    starts a measurement cycle (unless one is running); reads return the
+    last completed measurement, flagged stale (status 1) if it has been
+    fetched before. 'hum' (%RH) and 'temp' (C) may be callables of time. """
+    addr = 0x27
+    BIT_DEPTH = 14
+    T_MEAS = 36.65e-3
+
+    def __init__(self,hum=45.0,temp=22.0):
+        self.hum = hum
+        self.temp = temp
+        self._t_done = None
+        self._data = (0,0)
+        self._fresh = False
+
+    def _update(self):
+        if self._t_done is not None and _now() >= self._t_done:
+            full = 2**self.BIT_DEPTH - 2
+            hum_raw = int(round(_value(self.hum)/100.0*full))
+            temp_raw = int(round((_value(self.temp)+40.0)/165.0*full))
+            self._data = (min(max(hum_raw,0),full),min(max(temp_raw,0),full))
+            self._fresh = True
+            self._t_done = None
+
+    def write(self,data):
+        self._update()
+        if self._t_done is None:
+            self._t_done = _now() + self.T_MEAS
+
+    def read(self,n):
+        self._update()
+        status = 0 if self._fresh else 1
+        self._fresh = False
+        hum_raw,temp_raw = self._data
+        out = [(status << 6) + (hum_raw >> 8),hum_raw & 0xff,\
+               temp_raw >> 6,(temp_raw << 2) & 0xff]
+        return (out + [0xff]*n)[:n]
+
+
+class SimTCA9548A(SimDevice):
+    """ Model of the TCA9548A eight-channel i2c switch. The control byte
+    enables channel i if bit i is set. """
+    addr = 0x70
+    nchannels = 8
+
+    def __init__(self):
+        self.ctrl = 0x00
+
+    def write(self,data):
+        if len(data) > 0:
+            self.ctrl = data[-1] & (2**self.nchannels-1)
+
+    def read(self,n):
+        return [self.ctrl]*n
+
+
+class SimTCA9545A(SimTCA9548A):
+    """ Model of the TCA9545A four-channel i2c switch (interrupt bits always
+    read 0). """
+    nchannels = 4
+
+
+class SimMCP9808(SimRegisterFile):
+    """ Model of the MCP9808 temperature sensor; 'temp' in C. """
+    addr = 0x18
+    width = 2
+    _reset = {0x01:0x0000,0x02:0x0000,0x03:0x0000,0x04:0x0000,\
+              0x06:0x0054,0x07:0x0400,0x08:0x0003}
+
+    def __init__(self,temp=22.0):
+        SimRegisterFile.__init__(self)
+        self.temp = temp
+
+    def pointer(self,cmd):
+        return cmd & 0x0f
+
+    def get_reg(self,reg):
+        if reg == 0x05:
+            # 13-bit two's complement in 1/16 C, flag bits cleared
+            return _clamp(_value(self.temp)*16,13)
+        return self.regs.get(reg,0)
+
+
+class SimLSM9DS1_MAG(SimRegisterFile):
+    """ Model of the LSM9DS1 magnetometer. 'field' is the (x,y,z) field in
+    gauss; outputs are scaled by the full-scale setting. Multi-byte reads
+    advance the pointer if bit 7 of the sub-address is set. """
+    addr = 0x1e
+    FS = (4.0,8.0,12.0,16.0)
+    _reset = {0x0f:0x3d,0x20:0x10,0x21:0x00,0x22:0x03,0x23:0x00,0x24:0x00,\
+              0x27:0x0f}
+
+    def __init__(self,field=(0.0,0.0,0.0)):
+        SimRegisterFile.__init__(self)
+        self.field = field
+        self._out = [0]*6
+
+    def pointer(self,cmd):
+        return cmd & 0x7f
+
+    def autoinc(self,cmd):
+        return bool(cmd & 0x80)
+
+    def begin_read(self):
+        fs = self.FS[(self.regs[0x21] >> 5) & 0b11]
+        out = []
+        for b in _value(self.field):
+            code = _clamp(b/fs*2**15,16)
+            out.extend([code & 0xff,code >> 8])
+        self._out = out
+
+    def get_reg(self,reg):
+        if 0x28 <= reg <= 0x2d:
+            return self._out[reg-0x28]
+        return self.regs.get(reg,0)
+
+
+class SimLSM9DS1_ACC(SimRegisterFile):
+    """ Model of the LSM9DS1 accelerometer and gyroscope. 'rate' (dps) and
+    'acc' (g) are (x,y,z) triplets, 'temp' in C; outputs are scaled by the
+    full-scale settings. Multi-byte reads advance the pointer if IF_ADD_INC
+    is set (default). With FIFO_EN set and a FIFO mode other than bypass,
+    samples are collected in a 32-slot FIFO at the gyroscope data rate; the
+    output registers then show the oldest slot, which is discarded once its
+    last accelerometer byte (0x2d) has been read. """
+    addr = 0x6b
+    FS_G = (245.0,500.0,1000.0,2000.0)
+    FS_XL = (2.0,16.0,4.0,8.0)
+    ODR_G = (0.0,14.9,59.5,119.0,238.0,476.0,952.0,0.0)
+    FIFO_SIZE = 32
+    _reset = {0x0f:0x68,0x10:0x00,0x11:0x00,0x12:0x00,0x13:0x00,0x17:0x07,\
+              0x1e:0x38,0x1f:0x38,0x20:0x00,0x21:0x00,0x22:0x04,0x23:0x00,\
+              0x24:0x00,0x27:0x07,0x2e:0x00}
+
+    def __init__(self,rate=(0.0,0.0,0.0),acc=(0.0,0.0,1.0),temp=25.0):
+        SimRegisterFile.__init__(self)
+        self.rate = rate
+        self.acc = acc
+        self.temp = temp
+        self._out = {}
+        self._fifo = []
+        self._ovrn = False
+        self._t_fifo = None # start of FIFO collection
+        self._nfifo = 0 # samples collected since start
+
+    def autoinc(self,cmd):
+        return bool(self.regs[0x22] & 0x04)
+
+    def sample(self):
+        """ Returns the output registers (0x15..0x2d) of one sample. """
+        out = {}
+        code = _clamp((_value(self.temp)-25.0)*16,16)
+        out[0x15],out[0x16] = code & 0xff,code >> 8
+        fs = self.FS_G[(self.regs[0x10] >> 3) & 0b11]
+        for i,r in enumerate(_value(self.rate)):
+            code = _clamp(r/fs*2**15,16)
+            out[0x18+2*i],out[0x19+2*i] = code & 0xff,code >> 8
+        fs = self.FS_XL[(self.regs[0x20] >> 3) & 0b11]
+        for i,a in enumerate(_value(self.acc)):
+            code = _clamp(a/fs*2**15,16)
+            out[0x28+2*i],out[0x29+2*i] = code & 0xff,code >> 8
+        return out
+
+    def fifo_active(self):
+        return bool(self.regs[0x23] & 0x02) and (self.regs[0x2e] >> 5) != 0
+
+    def _fifo_update(self):
+        """ Collects the samples produced since the last update. """
+        if not self.fifo_active():
+            self._t_fifo = None
+            return
+        odr = self.ODR_G[self.regs[0x10] >> 5]
+        t = _now()
+        if self._t_fifo is None or odr == 0:
+            self._t_fifo = t
+            self._nfifo = 0
+            return
+        n = int((t-self._t_fifo)*odr) - self._nfifo
+        self._nfifo += n
+        fifo_mode = (self.regs[0x2e] >> 5) == 0b001
+        for i in range(min(n,self.FIFO_SIZE+1)):
+            if len(self._fifo) == self.FIFO_SIZE:
+                if fifo_mode: break # FIFO mode stops when full
+                self._fifo.pop(0)
+                self._ovrn = True
+            self._fifo.append(self.sample())
+
+    def set_reg(self,reg,value):
+        self.regs[reg] = value
+        if reg == 0x2e and (value >> 5) == 0:
+            # bypass mode empties the FIFO
+            self._fifo = []
+            self._ovrn = False
+        self._fifo_update()
+
+    def begin_read(self):
+        self._fifo_update()
+        if self.fifo_active() and len(self._fifo) > 0:
+            self._out = self._fifo[0]
+        else:
+            self._out = self.sample()
+
+    def get_reg(self,reg):
+        if reg == 0x2f:
+            n = len(self._fifo)
+            fth = n >= (self.regs[0x2e] & 0x1f) > 0
+            return (fth << 7) | (self._ovrn << 6) | n
+        if reg in self._out:
+            if reg == 0x2d and self.fifo_active() and len(self._fifo) > 0 \
+               and self._out is self._fifo[0]:
+                self._fifo.pop(0)
+                self._ovrn = False
+            return self._out[reg]
+        return self.regs.get(reg,0)
+
+
+class SimLSM9DS0_XM(SimRegisterFile):
+    """ Model of the LSM9DS0 accelerometer/magnetometer part. Outputs are
+    given as raw 16-bit counts 'acc' and 'mag' (x,y,z) and a 12-bit 'temp'
+    count. Multi-byte reads advance the pointer if bit 7 of the sub-address
+    is set. """
+    addr = 0x1d
+    _reset = {0x0f:0x49,0x20:0x07,0x21:0x00,0x24:0x18,0x25:0x20,0x26:0x02}
+
+    def __init__(self,acc=(0,0,0),mag=(0,0,0),temp=0):
+        SimRegisterFile.__init__(self)
+        self.acc = acc
+        self.mag = mag
+        self.temp = temp
+
+    def pointer(self,cmd):
+        return cmd & 0x7f
+
+    def autoinc(self,cmd):
+        return bool(cmd & 0x80)
+
+    def get_reg(self,reg):
+        if reg in (0x05,0x06):
+            code = _clamp(_value(self.temp),12)
+            return (code & 0xff) if reg == 0x05 else (code >> 8)
+        for base,vec in ((0x08,self.mag),(0x28,self.acc)):
+            if base <= reg < base+6:
+                code = _clamp(_value(vec)[(reg-base)//2],16)
+                return (code & 0xff) if (reg-base)%2 == 0 else (code >> 8)
+        return self.regs.get(reg,0)
+
+
+class SimLSM9DS0_G(SimRegisterFile):
+    """ Model of the LSM9DS0 gyroscope part; 'rate' in raw 16-bit counts. """
+    addr = 0x6b
+    _reset = {0x0f:0xd4,0x20:0x07,0x23:0x00}
+
+    def __init__(self,rate=(0,0,0)):
+        SimRegisterFile.__init__(self)
+        self.rate = rate
+
+    def pointer(self,cmd):
+        return cmd & 0x7f
+
+    def autoinc(self,cmd):
+        return bool(cmd & 0x80)
+
+    def get_reg(self,reg):
+        if 0x28 <= reg < 0x2e:
+            code = _clamp(_value(self.rate)[(reg-0x28)//2],16)
+            return (code & 0xff) if (reg-0x28)%2 == 0 else (code >> 8)
+        return self.regs.get(reg,0)
+
+
+class SimDAC8574(SimDevice):
+    """ Model of the DAC8574 four-channel 16-bit DAC. Writes consist of a
+    control byte and two data bytes; 'outputs' holds the DAC codes of the
+    four channels, 'ext_addr' the extended address set by the A3/A2 pins. """
+    addr = 0x4c
+
+    def __init__(self,ext_addr=0b00):
+        self.ext_addr = ext_addr
+        self.temp = [0,0,0,0]
+        self.outputs = [0,0,0,0]
+        self._sel = 0
+
+    def write(self,data):
+        if len(data) < 3:
+            return
+        ctrl,value = data[0],(data[1] << 8) + data[2]
+        load = (ctrl >> 4) & 0b11
+        ch = (ctrl >> 1) & 0b11
+        if load == 0b11:
+            # broadcast update of all channels
+            self.temp = [value]*4
+            self.outputs = list(self.temp)
+            return
+        if (ctrl >> 6) != self.ext_addr:
+            return # addressed to another chip on the same address
+        self._sel = ch
+        self.temp[ch] = value
+        if load == 0b01:
+            self.outputs[ch] = value
+        elif load == 0b10:
+            self.outputs = list(self.temp)
+
+    def read(self,n):
+        value = self.temp[self._sel]
+        out = [value >> 8,value & 0xff,(self.ext_addr << 6) + (self._sel << 1)]
+        return (out + [0xff]*n)[:n]
+
+
+# ---------- SIMULATED PINS ----------
+class SimPin(object):
+    """ A simulated GPIO edge source with the interface of py2C.GpioEdge.
+    Edges are produced now with fire(), or at given times with schedule()
+    (e.g. from another thread or ahead of an acquisition). """
+
+    def __init__(self):
+        self.t_edge = None # time of the last edge seen
+        self._pending = [] # times of edges not seen yet
+
+    def fire(self,t=None):
+        """ Produces an edge at time 't' (default: now). """
+        self._pending.append(_now() if t is None else t)
+        self._pending.sort()
+
+    def schedule(self,times):
+        """ Produces edges at the given times. """
+        for t in times: self.fire(t)
+
+    def _next(self):
+        """ Time of the next edge not seen yet (None if none is known). """
+        return self._pending[0] if len(self._pending) > 0 else None
+
+    def _consume(self,t):
+        self._pending.pop(0)
+        self.t_edge = t
+
+    def poll(self):
+        """ Returns the time of an edge that occurred since the last call
+        (None if there was none); does not block. """
+        t = self._next()
+        if t is None or t > _now():
+            return None
+        self._consume(t)
+        return t
+
+    def wait(self,timeout=None):
+        """ Blocks until the next edge for at most 'timeout' seconds. Returns
+        the time of the edge, or None on timeout. """
+        deadline = None if timeout is None else _now() + timeout
+        while True:
+            t = self._next()
+            if t is not None and (deadline is None or t <= deadline):
+                while _now() < t:
+                    time.sleep(max(0.0,min(t-_now()-2e-4,1e-3)))
+                self._consume(t)
+                return t
+            if deadline is not None and _now() >= deadline:
+                return None
+            time.sleep(1e-3)
+
+    def close(self):
+        pass
+
+
+class SimAlertPin(SimPin):
+    """ The ALERT/RDY pin of a simulated ADS1x15 ('model') in continuous mode,
+    configured as conversion-ready signal: one edge at the end of every
+    conversion. Like GPIO event detection, edges missed by a slow reader
+    coalesce into the most recent one. """
+
+    def __init__(self,model):
+        SimPin.__init__(self)
+        self.model = model
+        self._k = 0 # index of the last conversion seen
+
+    def _next(self):
+        t0 = self.model._t_cont
+        if t0 is None:
+            return None
+        T = self.model.conversion_time()
+        if self.t_edge is None or self.t_edge < t0:
+            self._k = 0
+        k = max(self._k + 1,int((_now() - t0)/T))
+        return t0 + k*T
+
+    def _consume(self,t):
+        T = self.model.conversion_time()
+        self._k = int(round((t - self.model._t_cont)/T))
+        self.t_edge = t
@@ -0,0 +1,448 @@
+# Behaviour tests of py2C on the simulated bus (see pySimBus). Run with
+#   python -m pytest -q
+import time
+import numpy as np
+import pytest
+import py2C as i2c
+import pySimBus as sim
+
+
+# ---------- BUS REGISTRY ----------
+class FakeSMBus(object):
+    """ Stands in for smbus.SMBus; remembers the buses it opened. """
+    opened = []
+    def __init__(self,busnum):
+        self.busnum = busnum
+        self.closed = False
+        self.opened.append(self)
+    def close(self):
+        self.closed = True
+
+def test_devices_share_registered_bus(bus):
+    bus.attach(sim.SimMCP9808(temp=21.5),0x18)
+    (a,b) = (i2c.MCP9808(),i2c.MCP9808())
+    assert a.bus is bus and b.bus is bus
+    assert a.busnum == 1
+    assert a.get() == 21.5
+
+def test_bus_handle_instead_of_number():
+    bus = sim.SimBus()
+    bus.attach(sim.SimMCP9808(temp=-5.25),0x18)
+    dev = i2c.MCP9808(bus=bus)
+    assert dev.bus is bus and dev.busnum == None
+    assert dev.get() == -5.25
+
+def test_buses_open_lazily(monkeypatch):
+    monkeypatch.setattr(i2c,'smbus',None)
+    with pytest.raises(IOError):
+        i2c.get_bus(97)
+    monkeypatch.setattr(i2c,'smbus',type('smbus',(),{'SMBus':FakeSMBus}))
+    del FakeSMBus.opened[:]
+    handle = i2c.get_bus(97)
+    assert i2c.get_bus(97) is handle
+    assert [h.busnum for h in FakeSMBus.opened] == [97]
+    i2c.close_buses()
+    assert handle.closed
+    # opened again on next use
+    assert i2c.get_bus(97) is not handle
+    i2c.close_buses()
+
+
+# ---------- COMBINED TRANSACTIONS ----------
+class PlainBus(object):
+    """ A simulated bus seen through the plain smbus methods only. """
+    def __init__(self,bus):
+        self._sim = bus
+    def __getattr__(self,name):
+        if name == 'transfer':
+            raise AttributeError(name)
+        return getattr(self._sim,name)
+
+def test_config_spanning_registers(bus):
+    model = bus.attach(sim.SimLSM9DS1_MAG(),0x1c)
+    mag = i2c.LSM9DS1_MAG(addr=0x1c)
+    bus.reset_stats()
+    mag.config(ODR=7,FS=1,MD=0)
+    # all three registers read in one transaction, written in another
+    assert bus.transactions == 2
+    assert (model.get_reg(0x20) >> 2) & 0b111 == 7
+    assert (model.get_reg(0x21) >> 5) & 0b11 == 1
+    assert model.get_reg(0x22) & 0b11 == 0
+
+def test_transaction_on_plain_smbus(bus):
+    bus.attach(sim.SimMCP9808(temp=21.5),0x18)
+    mcp = i2c.MCP9808(bus=PlainBus(bus))
+    segs = ((i2c.I2C_WR,[0x05]),(i2c.I2C_RD,2),(i2c.I2C_WR,[0x07]),\
+            (i2c.I2C_RD,2))
+    bus.reset_stats()
+    # each pointer and read pair becomes a block read
+    assert mcp.transaction(*segs) == [[0x01,0x58],[0x04,0x00]]
+    assert bus.transactions == 2
+    with pytest.raises(IOError):
+        mcp.transaction((i2c.I2C_RD,2))
+    mcp = i2c.MCP9808()
+    bus.reset_stats()
+    assert mcp.transaction(*segs) == [[0x01,0x58],[0x04,0x00]]
+    assert bus.transactions == 1
+
+def test_plain_smbus_fallback(bus):
+    tca = switched(bus,[sim.SimHIH8121(hum=40.0+ch) for ch in range(2)],\
+                   range(2))
+    model = bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    i2c.set_bus(1,PlainBus(bus))
+    sensors = [i2c.HIH8121(group={'me':ch,'channels':[0,1],\
+                                  'switch':tca}) for ch in range(2)]
+    assert not sensors[0].combined_transfers()
+    out = i2c.HIH8121.sweep(sensors)
+    assert [round(h,1) for (h,t,s) in out] == [40.0,41.0]
+    adc = i2c.ADS1115(addr=0x48)
+    adc.config(DR=7)
+    out = adc.stream(3,sim.SimAlertPin(model),ch=1)
+    assert np.allclose(out,-0.2,atol=1e-3)
+
+
+# ---------- SHADOW REGISTERS ----------
+def test_config_is_served_from_shadow(bus):
+    model = bus.attach(sim.SimADS1115(),0x48)
+    adc = i2c.ADS1115(addr=0x48)
+    adc.config(DR=7)
+    # the register is read once, then every change is a single write
+    bus.reset_stats()
+    adc.config(PGA=2)
+    assert bus.transactions == 1
+    assert (model.get_reg(0x01) >> 9) & 0b111 == 2
+    assert (model.get_reg(0x01) >> 5) & 0b111 == 7
+    bus.reset_stats()
+    assert adc.get_config(True,'PGA','DR') == {'PGA':2,'DR':7}
+    assert bus.transactions == 0
+
+def test_volatile_entries_are_read(bus):
+    bus.attach(sim.SimADS1115(),0x48)
+    adc = i2c.ADS1115(addr=0x48)
+    adc.config(PGA=1)
+    bus.reset_stats()
+    adc.get_config(True,'OS')
+    assert bus.transactions == 1
+    # writing the register leaves OS at its neutral value: no conversion
+    # is started by a plain configuration change
+    adc.config(MODE=1,OS=0)
+    adc.config(PGA=2)
+    assert adc.get_config(True,'OS')['OS'] == 1
+
+def test_invalidate_rereads(bus):
+    model = bus.attach(sim.SimADS1115(),0x48)
+    adc = i2c.ADS1115(addr=0x48)
+    adc.config(PGA=1)
+    # changed behind the instance's back
+    model.set_reg(0x01,(model.get_reg(0x01) & ~(0b111 << 9)) | (3 << 9))
+    assert adc.get_config(True,'PGA')['PGA'] == 1
+    adc.invalidate('PGA')
+    assert adc.get_config(True,'PGA')['PGA'] == 3
+
+
+def test_compiled_fields():
+    assert i2c.ADS1115._conf_fields['PGA'] == (0x01,9,0b111)
+    assert i2c.ADS1115._conf_fields['MUX'] == (0x01,12,0b111)
+    assert i2c.ADS1115._data_seg['CONV'] == ((i2c.I2C_WR,[0x00]),\
+                                              (i2c.I2C_RD,2))
+
+
+# ---------- LSM9DS1 BURSTS AND FIFO ----------
+def test_mag_vector(bus):
+    bus.attach(sim.SimLSM9DS1_MAG(field=(0.1,0.2,-0.3)),0x1c)
+    mag = i2c.LSM9DS1_MAG(addr=0x1c)
+    mag.get_vector()
+    bus.reset_stats()
+    vec = mag.get_vector(FS=4.0)
+    # the BDU check is served from the shadow register: a single burst
+    assert bus.transactions == 1
+    assert np.allclose(vec,(0.1,0.2,-0.3),atol=4.0/2**15)
+
+def test_acc_snapshot(bus):
+    bus.attach(sim.SimLSM9DS1_ACC(rate=(10.0,-20.0,30.0),\
+                                  acc=(0.5,-0.25,1.0),temp=25.0),0x6b)
+    acc = i2c.LSM9DS1_ACC(addr=0x6b)
+    (gyro,xl,temp) = acc.get_snapshot(FS_G=245.0,FS_XL=2.0)
+    assert np.allclose(gyro,(10.0,-20.0,30.0),atol=245.0/2**15)
+    assert np.allclose(xl,(0.5,-0.25,1.0),atol=2.0/2**15)
+    assert temp == 0.0
+
+
+def test_acc_fifo_stream(bus):
+    bus.attach(sim.SimLSM9DS1_ACC(rate=(10.0,-20.0,30.0),\
+                                  acc=(0.5,-0.25,1.0)),0x6b)
+    acc = i2c.LSM9DS1_ACC(addr=0x6b)
+    blocks = list(acc.stream(ODR=6,nframes=40,FS_G=245.0,FS_XL=2.0))
+    data = np.concatenate(blocks)
+    assert data.shape == (40,7)
+    assert np.all(np.diff(data[:,0]) > 0)
+    assert np.allclose(data[:,1:4],(10.0,-20.0,30.0),atol=245.0/2**15)
+    assert np.allclose(data[:,4:7],(0.5,-0.25,1.0),atol=2.0/2**15)
+    # FIFO disabled afterwards
+    assert acc.get_config(True,'FIFO_EN')['FIFO_EN'] == 0
+
+def test_acc_fifo_blocks(bus):
+    bus.attach(sim.SimLSM9DS1_ACC(),0x6b)
+    acc = i2c.LSM9DS1_ACC(addr=0x6b)
+    bus.reset_stats()
+    sizes = [len(b) for b in acc.stream(ODR=6,nframes=200)]
+    assert sum(sizes) == 200
+    # whole read transactions from a FIFO filled to the threshold
+    for n in sizes[:-1]:
+        assert n >= acc.FIFO_DRAIN and n % acc.FIFO_BURST == 0
+    assert bus.transactions < 200/4
+
+
+# ---------- ADS1x15 ----------
+def test_ads_stream(bus):
+    model = bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    adc = i2c.ADS1115(addr=0x48)
+    adc.config(DR=7,PGA=2)
+    bus.reset_stats()
+    out = adc.stream(20,sim.SimAlertPin(model),ch=2)
+    assert np.allclose(out,0.3,atol=1e-3)
+    # a plain read per conversion, a few for setting up and tearing down
+    assert bus.transactions <= 20 + 6
+    assert adc.get_config(True,'MODE')['MODE'] == 1
+    with pytest.raises(IOError):
+        adc.stream(5,sim.SimPin(),ch=2,timeout=0.01)
+    assert adc.get_config(True,'MODE')['MODE'] == 1
+
+def test_ads_stream_in_group(bus):
+    model = sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4))
+    tca = switched(bus,[sim.SimHIH8121(),model],[0,1])
+    group = lambda ch: {'me':ch,'channels':[0,1],'switch':tca}
+    hih = i2c.HIH8121(group=group(0))
+    adc = i2c.ADS1115(addr=0x48,group=group(1))
+    adc.set_focus()
+    adc.config(DR=7)
+    # another device on the switch was read last
+    hih.get()
+    out = adc.stream(5,sim.SimAlertPin(model),ch=1)
+    assert np.allclose(out,-0.2,atol=1e-3)
+
+
+def test_ads_waits_for_data_rate(bus):
+    model = bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    adc = i2c.ADS1115(addr=0x48)
+    adc.config(DR=4,PGA=2)
+    assert adc.conversion_time() == 1/128.0
+    t = time.perf_counter()
+    assert abs(adc.get_single(ch=1) + 0.2) < 1e-3
+    assert time.perf_counter() - t >= 1/128.0
+    assert i2c.ADS1015._conf_reg['DR'][4][7] == 3300
+    # a chip slower than its data rate
+    model.conversion_time = lambda: 1.0
+    with pytest.raises(IOError):
+        adc.get_single(ch=1)
+
+
+def test_ads_scan(bus):
+    bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    adc = i2c.ADS1115(addr=0x48,cycle=[0b100,0b101,0b110,0b111])
+    adc.config(DR=7,PGA=2)
+    bus.reset_stats()
+    assert np.allclose(adc.scan(),[0.1,-0.2,0.3,0.4],atol=1e-3)
+    # the start of the first conversion, then one transaction per
+    # conversion reading it and starting the next, besides the OS checks
+    assert bus.transactions <= 1 + 2*4
+    # PGA per channel: AIN3 clips at 0.256 V
+    out = adc.scan([0b111,0b000],PGA=[5,2])
+    assert np.allclose(out,[0.256,0.3],atol=1e-3)
+    assert adc.get_config(True,'PGA')['PGA'] == 2
+
+def test_ads_scan_needs_channels(bus):
+    bus.attach(sim.SimADS1115(),0x48)
+    adc = i2c.ADS1115(addr=0x48)
+    with pytest.raises(ValueError):
+        adc.scan()
+
+
+# ---------- SWITCHES ----------
+def switched(bus,models,channels,addr=0x70):
+    """ Attaches 'models' behind the channels 'channels' of a simulated
+    TCA9548A at 'addr'; returns the switch device. """
+    switch = bus.attach(sim.SimTCA9548A(),addr)
+    for (model,ch) in zip(models,channels):
+        bus.attach(model,behind=(switch,ch))
+    return i2c.TCA9548A(addr=addr)
+
+def test_switch_writes_only_on_change(bus):
+    tca = switched(bus,[sim.SimMCP9808(temp=20.0+ch) for ch in (0,3)],[0,3])
+    group = lambda ch: {'me':ch,'channels':[0,3],'switch':tca}
+    tca.select(0)
+    m0 = i2c.MCP9808(group=group(0))
+    tca.select(3)
+    m3 = i2c.MCP9808(group=group(3))
+    bus.reset_stats()
+    assert [m3.get(),m3.get()] == [23.0,23.0]
+    assert bus.transactions == 2
+    assert [m0.get(),m0.get()] == [20.0,20.0]
+    assert bus.transactions == 2 + 3
+    assert tca.get_settings()[0:4] == [1,0,0,0]
+    assert bus.transactions == 2 + 3
+    # changed behind the instance's back
+    bus.write_byte(0x70,0b1000)
+    tca.resync()
+    assert m0.get() == 20.0
+
+def test_select_isolates_other_switches(bus):
+    tca = [switched(bus,[sim.SimMCP9808(temp=20.0+k)],[0],addr=0x70+k) \
+           for k in range(2)]
+    for sw in tca:
+        sw.disable_all()
+    tca[0].select(0)
+    m0 = i2c.MCP9808(group={'me':0,'channels':[0],'switch':tca[0]})
+    tca[1].select(0)
+    m1 = i2c.MCP9808(group={'me':0,'channels':[0],'switch':tca[1]})
+    # the same address behind both switches: only one may be connected
+    assert [m0.get(),m1.get(),m0.get()] == [20.0,21.0,20.0]
+    assert tca[1].get_settings()[0] == 0
+
+def test_failed_switch_write(bus,monkeypatch):
+    tca = switched(bus,[],[])
+    tca.select(1)
+    def failing_write(error):
+        def write(*args,**kwargs):
+            raise error
+        return write
+    # the switch may or may not have taken the setting
+    monkeypatch.setattr(tca,'write',failing_write(IOError))
+    with pytest.raises(IOError):
+        tca.select(2)
+    assert tca._ctrl == None
+    monkeypatch.undo()
+    tca.select(1)
+    monkeypatch.setattr(tca,'write',failing_write(KeyboardInterrupt))
+    with pytest.raises(KeyboardInterrupt):
+        tca.select(2)
+    assert tca._ctrl == 0b10
+
+
+def test_schedule_reads_spares_switch_writes(bus):
+    hih = [sim.SimHIH8121(hum=40.0+ch) for ch in range(2)]
+    mcp = [sim.SimMCP9808(temp=24.0)]
+    tca = switched(bus,hih+mcp,[0,1,4])
+    group = lambda ch: {'me':ch,'channels':[0,1,4],'switch':tca}
+    (h0,h1) = [i2c.HIH8121(group=group(ch)) for ch in range(2)]
+    tca.select(4,[0,1,4])
+    m4 = i2c.MCP9808(group=group(4))
+    devices = [h0,m4,h0,m4,h1,m4]
+    # one transaction per reading plus the switch writes
+    tca.disable_all()
+    bus.reset_stats()
+    plain = [d.get() for d in devices]
+    assert bus.transactions == 6 + 6
+    tca.disable_all()
+    bus.reset_stats()
+    order = i2c.schedule_reads(devices)
+    scheduled = i2c.read_scheduled(devices,order)
+    assert bus.transactions == 6 + 3
+    assert [devices[i] for i in order] == [h0,h0,h1,m4,m4,m4]
+    assert scheduled[1::2] == plain[1::2] == [24.0]*3
+    # the route selected right now is visited first
+    assert i2c.schedule_reads(devices)[0] == 1
+
+
+# ---------- HIH8121 ----------
+def test_hih_sweep(bus,monkeypatch):
+    models = [sim.SimHIH8121(hum=40.0+ch,temp=20.0+ch) for ch in range(4)]
+    tca = switched(bus,models,range(4))
+    sensors = [i2c.HIH8121(group={'me':ch,'channels':[0,1,2,3],\
+                                  'switch':tca}) for ch in range(4)]
+    requests = []
+    write = sim.SimHIH8121.write
+    def counting_write(self,data):
+        requests.append(self)
+        return write(self,data)
+    monkeypatch.setattr(sim.SimHIH8121,'write',counting_write)
+    tca.get_settings()
+    bus.reset_stats()
+    out = i2c.HIH8121.sweep(sensors)
+    # a single broadcast request (and the switch write enabling all
+    # channels), then a switch write and a read per sensor
+    assert sorted(map(id,requests)) == sorted(map(id,models))
+    assert bus.transactions == 2 + 2*4
+    for (ch,(hum,temp,status)) in enumerate(out):
+        assert status == 0
+        assert abs(hum - (40.0+ch)) < 0.01
+        assert abs(temp - (20.0+ch)) < 0.02
+
+
+# ---------- OUTPUTS ----------
+def test_get_all(bus):
+    bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    bus.attach(sim.SimMCP9808(temp=-5.25),0x18)
+    bus.attach(sim.SimLSM9DS1_MAG(field=(0.1,0.2,-0.3)),0x1c)
+    adc = i2c.ADS1115(addr=0x48,cycle=[0b100,0b111])
+    adc.config(DR=7,PGA=2)
+    mcp = i2c.MCP9808()
+    mag = i2c.LSM9DS1_MAG(addr=0x1c)
+    assert adc.outputs == ('AIN0-GND','AIN3-GND')
+    assert np.allclose(adc.get_all(),[0.1,0.4],atol=1e-3)
+    assert mcp.outputs == ('temp',) and mcp.get_all() == (-5.25,)
+    assert mag.outputs == ('x','y','z')
+    assert np.allclose(mag.get_all(),mag.get_vector())
+    adc.cycle = None
+    assert adc.outputs == ('V',)
+
+def test_ads_outputs_keep_order(bus):
+    bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    adc = i2c.ADS1115(addr=0x48,cycle=[0b100,0b101,0b110])
+    adc.config(DR=7,PGA=2)
+    outputs = adc.outputs
+    # get() reads the channels in turn
+    assert abs(adc.get() - 0.1) < 1e-3
+    assert adc.outputs == outputs == ('AIN0-GND','AIN1-GND','AIN2-GND')
+    assert np.allclose(adc.get_all(),[0.1,-0.2,0.3],atol=1e-3)
+    assert np.allclose(adc.scan(),[0.1,-0.2,0.3],atol=1e-3)
+    assert abs(adc.get() + 0.2) < 1e-3
+
+
+# ---------- BATCH DECODERS ----------
+@pytest.mark.parametrize('cls,model_cls',\
+                         [(i2c.ADS1115,sim.SimADS1115),\
+                          (i2c.ADS1015,sim.SimADS1015)])
+def test_decode_ads_matches_get(bus,cls,model_cls):
+    bus.attach(model_cls(inputs=(0.1,-0.2,1.5,0.4)),0x48)
+    adc = cls(addr=0x48)
+    for PGA in (0,2,5):
+        adc.config(PGA=PGA,DR=7)
+        raw = []
+        ref = []
+        for MUX in (0b100,0b101,0b110,0b111):
+            ref.append(adc.get_single(MUX=MUX))
+            raw.append(adc.read(ctrl=0x00,nbytes=2))
+        assert np.allclose(adc.decode_raw(raw),ref)
+        assert np.allclose(i2c.decode_ads(raw,\
+            adc._conf_reg['PGA'][4][PGA],adc.BIT_DEPTH),ref)
+
+def test_decode_hih_matches_decode_data(bus):
+    bus.attach(sim.SimHIH8121(),0x27)
+    hih = i2c.HIH8121()
+    rows = np.random.default_rng(1).integers(0,256,(200,4),dtype=np.uint8)
+    (hum,temp,status) = hih.decode_raw(rows)
+    for (k,row) in enumerate(rows):
+        assert np.allclose((hum[k],temp[k],status[k]),\
+                           hih.decode_data([int(x) for x in row]))
+
+@pytest.mark.parametrize('temp',[-40.0,-5.25,0.0,0.0625,21.5,124.9375])
+def test_decode_mcp9808_matches_get(bus,temp):
+    bus.attach(sim.SimMCP9808(temp=temp),0x18)
+    mcp = i2c.MCP9808()
+    raw = mcp.read(ctrl=0x05,nbytes=2)
+    assert mcp.decode_raw([raw])[0] == mcp.get() == temp
+
+def test_decode_lsm_matches_get(bus):
+    bus.attach(sim.SimLSM9DS1_MAG(field=(0.1,0.2,-0.3)),0x1c)
+    bus.attach(sim.SimLSM9DS1_ACC(rate=(10.0,-20.0,30.0),\
+                                  acc=(0.5,-0.25,1.0),temp=30.0),0x6b)
+    mag = i2c.LSM9DS1_MAG(addr=0x1c)
+    acc = i2c.LSM9DS1_ACC(addr=0x6b)
+    vec = mag.get_vector(FS=4.0)
+    raw = mag.transaction(*mag._data_seg['XYZ'])[0]
+    assert np.allclose(mag.decode_raw([raw],FS=4.0)[0],vec)
+    (gyro,xl,temp) = acc.get_snapshot(FS_G=245.0,FS_XL=2.0)
+    raw = acc.transaction(*(acc._data_seg['G'] + acc._data_seg['XL']))
+    assert np.allclose(acc.decode_raw([raw[0]+raw[1]]*3,FS_G=245.0,\
+                                      FS_XL=2.0),[gyro+xl]*3)
@@ -0,0 +1,38 @@
+# Tests of the benchmark runner (see pyBench). Run with
+#   python -m pytest -q
+import json
+import pyBench as bench
+
+
+def test_run_case():
+    res = bench.run_case(bench.case_mcp,n=10)
+    assert res['transactions'] == 1.0
+    # address, command byte, address again and the three data bytes
+    assert res['bytes'] == 6.0
+    assert res['bus_time'] > 0 and res['cpu'] > 0
+
+def test_compare_flags_increases():
+    base = {'a':{'transactions':2.0,'bus_time':1e-3},\
+            'b':{'transactions':1.0,'bus_time':1e-3}}
+    results = {'a':{'transactions':2.05,'bus_time':0.9e-3},\
+               'b':{'transactions':1.0,'bus_time':1.2e-3},\
+               'c':{'transactions':9.0,'bus_time':1.0}}
+    # within the tolerance, better, or not in the baseline: no regression
+    assert bench.compare(results,base) == [('b','bus_time',1e-3,1.2e-3)]
+    assert len(bench.compare(results,base,tolerance=0.0)) == 2
+
+def test_baseline_covers_all_cases():
+    with open(bench.BASELINE) as f:
+        baseline = json.load(f)
+    assert sorted(baseline) == sorted(name for (name,setup) in bench.CASES)
+
+
+def test_saved_baseline_ends_with_newline(tmp_path):
+    filename = str(tmp_path/"baseline.json")
+    assert bench.main(['--save','--baseline',filename,'-n','1']) == 0
+    with open(filename) as f:
+        text = f.read()
+    assert text.endswith("}\n")
+    assert sorted(json.loads(text)) == sorted(n for (n,s) in bench.CASES)
+    with open(bench.BASELINE) as f:
+        assert f.read().endswith("}\n")
@@ -0,0 +1,279 @@
+# Behaviour tests of pyKraken on the simulated bus (see pySimBus). Run with
+#   python -m pytest -q
+import os
+import sys
+import time
+import types
+import numpy as np
+import pytest
+import py2C as i2c
+import pySimBus as sim
+import pyKraken as kraken
+
+
+# ---------- PACING ----------
+def test_deadline_grid():
+    timer = kraken.DeadlineTimer(0.005)
+    t = [timer.wait() for k in range(5)]
+    # deadlines on the grid, however long the loop body took
+    k = [int(round((x - timer.t0)/0.005)) for x in t]
+    assert t == [timer.t0 + i*0.005 for i in k]
+    assert k == sorted(set(k)) and k[-1] == 4 + timer.skipped
+    assert time.perf_counter() >= t[-1]
+
+def test_deadline_overrun():
+    timer = kraken.DeadlineTimer(0.005)
+    timer.wait()
+    time.sleep(0.02)
+    t = timer.wait()
+    # missed grid points are skipped, not caught up with
+    assert timer.overruns >= 1 and timer.skipped >= 3
+    assert t == timer.t0 + (timer.k - 1)*0.005
+
+def test_logger_lines_average_same_number_of_samples(bus,tmp_path,\
+                                                      monkeypatch):
+    bus.attach(sim.SimMCP9808(temp=-5.25),0x18)
+    logger = kraken.DataLogger(devices=[i2c.MCP9808()],meas_period=0.002,\
+                               avg_period=0.014,stats=('n',),format='bin',\
+                               path=str(tmp_path)+os.sep,echo=False)
+    calls = []
+    get = i2c.MCP9808.get
+    def stopping_get(self):
+        calls.append(self)
+        if len(calls) > 7*10:
+            raise KeyboardInterrupt
+        return get(self)
+    monkeypatch.setattr(i2c.MCP9808,'get',stopping_get)
+    with pytest.raises(KeyboardInterrupt):
+        logger.start_measurement_loop()
+    (header,rec) = kraken.read_binlog(os.path.join(str(tmp_path),\
+                                                   os.listdir(tmp_path)[0]))
+    assert len(rec) == 10
+    assert np.all(rec['n'] == 7)
+    assert np.all(rec[header['channels'][0]] == -5.25)
+
+
+# ---------- STREAMING STATISTICS ----------
+def test_stream_stats_match_numpy():
+    x = np.random.default_rng(0).normal(3.0,2.0,(500,4))
+    stats = kraken.StreamStats(4)
+    for row in x:
+        stats.add(row)
+    assert stats.n == 500
+    assert np.allclose(stats.mean,x.mean(axis=0))
+    assert np.allclose(stats.var,x.var(axis=0,ddof=1))
+    assert np.allclose(stats.get('std'),x.std(axis=0,ddof=1))
+    assert np.array_equal(stats.min,x.min(axis=0))
+    assert np.array_equal(stats.max,x.max(axis=0))
+    stats.reset()
+    stats.add(x[0])
+    assert np.array_equal(stats.mean,x[0])
+    assert np.array_equal(stats.var,np.zeros(4))
+
+
+# ---------- BINARY LOG ----------
+def test_binlog_round_trip(tmp_path):
+    channels = ['a','b','c']
+    sink = kraken.BinaryLogSink(str(tmp_path)+os.sep,\
+                                "log_{2:04}-{1:02}-{0:02}.bin",channels,\
+                                meta={'ncolumns':3})
+    t0 = time.time()
+    rows = [(t0+k,[k,2.5*k,-k],kraken.FLAG_TRIGGERED*(k%2)) \
+            for k in range(10)]
+    for (t,values,flags) in rows:
+        sink.write(t,values,flags)
+    sink.close()
+    (header,rec) = kraken.read_binlog(sink.filename)
+    assert header['channels'] == channels
+    assert header['meta'] == {'ncolumns':3}
+    assert len(rec) == 10
+    assert np.array_equal(rec['t'],[r[0] for r in rows])
+    assert np.array_equal(rec['b'],[r[1][1] for r in rows])
+    assert list(rec['flags']) == [r[2] for r in rows]
+    # a partly written record is cut off when appending
+    with open(sink.filename,'ab') as f:
+        f.write(b'\x00'*5)
+    sink.write(t0+10,[1,2,3])
+    sink.close()
+    (header,rec) = kraken.read_binlog(sink.filename)
+    assert len(rec) == 11 and rec['c'][-1] == 3
+
+
+# ---------- SEVERAL BUSES ----------
+def test_bus_reader():
+    buses = [sim.SimBus(),sim.SimBus()]
+    model = buses[0].attach(sim.SimMCP9808(temp=20.0),0x18)
+    buses[1].attach(sim.SimMCP9808(temp=30.0),0x18)
+    buses[1].attach(sim.SimLSM9DS1_MAG(field=(0.1,0.2,-0.3)),0x1c)
+    (m0,m1) = [i2c.MCP9808(bus=b) for b in buses]
+    mag = i2c.LSM9DS1_MAG(bus=buses[1],addr=0x1c)
+    reader = kraken.BusReader([m1,(mag,'z'),m0,(mag,'x')])
+    try:
+        # a worker per bus
+        assert len(reader._workers) == 2
+        t = time.time()
+        (t_row,values) = reader.read()
+        assert abs(t_row - t) < 1.0
+        assert values[0] == 30.0 and values[2] == 20.0
+        assert np.allclose(values[1::2],[-0.3,0.1],atol=4.0/2**15)
+        # errors on one bus reach the caller
+        buses[0].detach(model)
+        with pytest.raises(IOError):
+            reader.read()
+        buses[0].attach(model,0x18)
+        assert reader.read()[1][2] == 20.0
+    finally:
+        reader.close()
+    assert reader._workers == []
+
+
+# ---------- TRIGGERED TRACES ----------
+@pytest.fixture
+def devices(bus):
+    """ An ADC scanning two channels, a thermometer and a magnetometer. """
+    bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    bus.attach(sim.SimMCP9808(temp=-5.25),0x18)
+    bus.attach(sim.SimLSM9DS1_MAG(field=(0.1,0.2,-0.3)),0x1c)
+    adc = i2c.ADS1115(addr=0x48,cycle=[0b100,0b101])
+    adc.config(DR=7,PGA=2)
+    return [adc,i2c.MCP9808(),i2c.LSM9DS1_MAG(addr=0x1c)]
+
+def test_triggered_trace(devices):
+    pin = sim.SimPin()
+    t_edge = time.perf_counter()
+    pin.fire(t_edge)
+    (trace,stats) = kraken.triggered_trace(pin,devices,nmax=20)
+    names = kraken.column_names(devices)
+    assert trace.dtype.names == tuple(['t']+names)
+    assert len(trace) == stats['n'] == 20
+    assert trace['t'][0] >= 0 and np.all(np.diff(trace['t']) > 0)
+    # the ADC reads its channels in turn
+    assert np.allclose(trace[names[0]],[0.1,-0.2]*10,atol=1e-3)
+    assert np.all(trace[names[1]] == -5.25)
+    assert stats['latency'] >= 0
+
+def test_trace_trigger_timeout(devices):
+    (trace,stats) = kraken.triggered_trace(sim.SimPin(),devices,timeout=5,\
+                                           nmax=3)
+    assert len(trace) == 3 and stats['latency'] == None
+
+def test_wait_trigger_on_pin_number(monkeypatch):
+    gpio = types.ModuleType('RPi.GPIO')
+    (gpio.BCM,gpio.IN,gpio.RISING,gpio.FALLING,gpio.BOTH) = range(5)
+    gpio.getmode = lambda: gpio.BCM
+    gpio.setmode = gpio.setup = gpio.remove_event_detect = \
+        lambda *args: None
+    def add_event_detect(pin,edge,callback):
+        # the edge is caught right away, the wait returns much later
+        callback(pin)
+        time.sleep(0.05)
+    gpio.add_event_detect = add_event_detect
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = gpio
+    monkeypatch.setitem(sys.modules,'RPi',rpi)
+    monkeypatch.setitem(sys.modules,'RPi.GPIO',gpio)
+    monkeypatch.setattr(kraken,'gpio',gpio)
+    t = time.perf_counter()
+    t_edge = kraken.wait_trigger(17,timeout=1000)
+    assert t <= t_edge <= time.perf_counter() - 0.05
+
+def test_pretrigger_trace(devices):
+    pin = sim.SimPin()
+    t_edge = time.perf_counter() + 0.05
+    pin.fire(t_edge)
+    (trace,itrig,t) = kraken.pretrigger_trace(pin,devices,npre=5,npost=4,\
+                                               dt=0.002)
+    assert t == t_edge
+    assert len(trace) == 9 and itrig == 5
+    # times relative to the edge
+    assert np.all(trace['t'][:itrig] < 0) and np.all(trace['t'][itrig:] >= 0)
+    assert np.all(np.diff(trace['t']) > 0)
+    assert np.all(trace[kraken.column_names(devices)[1]] == -5.25)
+
+def test_pretrigger_timeout(devices):
+    (trace,itrig,t) = kraken.pretrigger_trace(sim.SimPin(),devices,npre=3,\
+                                               npost=2,timeout=5)
+    assert t == None
+    assert len(trace) == itrig + 2 and itrig <= 3
+
+
+# ---------- TRACE FILES ----------
+def test_trace_file_round_trip(tmp_path,devices):
+    filename = str(tmp_path/"trace.bin")
+    trace = kraken.create_trace_file(filename,devices,100)
+    trace['t'][0:40] = np.arange(40)*1e-3
+    name = kraken.column_names(devices)[1]
+    trace[name][0:40] = np.arange(40)
+    kraken.finish_trace_file(trace,40)
+    del trace
+    (trace,header) = kraken.open_trace(filename)
+    assert isinstance(trace,np.memmap)
+    assert header['length'] == len(trace) == 40
+    assert trace.dtype == kraken.trace_dtype(devices)
+    assert np.array_equal(trace[name],np.arange(40))
+    assert os.path.getsize(filename) == trace.offset + 40*trace.itemsize
+
+def test_interrupted_trace_keeps_samples(tmp_path,devices,monkeypatch):
+    filename = str(tmp_path/"trace.bin")
+    calls = []
+    get = i2c.MCP9808.get
+    def failing_get(self):
+        calls.append(self)
+        if len(calls) > 7:
+            raise KeyboardInterrupt
+        return get(self)
+    monkeypatch.setattr(i2c.MCP9808,'get',failing_get)
+    with pytest.raises(KeyboardInterrupt):
+        kraken.triggered_trace(None,devices,nmax=1000,filename=filename)
+    (trace,header) = kraken.open_trace(filename)
+    assert header['length'] == len(trace) == 7
+    assert np.all(trace[kraken.column_names(devices)[1]] == -5.25)
+
+
+# ---------- RAW CAPTURE ----------
+def test_raw_capture_matches_get_all(devices):
+    capture = kraken.RawCapture(devices,10)
+    for k in range(3):
+        capture.sample(time.perf_counter_ns())
+    ref = [x for d in devices for x in d.get_all()]
+    values = capture.values()
+    assert values.shape == (3,len(ref))
+    assert np.allclose(values,ref)
+    trace = capture.convert(capture.tns[0])
+    assert trace.dtype.names[1:] == tuple(kraken.column_names(\
+        capture.columns))
+    assert trace['t'][0] == 0.0 and np.all(np.diff(trace['t']) > 0)
+    # raw rows are a few bytes per device
+    assert capture.raw.shape == (10,2*2+2+6)
+
+def test_raw_capture_uses_settings_of_acquisition(devices):
+    adc = devices[0]
+    capture = kraken.RawCapture([adc],10)
+    capture.sample(0)
+    adc.config(PGA=0)
+    assert np.allclose(capture.values(),[[0.1,-0.2]],atol=1e-3)
+
+def test_raw_trace(devices):
+    (trace,stats) = kraken.triggered_trace(None,devices,nmax=20,raw=True)
+    assert len(trace) == stats['n'] == 20
+    assert np.all(np.diff(trace['t']) > 0)
+    assert np.allclose(trace[trace.dtype.names[3]],-5.25)
+
+def test_raw_capture_converts_in_chunks(devices):
+    capture = kraken.RawCapture(devices,50)
+    for k in range(37):
+        capture.sample(time.perf_counter_ns())
+    full = capture.convert()
+    out = np.zeros(50,dtype=full.dtype)
+    part = capture.convert(out=out,chunk=5)
+    assert len(part) == 37
+    assert np.array_equal(part,full)
+
+def test_raw_trace_to_file(tmp_path,devices):
+    filename = str(tmp_path/"raw.bin")
+    (trace,stats) = kraken.triggered_trace(None,devices,nmax=20,raw=True,\
+                                           filename=filename)
+    assert isinstance(trace,np.memmap) and len(trace) == 20
+    assert trace.dtype.names[1:] == tuple(kraken.column_names(\
+        [(d,k) for d in devices for k in range(len(d.outputs))]))
+    assert np.allclose(trace[trace.dtype.names[3]],-5.25)
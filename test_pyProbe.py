@@ -0,0 +1,53 @@
+# Tests of the bus instrumentation (see pyProbe). Run with
+#   python -m pytest -q
+import gc
+import pytest
+import py2C as i2c
+import pySimBus as sim
+import pyProbe as probe
+
+
+@pytest.fixture
+def probed():
+    """ Instrumentation enabled for the test, with no numbers yet. """
+    probe.reset()
+    probe.enable()
+    yield
+    probe.disable()
+    probe.reset()
+
+def test_switch_traffic_is_charged_to_device(bus,probed):
+    switch = bus.attach(sim.SimTCA9548A(),0x70)
+    bus.attach(sim.SimMCP9808(temp=20.0),behind=(switch,2))
+    tca = i2c.TCA9548A(addr=0x70)
+    tca.select(2)
+    mcp = i2c.MCP9808(group={'me':2,'channels':[2],'switch':tca})
+    tca.disable_all()
+    probe.reset()
+    assert [mcp.get() for k in range(3)] == [20.0]*3
+    stats = probe.snapshot()[i2c.device_name(mcp)]
+    assert stats['get']['calls'] == 3
+    # the switch is written once, then the route is cached
+    assert stats['mux']['calls'] == 1
+    assert stats['data']['calls'] == 3
+    assert stats['get']['ops'] == 1 + 3
+    # a switch byte, then command byte and three data bytes per reading
+    assert stats['get']['bytes'] == 1 + 3*4
+    assert sum(stats['get']['hist'].values()) == 3
+
+def test_numbers_go_with_device(bus,probed):
+    bus.attach(sim.SimMCP9808(),0x18)
+    mcp = i2c.MCP9808()
+    mcp.get()
+    name = i2c.device_name(mcp)
+    assert name in probe.snapshot()
+    del mcp
+    gc.collect()
+    assert name not in probe.snapshot()
+
+def test_disable_restores_classes():
+    get = i2c.MCP9808.get
+    probe.enable()
+    assert probe.enabled() and i2c.MCP9808.get is not get
+    probe.disable()
+    assert not probe.enabled() and i2c.MCP9808.get is get
@@ -0,0 +1,106 @@
+# Tests of the simulated bus and its chip models (see pySimBus). Run with
+#   python -m pytest -q
+import time
+import pytest
+import pySimBus as sim
+
+
+# ---------- BUS ----------
+def test_latency_accounting():
+    bus = sim.SimBus(sim.LatencyModel(t_trans=1e-4,t_byte=1e-5))
+    bus.attach(sim.SimMCP9808(),0x18)
+    bus.read_i2c_block_data(0x18,0x05,2)
+    bus.write_byte(0x18,0x05)
+    # address and command byte, then the data bytes
+    assert bus.transactions == 2
+    assert bus.nbytes == 5 + 2
+    assert bus.bus_time == pytest.approx(2*1e-4 + 7*1e-5)
+    bus.reset_stats()
+    assert (bus.transactions,bus.nbytes,bus.bus_time) == (0,0,0.0)
+
+def test_latency_for_clock():
+    latency = sim.LatencyModel.for_clock(100e3,t_trans=50e-6)
+    assert latency.cost(3) == pytest.approx(50e-6 + 27/100e3)
+
+def test_missing_device_and_collision():
+    bus = sim.SimBus()
+    with pytest.raises(IOError):
+        bus.read_byte(0x27)
+    (a,b) = (sim.SimHIH8121(),sim.SimHIH8121())
+    bus.attach(a)
+    bus.attach(b)
+    # writes reach both chips, reads collide
+    bus.write_quick(0x27)
+    assert a._t_done != None and b._t_done != None
+    with pytest.raises(IOError):
+        bus.read_byte(0x27)
+    bus.detach(b)
+    bus.read_byte(0x27)
+
+def test_devices_behind_switches():
+    bus = sim.SimBus()
+    tca = bus.attach(sim.SimTCA9548A(),0x70)
+    tca2 = bus.attach(sim.SimTCA9545A(),0x71,behind=(tca,1))
+    bus.attach(sim.SimMCP9808(temp=20.0),0x18,behind=(tca2,3))
+    with pytest.raises(IOError):
+        bus.read_i2c_block_data(0x18,0x05,2)
+    bus.write_byte(0x70,0b10)
+    bus.write_byte(0x71,0b1000)
+    assert bus.read_byte(0x71) == 0b1000
+    assert bus.read_i2c_block_data(0x18,0x05,2) == [0x01,0x40]
+    # cutting the upstream channel hides everything behind it
+    bus.write_byte(0x70,0b01)
+    with pytest.raises(IOError):
+        bus.read_i2c_block_data(0x18,0x05,2)
+
+
+# ---------- CHIP MODELS ----------
+def test_ads_single_shot():
+    bus = sim.SimBus()
+    model = bus.attach(sim.SimADS1115(inputs=(0.1,-0.2,0.3,0.4)),0x48)
+    # AIN1-GND, FS 2.048 V, single-shot at 860 SPS, start a conversion
+    conf = (1 << 15) | (0b101 << 12) | (2 << 9) | (1 << 8) | (7 << 5) | 0b11
+    bus.write_i2c_block_data(0x48,0x01,[conf >> 8,conf & 0xff])
+    # OS reads 0 until the conversion is done
+    assert bus.read_i2c_block_data(0x48,0x01,2)[0] >> 7 == 0
+    time.sleep(1.5*model.conversion_time())
+    assert bus.read_i2c_block_data(0x48,0x01,2)[0] >> 7 == 1
+    (MSb,LSb) = bus.read_i2c_block_data(0x48,0x00,2)
+    code = (MSb << 8) | LSb
+    assert code - 2**16 == round(-0.2/2.048*2**15)
+
+def test_ads1015_codes_are_left_justified():
+    model = sim.SimADS1015(inputs=(1.0,0.0,0.0,0.0))
+    model.regs[0x01] = (0b100 << 12) | (2 << 9) | (1 << 8)
+    assert model.convert() & 0xf == 0
+    assert model.convert() >> 4 == round(1.0/2.048*2**11)
+
+def test_hih_measurement_cycle():
+    bus = sim.SimBus()
+    bus.attach(sim.SimHIH8121(hum=40.0,temp=20.0))
+    bus.write_quick(0x27)
+    time.sleep(1.2*sim.SimHIH8121.T_MEAS)
+    data = bus.read_i2c_block_data(0x27,0x00,4)
+    assert data[0] >> 6 == 0
+    assert abs(100.0*(((data[0] & 0x3f) << 8) + data[1])/(2**14-2) - 40.0) \
+           < 0.01
+    # fetched before: stale
+    assert bus.read_i2c_block_data(0x27,0x00,4)[0] >> 6 == 1
+
+@pytest.mark.parametrize('temp',[-40.0,-5.25,0.0,21.5,124.9375])
+def test_mcp9808_temperature_register(temp):
+    bus = sim.SimBus()
+    bus.attach(sim.SimMCP9808(temp=temp))
+    (MSb,LSb) = bus.read_i2c_block_data(0x18,0x05,2)
+    code = ((MSb & 0x1f) << 8) | LSb
+    assert code - ((code & 0x1000) << 1) == temp*16
+
+def test_lsm_mag_burst():
+    bus = sim.SimBus()
+    bus.attach(sim.SimLSM9DS1_MAG(field=(1.0,-2.0,0.5)),0x1c)
+    # auto-increment with the MSb of the sub-address only
+    data = bus.read_i2c_block_data(0x1c,0x28|0x80,6)
+    codes = [(data[i] | (data[i+1] << 8)) for i in (0,2,4)]
+    codes = [c - 2**16 if c >= 2**15 else c for c in codes]
+    assert codes == [round(f/4.0*2**15) for f in (1.0,-2.0,0.5)]
+    assert len(set(bus.read_i2c_block_data(0x1c,0x28,6))) == 1